@@ -20,6 +20,7 @@ from PyQt5.QtWidgets import QApplication, QInputDialog, QMessageBox, QProgressDi
 from remedy.connect import BadHostKeyException, UnknownHostKeyException
 from remedy.connect import connect as sshconnect
 from remedy.gui.browser import FileBrowser
+from remedy.gui.browser.workers import Worker
 from remedy.gui.qmetadata import QRemarkableIndex, RemarkableIndex
 from remedy.remarkable.config import AppPaths, RemedyConfig, RemedyConfigException
 from remedy.remarkable.filesource import (
@@ -27,6 +28,9 @@ from remedy.remarkable.filesource import (
     LiveFileSourceSSH,
     LocalFileSource,
 )
+from remedy.remarkable.pdfbase import pageCache
+from remedy.remarkable.renderpool import renderService
+from remedy.remarkable.snapshot import IndexSnapshot, snapshotPath
 from remedy.utils import log, logging
 
 
@@ -36,6 +40,43 @@ def _mkIcon(fn):
     return icon
 
 
+def appPaths():
+    conf_dir = Path(QStandardPaths.standardLocations(QStandardPaths.ConfigLocation)[0])
+    old = conf_dir / 'remedy.json'
+    conf_dir = conf_dir / 'remedy'
+    conf_file = conf_dir / 'config.json'
+    conf_dir.mkdir(parents=True, exist_ok=True)
+    if old.is_file():  # migrate
+        log.warning("Old configuration file '%s' moved to '%s'.", old, conf_file)
+        old.rename(conf_file)
+    try:
+        cache_dir = Path(
+            QStandardPaths.standardLocations(QStandardPaths.CacheLocation)[0]
+        )
+    except Exception:
+        cache_dir = None
+
+    return AppPaths(conf_dir, conf_file, conf_dir / 'known_hosts', cache_dir)
+
+
+def openFileSource(stype, args):
+    # host should be assumed to be the address (unless specified otherwise)
+    if 'host' in args and not 'address' in args:
+        args['address'] = args['host']
+
+    if stype == 'local':
+        return LocalFileSource(
+            args.get('name'), args.get('documents'), args.get('templates')
+        )
+
+    ssh = sshconnect(**args)
+    if stype == 'ssh':
+        return LiveFileSourceSSH(ssh, **args)
+    elif stype == 'rsync':
+        return LiveFileSourceRsync(ssh, **args)
+    return None
+
+
 class RemedyApp(QApplication):
     _rootWindows = []  # this is a place to store top level windows
     # to avoid them being collected for going out of scope
@@ -59,14 +100,24 @@ class RemedyApp(QApplication):
         log.debug("Cache at '%s'", self.paths.cache_dir)
         log.debug("Known hosts at '%s'", self.paths.known_hosts)
 
+        processes = config.get('render_processes', 0)
+        if processes:
+            renderService.start(processes)
+            log.info('Rendering PDF pages in %d processes', processes)
+
         self.aboutToQuit.connect(self.cleanup)
         self.fsource = None
+        self.snapshot = None
 
     @pyqtSlot()
     def cleanup(self):
         log.info('Waiting for stray threads')
         QThreadPool.globalInstance().waitForDone()
         log.info('Done waiting')
+        renderService.shutdown()
+        pageCache.flush()
+        if self.snapshot:
+            self.snapshot.close()
         if self.fsource:
             self.fsource.cleanup()
             self.fsource.close()
@@ -82,24 +133,7 @@ class RemedyApp(QApplication):
         )
 
     def _makeAppPaths(self):
-        conf_dir = Path(
-            QStandardPaths.standardLocations(QStandardPaths.ConfigLocation)[0]
-        )
-        old = conf_dir / 'remedy.json'
-        conf_dir = conf_dir / 'remedy'
-        conf_file = conf_dir / 'config.json'
-        conf_dir.mkdir(parents=True, exist_ok=True)
-        if old.is_file():  # migrate
-            log.warning("Old configuration file '%s' moved to '%s'.", old, conf_file)
-            old.rename(conf_file)
-        try:
-            cache_dir = Path(
-                QStandardPaths.standardLocations(QStandardPaths.CacheLocation)[0]
-            )
-        except Exception:
-            cache_dir = None
-
-        self._paths = AppPaths(conf_dir, conf_file, conf_dir / 'known_hosts', cache_dir)
+        self._paths = appPaths()
 
     @property
     def paths(self):
@@ -272,8 +306,17 @@ class RemedyApp(QApplication):
         self.initDialog = None
         self.tree = FileBrowser(index)
         self.fsource = index.fsource  # for cleanup
+        self.snapshot = index.snapshot
         self.setQuitOnLastWindowClosed(True)
         log.info('Initialised, launching browser')
+        if index.fromSnapshot:
+            index.signals.changesRead.connect(self.applyChanges)
+            Worker(_reconcile, index).start()
+
+    @pyqtSlot(object)
+    def applyChanges(self, changes):
+        # Here on the GUI thread, so that the views never see the index changing
+        self.tree.index.applyChanges(changes)
 
     @pyqtSlot()
     def openSettings(self, prompt=True):
@@ -363,32 +406,19 @@ class RemedyInitWorker(QRunnable):
         self.signals.progress.emit(x, tot, txt)
 
     def run(self):
-        args = self.args
-
-        # host should be assumed to be the address (unless specified otherwise)
-        if 'host' in args and not 'address' in args:
-            args['address'] = args['host']
-
         app = QApplication.instance()
         fsource = None
         try:
             if self.stype == 'local':
                 self._progress(0, 0, 'Initialising...')
-                fsource = LocalFileSource(
-                    args.get('name'), args.get('documents'), args.get('templates')
-                )
             else:
                 self._progress(0, 0, 'Connecting...')
-                ssh = sshconnect(**args)
-                if self.stype == 'ssh':
-                    if app.paths.cache_dir is None:
-                        self.signals.error.emit(
-                            Exception('Error locating the cache folder')
-                        )
-                        return
-                    fsource = LiveFileSourceSSH(ssh, **args)
-                elif self.stype == 'rsync':
-                    fsource = LiveFileSourceRsync(ssh, **args)
+                if self.stype == 'ssh' and app.paths.cache_dir is None:
+                    self.signals.error.emit(
+                        Exception('Error locating the cache folder')
+                    )
+                    return
+            fsource = openFileSource(self.stype, self.args)
 
             if fsource is None:
                 self.signals.error.emit(
@@ -397,10 +427,19 @@ class RemedyInitWorker(QRunnable):
                 return
 
             T0 = time.perf_counter()
-            self._progress(0, 0, 'Fetching metadata')
-            fsource.prefetchMetadata(progress=self._progress)
+            spath = snapshotPath(fsource)
+            snapshot = IndexSnapshot(spath) if spath else None
+            if snapshot is None or snapshot.isEmpty():
+                self._progress(0, 0, 'Fetching metadata')
+                fsource.prefetchMetadata(progress=self._progress)
             self._progress(0, 0, 'Building index')
-            index = QRemarkableIndex(fsource, progress=self._progress)
+            index = QRemarkableIndex(
+                fsource,
+                progress=self._progress,
+                snapshot=snapshot,
+                compact=app.config.get('compact_index'),
+                writeBehind=app.config.get('write_behind'),
+            )
             self._progress(4, 4, 'Done')
             log.info('LOAD TIME: %f', time.perf_counter() - T0)
             self.signals.success.emit(index)
@@ -413,6 +452,14 @@ class RemedyInitWorker(QRunnable):
             self.signals.error.emit(e)
 
 
+def _reconcile(index):
+    # The index was loaded from its snapshot: catch up with the tablet
+    T0 = time.perf_counter()
+    index.fsource.prefetchMetadata()
+    index.signals.changesRead.emit(index.readChanges())
+    log.info('RECONCILE TIME: %f', time.perf_counter() - T0)
+
+
 def main():
     QCoreApplication.setAttribute(Qt.ApplicationAttribute.AA_EnableHighDpiScaling)
     log.setLevel(logging.INFO)
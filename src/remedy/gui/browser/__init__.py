@@ -19,6 +19,7 @@ from remedy.gui.browser.info import InfoPanel
 from remedy.gui.browser.search import *
 from remedy.gui.browser.workers import *
 from remedy.gui.export import exportDocument, webUIExport
+from remedy.gui.export.batch import exportBatch
 from remedy.gui.highlights import *
 from remedy.gui.notebookview import *
 from remedy.gui.qmetadata import *
@@ -40,7 +41,7 @@ class Actions:
         self.openBaseDoc = QAction('Open base document', parent)
         self.openBaseDoc.setShortcut('Ctrl+Shift+Enter')
         #
-        # if all non folders (for now)
+        # if any
         self.export = QAction('Export...', parent)
         self.export.setShortcut(QKeySequence.Save)
         self.export.setIcon(QIcon(':assets/16/export.svg'))
@@ -150,8 +151,7 @@ class Actions:
         self.openBaseDoc.setEnabled(
             singleSel and isinstance(e, Document) and e.hasBaseDocument()
         )
-        # self.export.setEnabled(not (empty or anyFolders)) # once implemented
-        self.export.setEnabled(singleSel and not anyFolders)
+        self.export.setEnabled(not empty)
         self.exportHighlights.setEnabled(not empty)
         self.upload.setEnabled(empty or (singleSel and allFolders and not anyDeleted))
         self.rename.setEnabled(singleSel)
@@ -453,10 +453,11 @@ class FileBrowser(QMainWindow):
 
     @pyqtSlot()
     def exportSelected(self):
-        # for now, later use selectedItems
-        entry = self.currentView().currentEntry()
-        if entry:
-            exportDocument(entry, self)
+        entries = self.currentView().selectedEntries()
+        if len(entries) == 1 and not entries[0].isFolder():
+            exportDocument(entries[0], self)
+        elif entries:
+            self._batchExport = exportBatch(entries, self)
 
     @pyqtSlot()
     def exportHighlightsSelected(self):
@@ -503,26 +504,26 @@ class FileBrowser(QMainWindow):
         if dest is not None:
             self.index.moveAll(uids, dest)
 
+    def _selectedUids(self):
+        return [item.entry().uid for item in self.tree.selectedItems() if item.entry()]
+
     @pyqtSlot()
     def deleteSelected(self):
-        for item in self.tree.selectedItems():
-            entry = item.entry()
-            if entry:
-                Worker(self.index.moveToTrash, entry.uid).start()
+        uids = self._selectedUids()
+        if uids:
+            Worker(self.index.moveAllToTrash, uids).start()
 
     @pyqtSlot()
     def pinSelected(self):
-        for item in self.tree.selectedItems():
-            entry = item.entry()
-            if entry:
-                Worker(lambda: self.index.update(entry.uid, pinned=True)).start()
+        uids = self._selectedUids()
+        if uids:
+            Worker(self.index.updateAll, uids, pinned=True).start()
 
     @pyqtSlot()
     def unpinSelected(self):
-        for item in self.tree.selectedItems():
-            entry = item.entry()
-            if entry:
-                Worker(lambda: self.index.update(entry.uid, pinned=False)).start()
+        uids = self._selectedUids()
+        if uids:
+            Worker(self.index.updateAll, uids, pinned=False).start()
 
     @pyqtSlot()
     def newFolderWith(self):
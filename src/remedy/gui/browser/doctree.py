@@ -308,6 +308,10 @@ class DocTree(QTreeWidget):
         index.signals.updateEntryPrepare.connect(self.updateEntryPrepare)
         index.signals.updateEntryComplete.connect(self.updateEntryComplete)
         index.signals.updateEntryError.connect(self.updateEntryError)
+        index.signals.removeEntryComplete.connect(self.removeEntryComplete)
+        index.signals.updateEntriesPrepare.connect(self.updateEntriesPrepare)
+        index.signals.updateEntriesComplete.connect(self.updateEntriesComplete)
+        index.signals.updateEntriesError.connect(self.updateEntriesError)
         self.index = index
 
         self._icon = {
@@ -384,7 +388,7 @@ class DocTree(QTreeWidget):
 
     _pending_item = {}
 
-    @pyqtSlot(str, int, dict, Path)
+    @pyqtSlot(str, object, dict, object)
     def newEntryPrepare(self, uid, etype, meta, path):
         op = NewEntryWorker.getWorkerFor(uid)
         item = self.itemOf(meta.get('parent', ROOT_ID))
@@ -406,7 +410,7 @@ class DocTree(QTreeWidget):
     def newEntryProgress(self, uid, done, tot):
         self._pending_item[uid].setProgress(done, tot)
 
-    @pyqtSlot(str, int, dict, Path)
+    @pyqtSlot(str, object, dict, object)
     def newEntryComplete(self, uid, etype, meta, path):
         self._nodes[uid] = i = self._pending_item[uid]
         del self._pending_item[uid]
@@ -414,7 +418,7 @@ class DocTree(QTreeWidget):
         i.setEntry(entry)
         i.idle()
 
-    @pyqtSlot(Exception, str, int, dict, Path)
+    @pyqtSlot(Exception, str, object, dict, object)
     def newEntryError(self, exception, uid, etype, meta, path=None):
         log.debug('New entry error: %s', exception)
         if isinstance(exception, NewEntryCancelled):
@@ -433,6 +437,10 @@ class DocTree(QTreeWidget):
 
     @pyqtSlot(str, dict, dict)
     def updateEntryComplete(self, uid, new_meta, new_cont):
+        if self._updateItem(uid, new_meta):
+            self.itemSelectionChanged.emit()
+
+    def _updateItem(self, uid, new_meta):
         item = self._nodes.get(uid)
         if item:
             entry = self.index.get(uid)
@@ -452,15 +460,50 @@ class DocTree(QTreeWidget):
                     )
                     log.error('Something went wrong in reparenting item')
             item.idle()
-            self.itemSelectionChanged.emit()
+        return item is not None
 
     @pyqtSlot(Exception, str, dict, dict)
     def updateEntryError(self, exception, uid, new_meta, new_cont):
+        if self._failItem(uid, exception):
+            self.itemSelectionChanged.emit()
+
+    def _failItem(self, uid, exception):
         item = self._nodes.get(uid)
         if item:
             item.setEntry(self.index.get(uid))
             msg = str(exception) or exception.__class__.__name__
             item.error('Failed to update item: %s' % msg)
+        return item is not None
+
+    @pyqtSlot(dict)
+    def updateEntriesPrepare(self, changes):
+        for uid in changes:
+            self.updateEntryPrepare(uid, changes[uid], {})
+
+    @pyqtSlot(dict)
+    def updateEntriesComplete(self, changes):
+        self.setUpdatesEnabled(False)
+        try:
+            updated = [self._updateItem(uid, meta) for uid, meta in changes.items()]
+        finally:
+            self.setUpdatesEnabled(True)
+        if any(updated):
+            self.itemSelectionChanged.emit()
+
+    @pyqtSlot(Exception, dict)
+    def updateEntriesError(self, exception, changes):
+        failed = [self._failItem(uid, exception) for uid in changes]
+        if any(failed):
+            self.itemSelectionChanged.emit()
+
+    @pyqtSlot(str)
+    def removeEntryComplete(self, uid):
+        item = self._nodes.pop(uid, None)
+        if item:
+            pi = item.parent()
+            if pi is None:
+                pi = self.invisibleRootItem()
+            pi.removeChild(item)
             self.itemSelectionChanged.emit()
 
     @pyqtSlot(QTreeWidgetItem, int)
@@ -12,6 +12,7 @@ from PyQt5.QtCore import (
 )
 from PyQt5.QtGui import QContextMenuEvent, QIcon, QKeySequence
 from PyQt5.QtWidgets import (
+    QApplication,
     QHBoxLayout,
     QHeaderView,
     QLineEdit,
@@ -21,9 +22,38 @@ from PyQt5.QtWidgets import (
 )
 
 from remedy.gui.browser.delegates import PinnedDelegate
+from remedy.gui.browser.workers import Worker
 from remedy.remarkable.metadata import RemarkableError
+from remedy.remarkable.tags import TagQueryError
+from remedy.remarkable.textindex import (
+    TextIndex,
+    documentPages,
+    indexLibrary,
+    textIndexPath,
+)
 from remedy.utils import log
 
+# Search queries starting with this are about tags, see TagIndex.query
+TAGS_PREFIX = 'tags:'
+
+
+class UidFilterProxyModel(QSortFilterProxyModel):
+    """Keeps only the rows of the given uids (all of them if None)."""
+
+    def __init__(self):
+        QSortFilterProxyModel.__init__(self)
+        self._uids = None
+
+    def setUids(self, uids):
+        self._uids = None if uids is None else set(uids)
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, row, parent):
+        if self._uids is None:
+            return True
+        i = self.sourceModel().index(row, 0, parent)
+        return self.sourceModel().data(i, Qt.ItemDataRole.UserRole) in self._uids
+
 
 class FlatRemarkableIndexModel(QAbstractTableModel):
     _fadedColor = Qt.GlobalColor.black
@@ -34,6 +64,8 @@ class FlatRemarkableIndexModel(QAbstractTableModel):
         self._uids = list(index.allUids())
         index.signals.newEntryComplete.connect(self.newEntry)
         index.signals.updateEntryComplete.connect(self.updateEntry)
+        index.signals.removeEntryComplete.connect(self.removeEntry)
+        index.signals.updateEntriesComplete.connect(self.updateEntries)
         self._icon = {
             'trash': QIcon(':assets/24/trash.svg'),
             'folder': QIcon(':assets/24/folder.svg'),
@@ -42,6 +74,9 @@ class FlatRemarkableIndexModel(QAbstractTableModel):
             'notebook': QIcon(':assets/24/notebook.svg'),
             'unknown': QIcon(':assets/24/unknown.svg'),
         }
+        self._textHits = {}
+        self._filterTags = UidFilterProxyModel()
+        self._filterText = UidFilterProxyModel()
         self._filterName = QSortFilterProxyModel()
         self._filterType = QSortFilterProxyModel()
         self._filterType.setFilterRole(Qt.ItemDataRole.UserRole + 1)
@@ -56,7 +91,9 @@ class FlatRemarkableIndexModel(QAbstractTableModel):
         # self._starred = QIcon(":assets/symbolic/starred.svg")
 
     def refresh(self):
-        self._filterName.setSourceModel(self)
+        self._filterTags.setSourceModel(self)
+        self._filterText.setSourceModel(self._filterTags)
+        self._filterName.setSourceModel(self._filterText)
         self._filterType.setSourceModel(self._filterName)
         self._filterTrash.setSourceModel(self._filterType)
         self._filterPinned.setSourceModel(self._filterTrash)
@@ -92,6 +129,14 @@ class FlatRemarkableIndexModel(QAbstractTableModel):
                 return -int(entry.lastModified or 0)
 
         if role == Qt.ItemDataRole.ToolTipRole:
+            hit = self._textHits.get(uid)
+            if hit:
+                pages = documentPages(entry, hit.pages)
+                return '%s\nPages %s: %s' % (
+                    self._index.fullPathOf(uid),
+                    ', '.join(str(p + 1) for p in pages[:20]),
+                    ' '.join(hit.snippet.split()),
+                )
             return self._index.fullPathOf(uid)
         elif role == Qt.ItemDataRole.ForegroundRole:
             if entry.isIndirectlyDeleted():
@@ -152,13 +197,21 @@ class FlatRemarkableIndexModel(QAbstractTableModel):
     def filterName(self, query):
         self._filterName.setFilterWildcard(query)
 
+    def filterText(self, hits):
+        # TextHits of a full-text search, or None to show everything
+        self._textHits = {hit.uid: hit for hit in hits or []}
+        self._filterText.setUids(None if hits is None else self._textHits)
+
+    def filterTags(self, uids):
+        self._filterTags.setUids(uids)
+
     def filterType(self, query):
         self._filterType.setFilterRegExp(query)
 
     def setCaseSensitivity(self, b):
         self._filterName.setFilterCaseSensitivity(b)
 
-    @pyqtSlot(str, int, dict, object)
+    @pyqtSlot(str, object, dict, object)
     def newEntry(self, uid, meta, pth):
         r = len(self._uids)
         self.beginInsertRows(QModelIndex(), r, r)
@@ -181,6 +234,31 @@ class FlatRemarkableIndexModel(QAbstractTableModel):
             ],
         )
 
+    @pyqtSlot(dict)
+    def updateEntries(self, changes):
+        rows = [i for i, uid in enumerate(self._uids) if uid in changes]
+        if rows:
+            self.dataChanged.emit(
+                self.createIndex(rows[0], 0),
+                self.createIndex(rows[-1], 3),
+                [
+                    Qt.ItemDataRole.ToolTipRole,
+                    Qt.ItemDataRole.ForegroundRole,
+                    Qt.ItemDataRole.UserRole + 1,
+                    Qt.ItemDataRole.UserRole + 2,
+                    Qt.ItemDataRole.UserRole + 3,
+                    Qt.ItemDataRole.DisplayRole,
+                ],
+            )
+
+    @pyqtSlot(str)
+    def removeEntry(self, uid):
+        if uid in self._uids:
+            i = self._uids.index(uid)
+            self.beginRemoveRows(QModelIndex(), i, i)
+            del self._uids[i]
+            self.endRemoveRows()
+
     def entryOf(self, uid):
         try:
             return self._index.get(uid)
@@ -193,6 +271,7 @@ class SearchResults(QTreeView):
     itemSelectionChanged = pyqtSignal()
     queryChanged = pyqtSignal(str)
     contextMenu = pyqtSignal(QContextMenuEvent)
+    textIndexed = pyqtSignal()
 
     def __init__(self, index, parent=None):
         QTreeView.__init__(self, parent=parent)
@@ -200,6 +279,10 @@ class SearchResults(QTreeView):
         self._index_model.setTextColor(self.palette().text().color())
         self.setModel(self._index_model.proxy())
         self._query = None
+        self._textIndex = None
+        self._textSearch = False
+        self._stopIndexing = False
+        self.textIndexed.connect(self._refreshText)
         # self.setWindowFlags(Qt.FramelessWindowHint | Qt.Tool);
         # self.setAttribute(Qt.WA_ShowWithoutActivating)
         self.setIconSize(QSize(24, 24))
@@ -219,6 +302,9 @@ class SearchResults(QTreeView):
         act.triggered.connect(self.setCaseSensitivity)
         # act.setChecked(True)
         # act.setChecked(False)
+        self._textToggle = act = menu.addAction('Search in text')
+        act.setCheckable(True)
+        act.triggered.connect(self.setTextSearch)
         menu.addSeparator()
         self._pdfToggle = act = menu.addAction('PDF')
         act.setIcon(QIcon(':assets/16/pdf.svg'))
@@ -278,9 +364,71 @@ class SearchResults(QTreeView):
         if self._query != txt:
             log.debug('Setting query %s', txt)
             self._query = txt
-            self._index_model.filterName(txt)
+            self._applyQuery()
             self.queryChanged.emit(txt)
 
+    def _applyQuery(self):
+        txt = self._query
+        if txt and txt.startswith(TAGS_PREFIX):
+            # A query on the tags, the rest of the filters showing everything
+            try:
+                uids = self._index_model._index.tags.query(txt[len(TAGS_PREFIX) :])
+            except TagQueryError as e:
+                log.debug('Incomplete tag query: %s', e)
+                return  # while typing, keep the last results
+            self._index_model.filterTags(uids)
+            self._index_model.filterText(None)
+            self._index_model.filterName(None)
+            return
+        self._index_model.filterTags(None)
+        if self._textSearch and txt:
+            self._index_model.filterName(None)
+            self._index_model.filterText(self._textIndex.search(txt))
+        else:
+            self._index_model.filterText(None)
+            self._index_model.filterName(txt)
+
+    def setTextSearch(self, b):
+        """Searches the text of the documents instead of their names."""
+        self._textSearch = b
+        self._textToggle.setChecked(b)
+        if b and self._textIndex is None:
+            self._startTextIndex()
+        self._applyQuery()
+
+    def _startTextIndex(self):
+        index = self._index_model._index
+        app = QApplication.instance()
+        filename = textIndexPath(index.fsource, app.paths.cache_dir)
+        if filename is None:
+            # Without a cache the text is extracted again at every session
+            self._textIndex = TextIndex()
+        else:
+            self._textIndex = TextIndex(filename)
+        app.aboutToQuit.connect(self._cancelIndexing)
+
+        def progress(done, total):
+            # Results get refreshed as the documents are indexed
+            if done % 20 == 0 or done == total:
+                self.textIndexed.emit()
+
+        Worker(
+            indexLibrary,
+            index,
+            self._textIndex,
+            progress=progress,
+            cancelled=lambda: self._stopIndexing,
+        ).start()
+
+    @pyqtSlot()
+    def _cancelIndexing(self):
+        self._stopIndexing = True
+
+    @pyqtSlot()
+    def _refreshText(self):
+        if self._textSearch and self._query:
+            self._applyQuery()
+
     def showDeleted(self, b):
         self._index_model.filterTrash(not b)
         self._trashToggle.setChecked(b)
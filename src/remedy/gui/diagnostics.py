@@ -0,0 +1,127 @@
+import argparse
+import os
+import sys
+import time
+
+from PyQt5.QtWidgets import QApplication
+
+from remedy.remarkable.export import peakMemory
+from remedy.remarkable.journal import KINDS, MOVED, RENAMED, diffSource
+from remedy.utils import log
+
+
+def printFootprint(index, out=sys.stdout):
+    usage = index.footprint()
+    tags = usage.pop('tags')
+    count = sum(c for c, _ in usage.values())
+    total = sum(b for _, b in usage.values())
+    print('%-10s %8s %12s %10s' % ('type', 'entries', 'bytes', 'per entry'), file=out)
+    for name, (c, b) in sorted(usage.items()):
+        print('%-10s %8d %12d %10d' % (name, c, b, b // c), file=out)
+    print('%-10s %8d %12d %10d' % ('all', count, total, total // count), file=out)
+    print('%-10s %8d %12d' % ('tags', tags[0], tags[1]), file=out)
+
+
+def printJournal(journal, out=sys.stdout):
+    for change in journal:
+        if change.kind in (MOVED, RENAMED):
+            detail = '%r -> %r' % (change.old, change.new)
+        else:
+            meta = change.new if change.new is not None else change.old
+            detail = repr(meta.get('visibleName', change.uid))
+        print('%-8s %s %s' % (change.kind, change.uid, detail), file=out)
+    kinds = [c.kind for c in journal]
+    print(', '.join('%d %s' % (kinds.count(k), k) for k in KINDS), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='remedy-diagnostics',
+        description='Report on the index of a reMarkable source.',
+    )
+    parser.add_argument('-s', '--source', help='source id from the configuration')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        '--compact',
+        dest='compact',
+        action='store_true',
+        default=None,
+        help='build the index in compact mode',
+    )
+    mode.add_argument(
+        '--no-compact',
+        dest='compact',
+        action='store_false',
+        help='build the index in normal mode',
+    )
+    parser.add_argument(
+        '--changes',
+        action='store_true',
+        help='list what changed on the tablet since the index was last saved',
+    )
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = QApplication(sys.argv[:1])
+    app.setOrganizationDomain('michaelmera.com')
+    app.setApplicationName('remedy')
+
+    # Imported here since the app module pulls in the whole browser
+    from remedy.gui.app import appPaths, openFileSource
+    from remedy.remarkable.config import RemedyConfig, RemedyConfigException
+    from remedy.remarkable.metadata import RemarkableIndex
+    from remedy.remarkable.snapshot import IndexSnapshot, snapshotPath
+
+    try:
+        config = RemedyConfig(paths=appPaths())
+        log.setLevel(config.logLevel())
+        source = args.source or config.get('default_source')
+        if not source:
+            raise RemedyConfigException('No source selected.')
+        config.selectSource(source)
+    except RemedyConfigException as e:
+        log.fatal('Misconfiguration: %s', str(e))
+        return 1
+
+    fsource = openFileSource(*config.connectionArgs())
+    if fsource is None:
+        log.fatal('Could not find the reMarkable data!')
+        return 1
+
+    compact = config.get('compact_index') if args.compact is None else args.compact
+    try:
+        if args.changes:
+            spath = snapshotPath(fsource)
+            if spath is None or not os.path.isfile(spath):
+                log.fatal('The index of %s was never saved', source)
+                return 1
+            snapshot = IndexSnapshot(spath)
+            try:
+                journal = diffSource(fsource, snapshot)
+            finally:
+                snapshot.close()
+            if journal is None:
+                log.fatal('The files of %s cannot be listed', source)
+                return 1
+            printJournal(journal)
+            return 0
+
+        fsource.prefetchMetadata()
+        T0 = time.perf_counter()
+        index = RemarkableIndex(fsource, compact=compact)
+        print(
+            'Index of %s (%s mode), built in %.2fs'
+            % (source, 'compact' if compact else 'normal', time.perf_counter() - T0)
+        )
+        printFootprint(index)
+        peak = peakMemory()
+        if peak:
+            print('Peak memory: %d MB' % (peak // 2**20))
+        return 0
+    finally:
+        fsource.cleanup()
+        fsource.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
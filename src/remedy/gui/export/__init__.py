@@ -95,6 +95,7 @@ def exportDocument(doc, parent=None):
     )
     if ok:
         op = ExportOperation(parent=parent)
+        opt.pop('max_jobs', None)
         if opt.pop('open_exported', True):
             op.success.connect(
                 lambda: QDesktopServices.openUrl(QUrl('file://' + filename))
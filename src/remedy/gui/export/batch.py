@@ -0,0 +1,229 @@
+import argparse
+import os
+import signal
+import sys
+from os import path
+
+from PyQt5.QtCore import QObject, QUrl, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QDesktopServices
+from PyQt5.QtWidgets import QApplication, QMessageBox, QProgressDialog
+
+from remedy.gui.export.options import ExportDialog
+from remedy.remarkable.batch import BatchExporter, batchJobs
+from remedy.remarkable.export import CancelledExporter, peakMemory
+from remedy.remarkable.metadata import ROOT_ID
+from remedy.remarkable.mirror import LibraryMirror
+from remedy.remarkable.raster import DEVICE_DPI, RASTER_FORMATS, rasterize
+from remedy.utils import log
+
+
+class BatchExportOperation(QObject):
+    success = pyqtSignal()
+
+    def run(self, jobs, max_jobs=2, **options):
+        self.jobs = len(jobs)
+        self.dialog = QProgressDialog(parent=self.parent())
+        self.dialog.setWindowTitle('Exporting %d documents' % self.jobs)
+        self.dialog.setLabelText('Initialising...')
+        self.dialog.setMinimumDuration(500)
+        self.dialog.setAutoClose(False)
+        batch = self.batch = BatchExporter(
+            jobs, max_jobs=max_jobs, parent=self, **options
+        )
+        batch.onStart.connect(self.dialog.setMaximum)
+        batch.onProgress.connect(self.onProgress)
+        batch.onJobStart.connect(self.onJobStart)
+        batch.onFinished.connect(self.onFinished)
+        self.dialog.canceled.connect(batch.cancel)
+        batch.start()
+
+    @pyqtSlot(int, int)
+    def onProgress(self, done, total):
+        # The total is known better once the documents are opened
+        if total != self.dialog.maximum():
+            self.dialog.setMaximum(total)
+        self.dialog.setValue(done)
+
+    @pyqtSlot(str, str)
+    def onJobStart(self, uid, filename):
+        self.dialog.setLabelText(
+            'Exporting %d of %d:\n%s...'
+            % (self.batch.finishedCount() + 1, self.jobs, path.basename(filename))
+        )
+
+    @pyqtSlot(int, int)
+    def onFinished(self, succeeded, failed):
+        self.dialog.close()
+        errors = [
+            job
+            for job in self.batch.failed
+            if not isinstance(job.error, CancelledExporter)
+        ]
+        if errors:
+            QMessageBox.critical(
+                self.parent(),
+                'Error',
+                'Some documents could not be exported.\n\n'
+                + '\n'.join(
+                    f'{job.document.visibleName}: {job.error}' for job in errors
+                ),
+            )
+        elif failed == 0:
+            self.success.emit()
+
+
+def exportBatch(entries, parent=None):
+    opt = QApplication.instance().config.export
+    dest, whichPages, opt, ok = ExportDialog.getFolderExportOptions(
+        options=opt, parent=parent
+    )
+    if ok:
+        jobs = batchJobs(entries[0].index, [e.uid for e in entries], dest, whichPages)
+        if not jobs:
+            QMessageBox.information(parent, 'Export', 'There is nothing to export.')
+            return None
+        op = BatchExportOperation(parent=parent)
+        if opt.pop('open_exported', True):
+            op.success.connect(lambda: QDesktopServices.openUrl(QUrl('file://' + dest)))
+        op.run(jobs, **opt)
+        return op
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='remedy-export',
+        description='Export documents from a reMarkable source without opening the GUI.',
+    )
+    parser.add_argument('destination', help='folder where the PDFs are saved')
+    parser.add_argument(
+        'uids', nargs='*', help='documents or folders to export (default: all)'
+    )
+    parser.add_argument('-s', '--source', help='source id from the configuration')
+    parser.add_argument('-j', '--jobs', type=int, help='number of parallel exports')
+    parser.add_argument('-p', '--pages', default='', help='page ranges to export')
+    parser.add_argument(
+        '-m',
+        '--mirror',
+        action='store_true',
+        help='only export what changed since the last mirror of the same folder',
+    )
+    parser.add_argument(
+        '-r',
+        '--raster',
+        choices=sorted(RASTER_FORMATS),
+        help='export every page as an image instead of a PDF per document',
+    )
+    parser.add_argument(
+        '--dpi', type=int, default=DEVICE_DPI, help='resolution of the images'
+    )
+    parser.add_argument(
+        '--tile',
+        type=int,
+        help='split the images in tiles of at most TILE pixels per side',
+    )
+    parser.add_argument(
+        '--memory-budget',
+        type=int,
+        metavar='MB',
+        help='merge PDFs in chunks that fit in MB megabytes (per document)',
+    )
+    args = parser.parse_args(argv)
+    if args.mirror and len(args.uids) > 1:
+        parser.error('--mirror takes at most one folder')
+    if args.mirror and args.raster:
+        parser.error('--mirror only supports PDF exports')
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = QApplication(sys.argv[:1])
+    app.setOrganizationDomain('michaelmera.com')
+    app.setApplicationName('remedy')
+
+    # Imported here since the app module pulls in the whole browser
+    from remedy.gui.app import appPaths, openFileSource
+    from remedy.remarkable.config import RemedyConfig, RemedyConfigException
+    from remedy.remarkable.metadata import RemarkableIndex
+
+    try:
+        config = RemedyConfig(paths=appPaths())
+        log.setLevel(config.logLevel())
+        source = args.source or config.get('default_source')
+        if not source:
+            raise RemedyConfigException('No source selected.')
+        config.selectSource(source)
+    except RemedyConfigException as e:
+        log.fatal('Misconfiguration: %s', str(e))
+        return 1
+
+    fsource = openFileSource(*config.connectionArgs())
+    if fsource is None:
+        log.fatal('Could not find the reMarkable data!')
+        return 1
+
+    try:
+        fsource.prefetchMetadata()
+        index = RemarkableIndex(fsource, compact=config.get('compact_index'))
+        opt = config.export
+        opt.pop('default_dir', None)
+        opt.pop('open_exported', None)
+        max_jobs = args.jobs or opt.pop('max_jobs', 2)
+        opt.pop('max_jobs', None)
+        budget = opt.pop('memory_budget', 0)
+        if args.memory_budget is not None:
+            budget = args.memory_budget
+
+        mirror = None
+        if args.mirror:
+            root = args.uids[0] if args.uids else ROOT_ID
+            mirror = LibraryMirror(
+                index, args.destination, root, whichPages=args.pages, **opt
+            )
+            plan = mirror.plan()
+            log.info('Mirror: %s', plan)
+            jobs = mirror.apply(plan)
+        else:
+            jobs = batchJobs(
+                index, args.uids or [ROOT_ID], args.destination, args.pages
+            )
+        log.info('Exporting %d documents to %s', len(jobs), args.destination)
+        if args.raster:
+            stats = rasterize(
+                jobs,
+                args.raster,
+                dpi=args.dpi,
+                tile=args.tile,
+                workers=max_jobs,
+                progress=lambda i, t: log.info('Rasterised %d/%d pages', i, t),
+                **opt,
+            )
+            log.info(
+                'Rasterised %d pages into %d files in %.1fs (%.2f pages/s)',
+                stats.pages,
+                stats.files,
+                stats.seconds,
+                stats.pages / stats.seconds if stats.seconds else 0,
+            )
+            return 1 if stats.failed else 0
+
+        batch = BatchExporter(jobs, max_jobs=max_jobs, memory_budget=budget, **opt)
+        batch.onJobSuccess.connect(lambda uid, fn: log.info('Exported %s', fn))
+        if mirror is not None:
+            batch.onJobSuccess.connect(mirror.exported)
+            batch.onFinished.connect(lambda ok, ko: mirror.save())
+        batch.onFinished.connect(lambda ok, ko: app.exit(1 if ko else 0))
+        signal.signal(signal.SIGINT, lambda *a: batch.cancel())
+        batch.start()
+        ret = app.exec_() if batch.isRunning() else (1 if batch.failed else 0)
+        if mirror is not None:
+            mirror.save()
+        peak = peakMemory()
+        if peak:
+            log.info('Peak memory: %d MB', peak // 2**20)
+        return ret
+    finally:
+        fsource.cleanup()
+        fsource.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
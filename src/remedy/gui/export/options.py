@@ -12,6 +12,7 @@ from PyQt5.QtWidgets import (
     QFormLayout,
     QHBoxLayout,
     QLineEdit,
+    QSpinBox,
     QVBoxLayout,
 )
 
@@ -39,6 +40,17 @@ class ExportDialog(QDialog):
         else:
             return (None, '', options, False)
 
+    @staticmethod
+    def getFolderExportOptions(parent=None, options={}, **kwargs):
+        d = ExportDialog(
+            mode=ExportDialog.FolderExport, options=options, parent=parent, **kwargs
+        )
+        res = d.exec_()
+        if res == QDialog.Accepted:
+            return (*d.getOptions(), True)
+        else:
+            return (None, '', options, False)
+
     def __init__(self, filename=None, options={}, mode=None, **kwargs):
         super().__init__(**kwargs)
         self.mode = ExportDialog.FileExport if mode is None else mode
@@ -81,9 +93,18 @@ class ExportDialog(QDialog):
         form.addRow('Export to:', pathsel)
 
         # OPEN EXPORTED
-        self.openExp = QCheckBox('Open file on completion')
+        if self.mode == ExportDialog.FileExport:
+            self.openExp = QCheckBox('Open file on completion')
+        else:
+            self.openExp = QCheckBox('Open folder on completion')
         form.addRow('', self.openExp)
 
+        # CONCURRENT JOBS
+        maxJobs = self.maxJobs = QSpinBox()
+        maxJobs.setRange(1, 16)
+        if self.mode == ExportDialog.FolderExport:
+            form.addRow('Parallel jobs:', maxJobs)
+
         # ORIENTATION
         orient = self.orientation = QComboBox()
         orient.addItem('Auto', 'auto')
@@ -191,9 +212,10 @@ class ExportDialog(QDialog):
                 self, 'Export PDF...', self.pathsel.text(), 'PDF (*.pdf)'
             )
         else:
-            filename, ok = QFileDialog.getExistingDirectory(
-                self, 'Export PDF...', self.pathsel.text()
+            filename = QFileDialog.getExistingDirectory(
+                self, 'Export PDFs to...', self.pathsel.text()
             )
+            ok = bool(filename)
         if ok and filename:
             self.pathsel.setText(filename)
 
@@ -216,8 +238,14 @@ class ExportDialog(QDialog):
 
     @pyqtSlot(bool)
     def reset(self, *args):
-        self.pathsel.setText(self.filename or 'Document.pdf')
+        if self.mode == ExportDialog.FileExport:
+            self.pathsel.setText(self.filename or 'Document.pdf')
+        else:
+            self.pathsel.setText(
+                self.filename or self.options.get('default_dir') or path.expanduser('~')
+            )
         self.openExp.setChecked(self.options.get('open_exported', False))
+        self.maxJobs.setValue(self.options.get('max_jobs', 2))
         self.pageRanges.clear()
         self.exclLayers.clear()  # makes little sense to get it from args
 
@@ -268,5 +296,7 @@ class ExportDialog(QDialog):
                 'draw_hl_below': self.hl_below.isChecked(),
                 'exclude_layers': parseExcludeLayers(self.exclLayers.text()),
                 'pencil_resolution': self.pencilMode.currentData(),
+                'max_jobs': self.maxJobs.value(),
+                'memory_budget': self.options.get('memory_budget', 0),
             },
         )
@@ -41,6 +41,11 @@ from remedy.remarkable.metadata import Page
 from remedy.remarkable.render import PageGraphicsItem
 from remedy.utils import log
 
+# Base PDFs are shown at twice the size of the canvas.
+# A quick, coarser rendering is shown first while the sharp one is made.
+BASE_MULT = 2
+BASE_PREVIEW_MULT = 0.5
+
 
 class Actions:
     def __init__(self, parent=None):
@@ -118,6 +123,7 @@ class NotebookView(QGraphicsView):
         self._rotation = 0  # used to produce a rotated screenshot
 
         self._page_cache = {}
+        self._loads = {}  # page -> pending AsyncPageLoad
         self._page = 0
         self._templates = {}
         self._maxPage = document.num_pages() - 1
@@ -160,7 +166,12 @@ class NotebookView(QGraphicsView):
         # pres = self.options.get("pencil_resolution", 0.4)
         # pal = self.options.get("palette", {})
         # scene = self.makePageScene(i, eraser_mode=ermode, pencil_resolution=pres, palette=pal)
+        # Refining pages we left is wasted work
+        for j in [j for j in self._loads if j != i]:
+            self._loads.pop(j).cancel()
         scene = self.makePageScene(i, **self.options)
+        if scene.pageItem is not None and not scene.refined and i not in self._loads:
+            self._startLoad(i, scene.pageItem, scene.page)
         self.setScene(scene)
         old_page = self._page
         self._page = i
@@ -182,31 +193,63 @@ class NotebookView(QGraphicsView):
         # lw = scene.loadingItem.boundingRect().width()
         # scene.loadingItem.setPos(r.rect().center() - QPointF(lw/2,12))
         scene.loadingItem.setPos(r.rect().center())
+        scene.page = None
+        scene.pageItem = None
+        scene.baseItem = None
+        scene.refined = False
+
+        old = self._loads.pop(i, None)
+        if old:
+            old.cancel()
+        self._startLoad(i, **options)
+        return scene
 
-        w = AsyncPageLoad(self._document, i, **options)
+    def _startLoad(self, i, item=None, page=None, **options):
+        w = self._loads[i] = AsyncPageLoad(self._document, i, item, page, **options)
         w.signals.pageReady.connect(self.pageReady)
         QThreadPool.globalInstance().start(w)
-        return scene
 
-    @pyqtSlot(Page, PageGraphicsItem, QImage)
-    def pageReady(self, page, pitem, img):
-        scene = self._page_cache[page.pageNum]
+    @pyqtSlot(Page, PageGraphicsItem, QImage, bool)
+    def pageReady(self, page, pitem, img, final):
+        # A page can be updated a second time, with a sharper base PDF
+        i = page.pageNum
+        scene = self._page_cache[i]
+        if final and self._loads.get(i) is self.sender().job:
+            del self._loads[i]
+        if scene.pageItem is not None:
+            if scene.pageItem is pitem:
+                if img:
+                    self._setBaseImage(scene, img, BASE_MULT)
+                scene.refined = final
+            return
+
         if page.background and page.background.name != 'Blank':
             img = self.imageOfBackground(page.background)
             if img:
                 scene.baseItem = QGraphicsPixmapItem(QPixmap(img), scene.pageRect)
         elif img:
-            img = QGraphicsPixmapItem(QPixmap(img), scene.pageRect)
-            img.setTransformationMode(Qt.TransformationMode.SmoothTransformation)
-            img.setScale(1 / 2)
-            scene.baseItem = img
-        else:
-            scene.baseItem = None
+            self._setBaseImage(scene, img, BASE_MULT if final else BASE_PREVIEW_MULT)
+        scene.page = page
+        scene.pageItem = pitem
+        scene.refined = final
         scene.removeItem(scene.loadingItem)
         pitem.setParentItem(scene.pageRect)
         scene.setSceneRect(scene.pageRect.rect())
         r = scene.addRect(0, 0, rm.WIDTH, rm.HEIGHT)
         r.setPen(Qt.GlobalColor.black)
+        # The refinement was cancelled, but we are back to the page
+        if not final and i == self._page and i not in self._loads:
+            self._startLoad(i, pitem, page)
+
+    def _setBaseImage(self, scene, img, mult):
+        if scene.baseItem is None:
+            scene.baseItem = QGraphicsPixmapItem(scene.pageRect)
+            scene.baseItem.setTransformationMode(
+                Qt.TransformationMode.SmoothTransformation
+            )
+            scene.baseItem.setZValue(-1)
+        scene.baseItem.setPixmap(QPixmap(img))
+        scene.baseItem.setScale(1 / mult)
 
     # def resetSize.emit(self, ratio):
     #   dg = QApplication.desktop().availableGeometry(self.window())
@@ -258,19 +301,17 @@ class NotebookView(QGraphicsView):
         return False
 
     def nextMarkedPage(self):
-        p = self._page
-        while p < self._maxPage:
-            p += 1
-            if self._document.marked(p):
+        states = self._document.pageStates(refresh=True)
+        for p in range(self._page + 1, min(self._maxPage + 1, len(states))):
+            if states[p]:
                 self._loadPage(p)
                 return True
         return False
 
     def prevMarkedPage(self):
-        p = self._page
-        while p > 0:
-            p -= 1
-            if self._document.marked(p):
+        states = self._document.pageStates(refresh=True)
+        for p in range(min(self._page, len(states)) - 1, -1, -1):
+            if states[p]:
                 self._loadPage(p)
                 return True
         return False
@@ -422,34 +463,53 @@ class NotebookView(QGraphicsView):
 
 
 class AsyncPageLoadSignals(QObject):
-    pageReady = pyqtSignal(Page, PageGraphicsItem, QImage)
+    # The bool is False for a quick rendering of the base PDF
+    # that will be followed by a sharper one
+    pageReady = pyqtSignal(Page, PageGraphicsItem, QImage, bool)
 
 
 class AsyncPageLoad(QRunnable):
-    def __init__(self, document, i, **kw):
+    """
+    Loads a page and renders its base PDF, if any.
+    Given the `item` of an already loaded `page`, only renders the sharp base.
+    """
+
+    def __init__(self, document, i, item=None, page=None, **kw):
         QRunnable.__init__(self)
         self.document = document
         self.pageNum = i
+        self.item = item
+        self.page = page
         self.options = kw
         self.signals = AsyncPageLoadSignals()
+        self.signals.job = self
+        self._cancelled = False
 
-    def imageOfBasePdf(self, mult=1):
-        pdf = self.document.baseDocument()
-        if pdf:
-            return pdf.toImage(self.pageNum, 72.0 * mult)
-        else:
-            return QImage()
+    def cancel(self):
+        # The quick pass still happens, so that the page is not left loading
+        self._cancelled = True
 
-    def run(self):
-        page = self.document.getPage(self.pageNum)
-        img = None
+    def basePdf(self, page):
         if not page.background or page.background.name == 'Blank':
-            img = self.imageOfBasePdf(2)
-        else:
-            img = QImage()
+            return self.document.baseDocument()
+        return None
 
-        p = PageGraphicsItem(page, **self.options)
-        self.signals.pageReady.emit(page, p, img)
+    def run(self):
+        page = self.page
+        if page is None:
+            page = self.document.getPage(self.pageNum)
+        p = self.item or PageGraphicsItem(page, **self.options)
+        pdf = self.basePdf(page)
+        if not pdf:
+            self.signals.pageReady.emit(page, p, QImage(), True)
+            return
+
+        scale = 72.0 * BASE_MULT
+        if self.item is None and not pdf.isCached(self.pageNum, scale):
+            img = pdf.toImage(self.pageNum, 72.0 * BASE_PREVIEW_MULT)
+            self.signals.pageReady.emit(page, p, img, False)
+        if not self._cancelled:
+            self.signals.pageReady.emit(page, p, pdf.toImage(self.pageNum, scale), True)
 
 
 class QLoadingItem(QGraphicsRectItem):
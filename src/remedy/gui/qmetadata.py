@@ -4,13 +4,20 @@ from remedy.remarkable.metadata import RemarkableIndex
 
 
 class QRemarkableIndexSignals(QObject):
-    newEntryPrepare = pyqtSignal(str, int, dict, object)
+    newEntryPrepare = pyqtSignal(str, object, dict, object)
     newEntryProgress = pyqtSignal(str, int, int)
-    newEntryComplete = pyqtSignal(str, int, dict, object)
-    newEntryError = pyqtSignal(Exception, str, int, dict, object)
+    newEntryComplete = pyqtSignal(str, object, dict, object)
+    newEntryError = pyqtSignal(Exception, str, object, dict, object)
     updateEntryPrepare = pyqtSignal(str, dict, dict)
     updateEntryComplete = pyqtSignal(str, dict, dict)
     updateEntryError = pyqtSignal(Exception, str, dict, dict)
+    removeEntryComplete = pyqtSignal(str)
+    # uid -> new metadata, for the entries changed by a transaction
+    updateEntriesPrepare = pyqtSignal(dict)
+    updateEntriesComplete = pyqtSignal(dict)
+    updateEntriesError = pyqtSignal(Exception, dict)
+    # The result of readChanges, to apply on the thread of the views
+    changesRead = pyqtSignal(object)
 
 
 class QRemarkableIndex(RemarkableIndex):
@@ -36,3 +43,15 @@ class QRemarkableIndex(RemarkableIndex):
 
     def _update_entry_error(self, exception, uid, new_meta, new_content):
         self.signals.updateEntryError.emit(exception, uid, new_meta, new_content)
+
+    def _remove_entry_complete(self, uid):
+        self.signals.removeEntryComplete.emit(uid)
+
+    def _update_entries_prepare(self, changes):
+        self.signals.updateEntriesPrepare.emit(changes)
+
+    def _update_entries_complete(self, changes):
+        self.signals.updateEntriesComplete.emit(changes)
+
+    def _update_entries_error(self, exception, changes):
+        self.signals.updateEntriesError.emit(exception, changes)
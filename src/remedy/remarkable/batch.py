@@ -0,0 +1,223 @@
+from collections import deque
+from os import makedirs, path
+
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+
+from remedy.remarkable.export import CancelledExporter, Exporter, parsePageRanges
+from remedy.remarkable.metadata import Document
+from remedy.utils import log
+
+INVALID_FILENAME_CHARS = '/\\:'
+
+
+def safeFilename(name):
+    name = ''.join('_' if c in INVALID_FILENAME_CHARS else c for c in name)
+    return name.strip() or 'Untitled'
+
+
+def pdfStem(name):
+    name = safeFilename(name)
+    if name.lower().endswith('.pdf'):
+        name = name[:-4]
+    return name
+
+
+def uniqueFilename(folder, name, taken):
+    name = pdfStem(name)
+    filename = path.join(folder, name + '.pdf')
+    n = 1
+    while filename in taken:
+        n += 1
+        filename = path.join(folder, '%s (%d).pdf' % (name, n))
+    taken.add(filename)
+    return filename
+
+
+class BatchJob:
+    def __init__(self, document, filename, whichPages=[slice(None)]):
+        self.document = document
+        self.filename = filename
+        if isinstance(whichPages, str):
+            whichPages = parsePageRanges(whichPages, document)
+        self.whichPages = whichPages
+        self.exporter = None
+        self.steps = 0
+        self.done = 0
+        self.error = None
+
+    @property
+    def uid(self):
+        return self.document.uid
+
+    def weight(self, exact=False):
+        """
+        The number of pages to export. Unless `exact`, an estimate that
+        does not need the base PDF of the document (see BatchExporter._jobStart).
+        """
+        if exact:
+            n = self.document.num_pages()
+        else:
+            n = self.document.pageCount or len(self.document.pages or ())
+        return max(1, sum(len(range(*s.indices(n))) for s in self.whichPages))
+
+    def fraction(self):
+        if self.steps == 0:
+            return 0
+        return min(1, self.done / self.steps)
+
+
+def batchJobs(index, uids, dest, whichPages='', includeDeleted=False):
+    """
+    Expands a set of uids into one export job per document.
+    Folders are exported recursively, mirroring their sub-folders
+    inside of `dest`.
+    """
+    jobs = []
+    taken = set()
+
+    def addJob(entry, folder):
+        filename = uniqueFilename(folder, entry.visibleName, taken)
+        jobs.append(BatchJob(entry, filename, whichPages or [slice(None)]))
+
+    for uid in uids:
+        entry = index.get(uid)
+        if isinstance(entry, Document):
+            addJob(entry, dest)
+            continue
+        if not entry.isFolder():
+            continue
+        root = dest if entry.isRoot() else path.join(dest, safeFilename(entry.name()))
+        stack = [(entry, root)]
+        while stack:
+            folder, folderPath = stack.pop()
+            for f in folder.files:
+                doc = index.get(f)
+                if isinstance(doc, Document) and (
+                    includeDeleted or not doc.isDeleted()
+                ):
+                    addJob(doc, folderPath)
+            for f in folder.folders:
+                sub = index.get(f)
+                if sub.type_name == 'trash' or (sub.isDeleted() and not includeDeleted):
+                    continue
+                stack.append((sub, path.join(folderPath, safeFilename(sub.name()))))
+
+    return jobs
+
+
+class BatchExporter(QObject):
+    """
+    Runs many `Exporter`s, at most `max_jobs` at a time.
+    Shorter documents are exported first.
+    Progress is reported in pages, aggregated over all the jobs.
+    """
+
+    onStart = pyqtSignal(int)
+    onProgress = pyqtSignal(int, int)
+    onJobStart = pyqtSignal(str, str)
+    onJobSuccess = pyqtSignal(str, str)
+    onJobError = pyqtSignal(str, Exception)
+    onFinished = pyqtSignal(int, int)
+
+    _cancel = False
+
+    def __init__(self, jobs, max_jobs=2, parent=None, **options):
+        super().__init__(parent=parent)
+        self.max_jobs = max(1, int(max_jobs))
+        self.options = options
+        self._weights = {id(job): job.weight() for job in jobs}
+        self._queue = deque(sorted(jobs, key=lambda job: self._weights[id(job)]))
+        self._total = sum(self._weights.values())
+        self._completed = 0
+        self._running = []
+        self.succeeded = []
+        self.failed = []
+
+    def jobCount(self):
+        return len(self._queue) + len(self._running) + self.finishedCount()
+
+    def finishedCount(self):
+        return len(self.succeeded) + len(self.failed)
+
+    def isRunning(self):
+        return bool(self._queue or self._running)
+
+    def start(self):
+        self.onStart.emit(self._total)
+        self.onProgress.emit(0, self._total)
+        self._schedule()
+
+    @pyqtSlot()
+    def cancel(self):
+        self._cancel = True
+        self._queue.clear()
+        for job in self._running:
+            job.exporter.cancel()
+
+    def _schedule(self):
+        while self._queue and len(self._running) < self.max_jobs:
+            self._startJob(self._queue.popleft())
+        if not self._running:
+            self.onFinished.emit(len(self.succeeded), len(self.failed))
+
+    def _startJob(self, job):
+        d = path.dirname(job.filename)
+        try:
+            if d and not path.isdir(d):
+                makedirs(d, exist_ok=True)
+            job.exporter = Exporter(
+                job.filename,
+                job.document,
+                whichPages=job.whichPages,
+                parent=self,
+                **dict(self.options),
+            )
+        except Exception as e:
+            self._jobError(job, e)
+            self._completed += self._weights[id(job)]
+            self._emitProgress()
+            return
+        job.exporter.onStart.connect(lambda steps, job=job: self._jobStart(job, steps))
+        job.exporter.onProgress.connect(lambda job=job: self._jobProgress(job))
+        job.exporter.onError.connect(lambda e, job=job: self._jobError(job, e))
+        job.exporter.onSuccess.connect(lambda job=job: self._jobSuccess(job))
+        job.exporter.finished.connect(lambda job=job: self._jobFinished(job))
+        self._running.append(job)
+        self.onJobStart.emit(job.uid, job.filename)
+        job.exporter.start()
+
+    def _jobStart(self, job, steps):
+        job.steps = steps
+        # The document is open by now: correct the estimate of its weight
+        weight = job.weight(exact=True)
+        self._total += weight - self._weights[id(job)]
+        self._weights[id(job)] = weight
+        self._emitProgress()
+
+    def _jobProgress(self, job):
+        job.done += 1
+        self._emitProgress()
+
+    def _jobError(self, job, e):
+        job.error = e
+        self.failed.append(job)
+        if not isinstance(e, CancelledExporter):
+            log.warning('Batch export of %s failed: %s', job.uid, e)
+        self.onJobError.emit(job.uid, e)
+
+    def _jobSuccess(self, job):
+        self.succeeded.append(job)
+        self.onJobSuccess.emit(job.uid, job.filename)
+
+    def _jobFinished(self, job):
+        if job in self._running:
+            self._running.remove(job)
+        self._completed += self._weights[id(job)]
+        self._emitProgress()
+        self._schedule()
+
+    def _emitProgress(self):
+        done = self._completed + sum(
+            self._weights[id(job)] * job.fraction() for job in self._running
+        )
+        self.onProgress.emit(int(done), self._total)
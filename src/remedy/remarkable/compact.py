@@ -0,0 +1,134 @@
+import re
+import sys
+from array import array
+from collections.abc import Sequence
+
+# Content fields only the tablet makes use of, and which can be big:
+# compact entries leave them out until they are asked for
+RARE_CONTENT = frozenset(
+    {'cPages', 'documentMetadata', 'extraMetadata', 'keyboardMetadata', 'transform'}
+)
+
+# Fields whose values repeat across entries (uids of parents, tag names...)
+SHARED_VALUES = frozenset(
+    {'parent', 'type', 'fileType', 'orientation', 'fontName', 'textAlignment', 'name'}
+)
+
+
+# As written by the tablet, so that they read back the same
+_UUID = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+class PackedIds(Sequence):
+    """A read-only list of UUIDs (as strings), kept in 16 bytes each."""
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    @classmethod
+    def pack(cls, ids):
+        """The PackedIds of `ids`, or None if they are not all lowercase UUIDs."""
+        if not all(isinstance(i, str) and _UUID.fullmatch(i) for i in ids):
+            return None
+        return cls(bytes.fromhex(''.join(ids).replace('-', '')))
+
+    def __len__(self):
+        return len(self._data) // 16
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('page index out of range')
+        h = self._data[16 * i : 16 * i + 16].hex()
+        return '%s-%s-%s-%s-%s' % (h[:8], h[8:12], h[12:16], h[16:20], h[20:])
+
+    def __eq__(self, other):
+        if isinstance(other, PackedIds):
+            return self._data == other._data
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return 'PackedIds(%d)' % len(self)
+
+
+def _packInts(values):
+    try:
+        return array('i', values)
+    except (TypeError, OverflowError):
+        return None
+
+
+def _intern(value, key=None):
+    if isinstance(value, dict):
+        return {sys.intern(k): _intern(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_intern(v, key) for v in value]
+    if isinstance(value, str) and key in SHARED_VALUES:
+        return sys.intern(value)
+    return value
+
+
+def compactMetadata(metadata):
+    """A copy of `metadata` sharing its keys and repeated values with the others."""
+    return _intern(metadata)
+
+
+def compactContent(content):
+    """
+    A compact copy of `content`, and the names of the fields left out of it.
+    The page ids and the redirection map are packed in arrays when possible.
+    """
+    compact = {}
+    dropped = []
+    for k, v in content.items():
+        if k in RARE_CONTENT:
+            dropped.append(sys.intern(k))
+            continue
+        if k == 'pages' and isinstance(v, list):
+            v = PackedIds.pack(v) or v
+        elif k == 'redirectionPageMap' and isinstance(v, list):
+            packed = _packInts(v)
+            v = v if packed is None else packed
+        compact[sys.intern(k)] = _intern(v, k)
+    return compact, frozenset(dropped) or None
+
+
+def expandContent(content):
+    """A copy of a (possibly compact) content, as plain JSON values."""
+    if isinstance(content, dict):
+        return {k: expandContent(v) for k, v in content.items()}
+    if isinstance(content, (list, PackedIds)):
+        return [expandContent(v) for v in content]
+    if isinstance(content, array):
+        return content.tolist()
+    return content
+
+
+def deepSizeOf(obj, seen):
+    """
+    The memory taken by `obj` and what it holds, except for what is in `seen`
+    (the ids of the objects already counted, updated along the way).
+    """
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif isinstance(o, PackedIds):
+            stack.append(o._data)
+    return size
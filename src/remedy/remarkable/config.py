@@ -17,6 +17,9 @@ OPTIONS_DEFAULTS = {
     'default_source': False,
     'sources': {},
     'log_verbosity': 'info',
+    'render_processes': 0,
+    'compact_index': False,
+    'write_behind': True,
     'export': {
         'default_dir': '',
         'eraser_mode': 'ignore',
@@ -26,6 +29,8 @@ OPTIONS_DEFAULTS = {
         'smoothen': False,
         'simplify': 0,
         'pencil_resolution': 0.4,  # Alas QPrinter ignores QBrush's transforms
+        'max_jobs': 2,
+        'memory_budget': 0,
     },
     'preview': {'eraser_mode': 'ignore', 'pencil_resolution': 0.4},
     'upload': {'default_options': {}},
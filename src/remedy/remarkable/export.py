@@ -1,4 +1,10 @@
-from PyPDF2 import PdfFileReader, PdfFileWriter
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import ExitStack
+
+from PyPDF2 import PdfFileMerger, PdfFileReader, PdfFileWriter
 from PyPDF2.generic import NullObject
 from PyQt5.QtCore import QSizeF, QThread, pyqtSignal
 from PyQt5.QtGui import QPainter
@@ -13,6 +19,16 @@ except ImportError:
     from PyPDF2 import PageObject
     from PyPDF2.errors import PdfReadError
 
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
 from remedy.remarkable.metadata import PDFBasedDoc
 from remedy.remarkable.render import BarePageScene
 from remedy.utils import log
@@ -59,31 +75,131 @@ def scenesPdf(scenes, pages, outputPath, progress=None, tot=0):
         p.end()
 
 
-def pdfrotate(outputPath, rotate=0):
-    reader = PdfFileReader(outputPath, strict=False)
+def peakMemory():
+    """Peak resident memory of the process in bytes, or None if unknown."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+# Rough ratio between the memory taken by a merged page
+# and the size of its source pages on disk (content streams get decoded)
+MERGE_OVERHEAD = 8
+
+
+def chunkSize(paths, pageNum, budget):
+    """
+    Number of pages that can be processed at once within `budget` bytes,
+    estimated from the average size per page of the files in `paths`.
+    """
+    if not budget or pageNum == 0:
+        return pageNum
+    perPage = sum(os.path.getsize(p) for p in paths) / pageNum * MERGE_OVERHEAD
+    return max(1, min(pageNum, int(budget / max(perPage, 1))))
+
+
+def _pageCount(p):
+    # Reading from the file only parses its cross-reference table
+    with open(p, 'rb') as f:
+        return PdfFileReader(f, strict=False).numPages
+
+
+def _rewriteInChunks(outputPath, inputs, pageNum, chunk, addPages):
+    # The files in `inputs` are opened once, but each chunk gets fresh readers
+    # over them and a fresh writer, so that the objects they hold
+    # are freed once the chunk is on disk (the writer rewrites the objects
+    # it copies, so a reader cannot serve two writers).
+    # addPages(writer, readers, start, stop) adds the pages of the chunk to writer.
+    tmpdir = tempfile.mkdtemp(prefix='.remedy-', dir=os.path.dirname(outputPath) or '.')
+    try:
+        chunks = []
+        with ExitStack() as stack:
+            files = [stack.enter_context(open(p, 'rb')) for p in inputs]
+            for start in range(0, pageNum, chunk):
+                readers = [PdfFileReader(f, strict=False) for f in files]
+                writer = TolerantPdfWriter()
+                addPages(writer, readers, start, min(start + chunk, pageNum))
+                chunks.append(os.path.join(tmpdir, 'chunk-%05d.pdf' % len(chunks)))
+                with open(chunks[-1], 'wb') as out:
+                    writer.write(out)
+                del writer, readers
+        merged = os.path.join(tmpdir, 'merged.pdf')
+        pdfconcat(chunks, merged)
+        os.replace(merged, outputPath)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def pdfconcat(inputs, outputPath):
+    if fitz is not None:
+        # Appending with incremental saves only keeps one chunk in memory
+        shutil.copyfile(inputs[0], outputPath)
+        for p in inputs[1:]:
+            doc = fitz.open(outputPath)
+            try:
+                with fitz.open(p) as chunk:
+                    doc.insert_pdf(chunk)
+                doc.saveIncr()
+            finally:
+                doc.close()
+    else:
+        # Without PyMuPDF the chunks are concatenated in memory,
+        # which is still cheaper than merging since their content is final
+        merger = PdfFileMerger(strict=False)
+        for p in inputs:
+            merger.append(p, import_bookmarks=False)
+        with open(outputPath, 'wb') as out:
+            merger.write(out)
+        merger.close()
+
+
+def pdfdedupe(outputPath, budget=None):
+    """
+    Rewrites the PDF storing identical objects only once.
+
+    QPrinter embeds each template and brush texture once per document,
+    since it caches images by their cacheKey, but it repeats the patterns
+    tiling the brush textures on every page.
+    Needs PyMuPDF and loads the whole file, so it is skipped
+    when the file does not fit in `budget` (bytes).
+    """
+    if fitz is None:
+        return False
+    if budget and os.path.getsize(outputPath) * MERGE_OVERHEAD > budget:
+        return False
+    tmp = outputPath + '.tmp'
+    try:
+        with fitz.open(outputPath) as doc:
+            doc.save(tmp, garbage=4)
+        os.replace(tmp, outputPath)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return True
+
+
+def pdfrotate(outputPath, rotate=0, budget=None):
+    def addPages(writer, readers, start, stop):
+        for pageNum in range(start, stop):
+            page = readers[0].getPage(pageNum)
+            page.rotateClockwise(90)
+            writer.addPage(page)
+
+    pageNum = _pageCount(outputPath)
+    chunk = chunkSize([outputPath], pageNum, budget)
+    if chunk < pageNum:
+        _rewriteInChunks(outputPath, [outputPath], pageNum, chunk, addPages)
+        return
+
     writer = TolerantPdfWriter()
-    for pageNum in range(reader.numPages):
-        page = reader.getPage(pageNum)
-        page.rotateClockwise(90)
-        writer.addPage(page)
+    addPages(writer, [PdfFileReader(outputPath, strict=False)], 0, pageNum)
     with open(outputPath, 'wb') as out:
         writer.write(out)
 
 
-def pdfmerge(base, outputPath, pdfRanges=None, rotate=0, progress=None):
-    baseReader = PdfFileReader(base.path(), strict=False)
-    annotReader = PdfFileReader(outputPath, strict=False)
-    if pdfRanges is None:
-        pageNum = (
-            annotReader.getNumPages()
-        )  # min(baseReader.getNumPages(), annotReader.getNumPages())
-        pdfRanges = range(pageNum)
-    else:
-        pageNum = sum(len(r) for r in pdfRanges)
-        pdfRanges = chain(*pdfRanges)
-    writer = TolerantPdfWriter()
-    _progress(progress, 0, pageNum + 1)
-    for apage, page in enumerate(pdfRanges):
+def _mergePages(writer, baseReader, annotReader, base, pages, rotate, progress):
+    for apage, page in pages:
         ap = annotReader.getPage(apage)
         bpage = base.originalPageNum(page)
         if bpage is None:
@@ -114,11 +230,41 @@ def pdfmerge(base, outputPath, pdfRanges=None, rotate=0, progress=None):
                 np.rotateCounterClockwise(rotate)
 
             writer.addPage(np)
-        _progress(progress, page, pageNum + 1)
+        _progress(progress, page, len(pages) + 1)
 
     writer.removeLinks()  # until we implement transformations on annotations
-    with open(outputPath, 'wb') as out:
-        writer.write(out)
+
+
+def pdfmerge(base, outputPath, pdfRanges=None, rotate=0, progress=None, budget=None):
+    """
+    Overlays the annotations in outputPath onto the pages of the base PDF.
+    With a `budget` (in bytes) the pages are merged in chunks
+    small enough to fit in it, instead of all in memory at once.
+    """
+    if pdfRanges is None:
+        # min(baseReader.getNumPages(), annotReader.getNumPages())
+        pageNum = _pageCount(outputPath)
+        pdfRanges = [range(pageNum)]
+    pages = list(enumerate(chain(*pdfRanges)))
+    pageNum = len(pages)
+    _progress(progress, 0, pageNum + 1)
+
+    def addPages(writer, readers, start, stop):
+        baseReader, annotReader = readers
+        _mergePages(
+            writer, baseReader, annotReader, base, pages[start:stop], rotate, progress
+        )
+
+    inputs = [base.path(), outputPath]
+    chunk = chunkSize(inputs, pageNum, budget)
+    if chunk < pageNum:
+        _rewriteInChunks(outputPath, inputs, pageNum, chunk, addPages)
+    else:
+        writer = TolerantPdfWriter()
+        readers = [PdfFileReader(p, strict=False) for p in inputs]
+        addPages(writer, readers, 0, pageNum)
+        with open(outputPath, 'wb') as out:
+            writer.write(out)
 
     _progress(progress, pageNum + 1, pageNum + 1)
 
@@ -211,6 +357,8 @@ class Exporter(QThread):
         if isinstance(whichPages, str):
             whichPages = parsePageRanges(whichPages, document)
         self.whichPages = whichPages
+        # in MB, 0 means no limit
+        self.budget = options.pop('memory_budget', 0) * 2**20
         self.options = options
         # we are disabling highlight customisation for the moment
         # and using opacity instead of 'darken' composition mode
@@ -272,6 +420,8 @@ class Exporter(QThread):
             scenesPdf(
                 self.genScenes, pages, self.filename, progress=self._progress, tot=steps
             )
+            # Less objects to parse when merging, too
+            pdfdedupe(self.filename, budget=self.budget)
             if pdf:
                 self.onNewPhase.emit('Merging with original PDF')
                 pdfmerge(
@@ -280,10 +430,16 @@ class Exporter(QThread):
                     pdfRanges=ranges,
                     rotate=90 if rot else 0,
                     progress=self._progress,
+                    budget=self.budget,
                 )
             elif rot:
-                pdfrotate(self.filename, 90)
+                pdfrotate(self.filename, 90, budget=self.budget)
 
+            peak = peakMemory()
+            if peak:
+                log.info(
+                    'Exported %s (peak memory: %d MB)', self.filename, peak // 2**20
+                )
             self.onSuccess.emit()
         except Exception as e:
             log.warning('Exception on exporting: %s', e)
@@ -298,5 +454,5 @@ class Exporter(QThread):
                 raise CancelledExporter('Export was cancelled')
 
         # ---
-        for i in pages:
-            yield BarePageScene(self.document.getPage(i), progress=pr, **self.options)
+        for page in self.document.getPages(pages):
+            yield BarePageScene(page, progress=pr, **self.options)
@@ -1,8 +1,14 @@
+import errno
 import json
 import os
 import os.path as path
+import shlex
 import shutil
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path, PurePosixPath
 from shutil import which
 from stat import S_ISDIR, S_ISREG
@@ -10,6 +16,7 @@ from threading import RLock
 
 import paramiko
 
+from remedy.remarkable.rangefile import BlockCache
 from remedy.utils import log
 
 
@@ -19,8 +26,27 @@ class FileSource:
     Should guarantee thread safety if used on disjoint paths.
     """
 
+    # Local folder where derived data (e.g. rendered pages) can be cached
+    cache_dir = None
+
+    # How many files it is worth reading at the same time
+    parallel_reads = 1
+
     def __init__(self, name: str) -> None:
         self.name = name
+        self._flushers = []
+
+    def addFlusher(self, flush) -> None:
+        """
+        Registers `flush`, called by `flush` to finish the writes
+        left for later (see RemarkableIndex.flush).
+        """
+        self._flushers.append(flush)
+
+    def flush(self) -> None:
+        """Finishes the pending writes, before refreshing the tablet."""
+        for flush in self._flushers:
+            flush()
 
     def readJson(self, remote, ext=None):
         try:
@@ -41,6 +67,28 @@ class FileSource:
         """
         raise NotImplementedError
 
+    def retrieveBlocks(self, *remote, ext=None):
+        """
+        A BlockCache reading the file at `remote` without downloading it all,
+        or None if `retrieve` would be quick.
+        """
+        return None
+
+    def retrieveBundle(self, files):
+        """
+        Retrieves several files at once, each given as a tuple of path components
+        relative to the documents root.
+        Returns the local path of each file, or None if it does not exist.
+        """
+        bundle = {}
+        for f in files:
+            try:
+                local = self.retrieve(*f)
+            except OSError:
+                local = None
+            bundle[f] = local if local and path.isfile(local) else None
+        return bundle
+
     def retrieveTemplate(self, name, progress=None):
         """
         Given a path `filename` relative to the documents root
@@ -57,6 +105,20 @@ class FileSource:
         """
         raise NotImplementedError
 
+    def storeBundle(self, contents):
+        """
+        Stores several files at once, overwriting them, given as {name: content}
+        with names relative to the documents root (see `store`).
+        Returns the exceptions raised storing some of them, by name.
+        """
+        failed = {}
+        for name, content in contents.items():
+            try:
+                self.store(content, name, overwrite=True)
+            except Exception as e:
+                failed[name] = e
+        return failed
+
     def remove(self, *remote, progress=None):
         raise NotImplementedError
 
@@ -72,8 +134,22 @@ class FileSource:
     def exists(self, *filename, ext=None):
         raise NotImplementedError
 
+    def stat(self, *filename, ext=None):
+        """
+        The (size, modification time) of a file, without retrieving it,
+        or None if it does not exist or the source cannot tell.
+        """
+        return None
+
+    def listStats(self):
+        """
+        The (size, modification time) of the files at the top of the documents
+        folder, by name, in one go, or None if the source cannot list them.
+        """
+        return None
+
     def cleanup(self) -> None:
-        return
+        self.flush()
 
     def close(self) -> None:
         return
@@ -140,8 +216,23 @@ class LocalFileSource(FileSource):
             filename = filename[:-1] + (filename[-1] + '.' + ext,)
         return path.isfile(path.join(self.root, *filename))
 
-    def cleanup(self) -> None:
-        pass
+    def stat(self, *filename, ext=None):
+        if ext:
+            filename = filename[:-1] + (filename[-1] + '.' + ext,)
+        try:
+            st = os.stat(path.join(self.root, *filename))
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime)
+
+    def listStats(self):
+        stats = {}
+        with os.scandir(self.root) as entries:
+            for e in entries:
+                if e.is_file():
+                    st = e.stat()
+                    stats[e.name] = (st.st_size, st.st_mtime)
+        return stats
 
     def listItems(self):
         for file in Path(self.root).glob('*.metadata'):
@@ -166,6 +257,63 @@ DOCSDIR = 0
 TEMPLDIR = 1
 
 
+class RemoteManifest:
+    """
+    The files and folders under a remote folder, with their size and
+    modification time, listed in one go (see `parse`),
+    by their path relative to the folder.
+    """
+
+    def __init__(self) -> None:
+        self.stats = {}  # path -> (size, mtime), or None if written since
+        self.folders = {'': set()}  # path -> names in the folder
+
+    @classmethod
+    def parse(cls, lines):
+        """
+        The manifest of lines of `type size mtime path`, the type being
+        `f` or `d` (as by find -printf %y) or the mode in hex (as by stat -c %f).
+        Returns None if a line cannot be read.
+        """
+        manifest = cls()
+        for line in lines:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            try:
+                kind, size, mtime, name = line.split(' ', 3)
+                if kind not in ('f', 'd'):
+                    mode = int(kind, 16)
+                    kind = 'd' if S_ISDIR(mode) else 'f' if S_ISREG(mode) else None
+                st = (int(size), int(mtime.partition('.')[0]))  # whole seconds, as SFTP
+            except ValueError:
+                return None
+            if name.startswith('./'):
+                name = name[2:]
+            if kind is not None:
+                manifest.add(name, isdir=(kind == 'd'), st=st)
+        return manifest
+
+    def add(self, name, isdir=False, st=None) -> None:
+        parent, _, base = name.rpartition('/')
+        self.folders.setdefault(parent, set()).add(base)
+        self.stats[name] = st
+        if isdir:
+            self.folders.setdefault(name, set())
+
+    def remove(self, name) -> None:
+        parent, _, base = name.rpartition('/')
+        self.folders.get(parent, set()).discard(base)
+        self.stats.pop(name, None)
+        self.folders.pop(name, None)
+
+    def isfile(self, name) -> bool:
+        return name in self.stats and name not in self.folders
+
+    def isdir(self, name) -> bool:
+        return name in self.folders
+
+
 class LiveFileSourceSSH(FileSource):
     remote_roots = (
         '/home/root/.local/share/remarkable/xochitl',
@@ -176,6 +324,13 @@ class LiveFileSourceSSH(FileSource):
 
     _dirty = False
 
+    # Each listing every file and folder under the documents root as
+    # `type size mtime path`, the second for the find of busybox (no -printf)
+    MANIFEST_COMMANDS = (
+        "find %s -mindepth 1 -printf '%%y %%s %%T@ %%P\\n'",
+        "cd %s && find . -mindepth 1 -exec stat -c '%%f %%s %%Y %%n' {} +",
+    )
+
     def __init__(
         self,
         ssh,
@@ -189,12 +344,20 @@ class LiveFileSourceSSH(FileSource):
         connect=True,
         utils_path='$HOME',
         persist_cache=True,
+        parallel_reads=8,
+        use_manifest=True,
+        manifest_ttl=60,
         **kw,
     ):
         super().__init__(name)
 
         self.ssh = ssh
         self.persist_cache = persist_cache
+        self.parallel_reads = parallel_reads
+        self.use_manifest = use_manifest
+        self.manifest_ttl = manifest_ttl  # seconds, None to keep it all session
+        self._manifest = None
+        self._manifestTime = 0
 
         self.cache_dir = cache_dir = path.join(path.expanduser(cache_dir), id)
         self.local_roots = (
@@ -227,6 +390,7 @@ class LiveFileSourceSSH(FileSource):
         self.sftp = ssh.open_sftp()
         self.scp = self.sftp
         self._lock = RLock()
+        self._channels = []
         # self.scp = SCPClient(ssh.get_transport())
 
         self.templates = {}
@@ -256,6 +420,9 @@ class LiveFileSourceSSH(FileSource):
                 os.makedirs(dirname)
 
     def _isfile(self, p):
+        name = self._manifestName(p)
+        if name is not None:
+            return self._manifest.isfile(name)
         try:
             p = self.sftp.stat(p)
         except:
@@ -263,12 +430,117 @@ class LiveFileSourceSSH(FileSource):
         return S_ISREG(p.st_mode) != 0
 
     def _isdir(self, p):
+        name = self._manifestName(p)
+        if name is not None:
+            return self._manifest.isdir(name)
         try:
             p = self.sftp.stat(p)
         except:
             return False
         return S_ISDIR(p.st_mode) != 0
 
+    def refreshManifest(self) -> bool:
+        """
+        Lists every file and folder under the documents root, with their size
+        and modification time, in one remote command.
+        For `manifest_ttl` seconds, the listing answers `exists`, `stat`,
+        the listings of items and the checks of the cache, with no round trip.
+        Returns False if the tablet could not list them, in which case
+        it is asked about each file instead.
+        """
+        manifest = None
+        for command in self.MANIFEST_COMMANDS:
+            manifest = self._runManifest(command % shlex.quote(self._remote()))
+            if manifest is not None:
+                break
+        else:
+            log.info('Could not list the files of the tablet at once')
+        with self._lock:
+            self._manifest = manifest
+            self._manifestTime = time.monotonic()
+            self._allUids = None
+        return manifest is not None
+
+    def _currentManifest(self):
+        # The manifest, unless too old to tell what changed on the tablet since
+        if self._manifest is None or self.manifest_ttl is None:
+            return self._manifest
+        if time.monotonic() - self._manifestTime > self.manifest_ttl:
+            return None
+        return self._manifest
+
+    def _runManifest(self, command):
+        try:
+            _, out, _ = self.ssh.exec_command(command)
+            manifest = RemoteManifest.parse(out)  # as it comes
+            if out.channel.recv_exit_status() != 0:
+                return None
+            return manifest
+        except Exception as e:
+            log.debug('Listing failed: %s', e)
+            return None
+
+    def _manifestName(self, p):
+        # The path of `p` in the manifest, or None if it cannot tell
+        root = self.remote_roots[DOCSDIR]
+        if self._currentManifest() is None:
+            return None
+        if p == root:
+            return ''
+        if p.startswith(root + '/'):
+            return p[len(root) + 1 :]
+        return None
+
+    def _remoteStat(self, p, sftp=None):
+        # The (size, mtime) of `p`, from the manifest if it knows it
+        with self._lock:
+            manifest = self._manifest
+            name = self._manifestName(p)
+            if name is not None:
+                if name not in manifest.stats:
+                    raise FileNotFoundError(errno.ENOENT, 'No such file', p)
+                st = manifest.stats[name]
+                if st is not None:
+                    return st
+        if sftp is None:
+            with self._lock:
+                rstat = self.sftp.stat(p)
+        else:
+            rstat = sftp.stat(p)
+        st = (rstat.st_size, rstat.st_mtime)
+        if name is not None:
+            with self._lock:
+                if self._manifest is manifest and name in manifest.stats:
+                    manifest.stats[name] = st
+        return st
+
+    def _written(self, *remote, isdir=False) -> None:
+        # Keeps the manifest in step with what is written to the tablet
+        with self._lock:
+            name = self._manifestName(self._remote(*remote))
+            if name:
+                self._manifest.add(name, isdir=isdir)
+
+    def _removed(self, *remote) -> None:
+        with self._lock:
+            name = self._manifestName(self._remote(*remote))
+            if name:
+                self._manifest.remove(name)
+
+    @contextmanager
+    def _channel(self):
+        # An SFTP channel for this thread alone: requests on a channel
+        # are answered in turn, so threads sharing one would wait on each other
+        with self._lock:
+            sftp = self._channels.pop() if self._channels else None
+        if sftp is None:
+            sftp = self.ssh.open_sftp()
+        try:
+            yield sftp
+        finally:
+            with self._lock:
+                self._channels.append(sftp)
+
     def _local(self, *paths, branch=DOCSDIR):
         return path.join(self.local_roots[branch], *paths)
 
@@ -282,26 +554,59 @@ class LiveFileSourceSSH(FileSource):
         if ext:
             filename = filename[:-1] + (filename[-1] + '.' + ext,)
         cachep = self._local(*filename)
-        with self._lock:
-            d = path.dirname(cachep)
-            if not path.isdir(d):
-                os.makedirs(d)
-            remp = self._remote(*filename)
-            rstat = self.sftp.stat(remp)
+        os.makedirs(path.dirname(cachep), exist_ok=True)
+        remp = self._remote(*filename)
+        with self._channel() as sftp:
+            size, mtime = self._remoteStat(remp, sftp)
             found = path.isfile(cachep)
             if found:
                 lstat = os.stat(cachep)
-                found = (lstat.st_mtime == rstat.st_mtime) and (
-                    lstat.st_size == rstat.st_size
-                )
+                found = (lstat.st_mtime == mtime) and (lstat.st_size == size)
                 # not fool-proof but good enough?
                 # There is always the option of setting persist_cache: false
                 # for the source
             if not found:
-                self.scp.get(remp, cachep)
-                os.utime(cachep, (rstat.st_atime, rstat.st_mtime))
+                # Threads getting the same file must not write over each other
+                tmp = '%s.%d.tmp' % (cachep, threading.get_ident())
+                sftp.get(remp, tmp)
+                os.utime(tmp, (mtime, mtime))
+                os.replace(tmp, cachep)
         return cachep
 
+    def retrieveBlocks(self, *filename, ext=None):
+        if ext:
+            filename = filename[:-1] + (filename[-1] + '.' + ext,)
+        cachep = self._local(*filename)
+        remp = self._remote(*filename)
+        size, mtime = self._remoteStat(remp)
+        if path.isfile(cachep):
+            lstat = os.stat(cachep)
+            if lstat.st_mtime == mtime and lstat.st_size == size:
+                return None
+
+        def fetch(ranges):
+            with self._lock:
+                with self.sftp.open(remp, 'rb') as f:
+                    return list(f.readv(ranges))
+
+        return BlockCache(fetch, size, mtime, cachep)
+
+    def retrieveBundle(self, files):
+        # Each file on a channel of its own, so that their round trips overlap;
+        # a missing file shows in its stat
+        def fetch(f):
+            try:
+                return f, self.retrieve(*f)
+            except IOError:
+                return f, None
+
+        files = list(files)
+        if len(files) < 2 or self.parallel_reads < 2:
+            return dict(map(fetch, files))
+        n = min(len(files), self.parallel_reads)
+        with ThreadPoolExecutor(n, 'Bundle') as pool:
+            return dict(pool.map(fetch, files))
+
     def retrieveTemplate(self, name, progress=None):
         try:
             filename = self._selectTemplate(name)
@@ -316,7 +621,8 @@ class LiveFileSourceSSH(FileSource):
             return None
 
     def prefetchMetadata(self, progress=None) -> None:
-        pass
+        if self.use_manifest:
+            self.refreshManifest()
 
     def exists(self, *filename, ext=None):
         if ext:
@@ -324,13 +630,40 @@ class LiveFileSourceSSH(FileSource):
         with self._lock:
             return self._isfile(self._remote(*filename))
 
+    def stat(self, *filename, ext=None):
+        if ext:
+            filename = filename[:-1] + (filename[-1] + '.' + ext,)
+        try:
+            return self._remoteStat(self._remote(*filename))
+        except IOError:
+            return None
+
+    def listStats(self):
+        # Listing everything takes one round trip, as listing the top folder does
+        if self.use_manifest and self._currentManifest() is None:
+            self.refreshManifest()
+        with self._lock:
+            manifest = self._currentManifest()
+            if manifest is not None:
+                stats = {n: manifest.stats[n] for n in manifest.folders['']}
+                # Unless some were written since
+                if None not in stats.values():
+                    return {n: st for n, st in stats.items() if manifest.isfile(n)}
+            attrs = self.sftp.listdir_attr(self._remote())
+        return {
+            a.filename: (a.st_size, a.st_mtime) for a in attrs if S_ISREG(a.st_mode)
+        }
+
     def cleanup(self) -> None:
+        # Before the cache goes, for the writes still going through it
+        self.flush()
         if not self.persist_cache:
             log.debug('Clearing cache')
             shutil.rmtree(self.cache_dir, ignore_errors=True)
         self.refreshXochitl()
 
     def refreshXochitl(self) -> None:
+        self.flush()
         if not self._dirty:
             return
 
@@ -350,7 +683,12 @@ class LiveFileSourceSSH(FileSource):
         with self._lock:
             if self._allUids is None:
                 self._allUids = []
-                for entry in self.sftp.listdir(self._remote()):
+                manifest = self._currentManifest()
+                if manifest is not None:
+                    entries = sorted(manifest.folders[''])
+                else:
+                    entries = self.sftp.listdir(self._remote())
+                for entry in entries:
                     name = path.splitext(entry)
                     if name[1] == '.metadata':
                         self._allUids.append(name[0])
@@ -363,9 +701,14 @@ class LiveFileSourceSSH(FileSource):
             # I don't want to yield while holding a lock
             items = []
             with self._lock:
-                for entry in self.sftp.listdir(folder):
+                name = self._manifestName(folder)
+                if name is not None:
+                    entries = sorted(self._manifest.folders.get(name, ()))
+                else:
+                    entries = self.sftp.listdir(folder)
+                for entry in entries:
                     name = path.splitext(entry)
-                    if name[1] == ext:
+                    if name[1] == '.' + ext:
                         items.append(name[0])
             yield from items
         except Exception as e:
@@ -375,6 +718,7 @@ class LiveFileSourceSSH(FileSource):
         with self._lock:
             if overwrite or not self._isfile(self._remote(*remote)):
                 self.sftp.put(local, self._remote(*remote), callback=progress)
+                self._written(*remote)
                 self._dirty = True
                 return True
         return False
@@ -387,14 +731,40 @@ class LiveFileSourceSSH(FileSource):
                         f.write(content)
                     else:
                         json.dump(content, f, indent=4)
+                self._written(*remote)
                 self._dirty = True
                 return True
         return False
 
+    def storeBundle(self, contents):
+        # Each file on a channel of its own, so that their round trips overlap
+        def write(item):
+            name, content = item
+            if type(content) is not str:
+                content = json.dumps(content, indent=4)
+            try:
+                with self._channel() as sftp:
+                    with sftp.open(self._remote(name), 'w') as f:
+                        f.write(content)
+            except Exception as e:
+                return name, e
+            self._written(name)
+            return name, None
+
+        if not contents:
+            return {}
+        n = min(len(contents), max(self.parallel_reads, 1))
+        with ThreadPoolExecutor(n, 'Bundle') as pool:
+            results = list(pool.map(write, contents.items()))
+        with self._lock:
+            self._dirty = True
+        return {name: e for name, e in results if e is not None}
+
     def remove(self, *remote, progress=None):
         p = self._remote(*remote)
         if self._isfile(p):
             self.sftp.remove(p)
+            self._removed(*remote)
             return True
         return False
 
@@ -403,17 +773,21 @@ class LiveFileSourceSSH(FileSource):
         with self._lock:
             if self._isdir(p):
                 self.sftp.rmdir(p)
+                self._removed(*remote)
 
     def makeDir(self, *remote):
         try:
             with self._lock:
                 self.sftp.mkdir(self._remote(*remote))
+                self._written(*remote, isdir=True)
             self._dirty = True
             return True
         except:
             return False
 
     def close(self) -> None:
+        for sftp in self._channels:
+            sftp.close()
         self.sftp.close()
         self.ssh.close()
 
@@ -549,6 +923,24 @@ class LiveFileSourceRsync(LiveFileSourceSSH):
                 self._updated[local] = True
         return local
 
+    def retrieveBundle(self, files):
+        local = {f: self._local(*f) for f in files}
+        todo = [f for f in files if local[f] not in self._updated]
+        if todo:
+            # One transfer for all, removing the copies of those that are gone
+            cmd = self.RSYNC + ['-t', '--files-from=-', '--delete-missing-args']
+            cmd += [self._remote_rsync(self._remote() + '/'), self._local()]
+            listing = ''.join(str(PurePosixPath(*f)) + '\n' for f in todo)
+            with self._lock:
+                p = subprocess.run(cmd, input=listing.encode(), capture_output=True)
+                if p.returncode not in (0, 23, 24):
+                    log.debug('RSYNC returned %s: %s', p.returncode, p.stderr)
+                    return FileSource.retrieveBundle(self, files)
+                for f in todo:
+                    if path.isfile(local[f]):
+                        self._updated[local[f]] = True
+        return {f: local[f] if path.isfile(local[f]) else None for f in files}
+
     def retrieveTemplate(self, name, progress=None):
         try:
             t = self._selectTemplate(name)
@@ -0,0 +1,173 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from remedy.remarkable.compact import expandContent
+from remedy.remarkable.metadata import ROOT_ID, TRASH_ID
+from remedy.remarkable.snapshot import entryIdentity
+
+ADDED = 'added'
+REMOVED = 'removed'
+MOVED = 'moved'
+RENAMED = 'renamed'
+CHANGED = 'changed'
+KINDS = (ADDED, REMOVED, MOVED, RENAMED, CHANGED)
+
+# For MOVED the parents, for RENAMED the names,
+# otherwise the metadata of the entry before and after (None if absent)
+Change = namedtuple('Change', ['kind', 'uid', 'old', 'new'])
+
+# Fields whose changes are reported on their own
+_TRACKED = ('parent', 'deleted', 'visibleName')
+
+# The value of the fields of a content that are not known,
+# like those a compact index dropped: they are not compared
+UNKNOWN = object()
+
+
+def _parentOf(metadata):
+    # Deleted entries are shown in the trash, as in the index
+    return TRASH_ID if metadata.get('deleted') else metadata.get('parent', ROOT_ID)
+
+
+def _depths(state):
+    depths = {}
+
+    def depth(uid):
+        chain = []
+        while uid in state and uid not in depths and uid not in chain:
+            chain.append(uid)
+            uid = _parentOf(state[uid][0])
+        d = depths.get(uid, 0)
+        for u in reversed(chain):
+            d += 1
+            depths[u] = d
+        return d
+
+    return depth
+
+
+def _sameContent(cont, oldCont):
+    unknown = {k for c in (cont, oldCont) for k, v in c.items() if v is UNKNOWN}
+    if unknown:
+        cont = {k: v for k, v in cont.items() if k not in unknown}
+        oldCont = {k: v for k, v in oldCont.items() if k not in unknown}
+    return cont == oldCont
+
+
+def diffEntries(old, new):
+    """
+    The journal of the changes from one state of the library to another,
+    each given as {uid: (metadata, content)}: a list of Change,
+    the additions first (parents before children), then the moves, renames
+    and other changes of the entries in both, then the removals
+    (children before parents), so that applying them in turn
+    never leaves an entry without its parent.
+    The fields of a content set to UNKNOWN are left out of the comparison.
+    """
+    added, removed, changed = [], [], []
+    for uid, (meta, cont) in new.items():
+        if uid not in old:
+            added.append(uid)
+            continue
+        oldMeta, oldCont = old[uid]
+        if meta is oldMeta and cont is oldCont:
+            continue
+        if _parentOf(oldMeta) != _parentOf(meta):
+            changed.append(Change(MOVED, uid, _parentOf(oldMeta), _parentOf(meta)))
+        # Named after their uid if they have no name, as in the index
+        name, oldName = meta.get('visibleName', uid), oldMeta.get('visibleName', uid)
+        if oldName != name:
+            changed.append(Change(RENAMED, uid, oldName, name))
+        others = {k: v for k, v in meta.items() if k not in _TRACKED}
+        oldOthers = {k: v for k, v in oldMeta.items() if k not in _TRACKED}
+        if others != oldOthers or not _sameContent(cont, oldCont):
+            changed.append(Change(CHANGED, uid, oldMeta, meta))
+    removed = [uid for uid in old if uid not in new]
+
+    newDepth = _depths(new)
+    oldDepth = _depths(old)
+    added.sort(key=newDepth)
+    removed.sort(key=oldDepth, reverse=True)
+    return (
+        [Change(ADDED, uid, None, new[uid][0]) for uid in added]
+        + changed
+        + [Change(REMOVED, uid, old[uid][0], None) for uid in removed]
+    )
+
+
+def _contentOf(entry):
+    # Without reading back what a compact index dropped
+    content = expandContent(entry._content)
+    for field in entry._dropped or ():
+        content[field] = UNKNOWN
+    return content
+
+
+def indexState(index):
+    """
+    The state of the entries of a RemarkableIndex, for `diffEntries`
+    (the fields dropped by a compact index are UNKNOWN).
+    """
+    with index._upd_lock:
+        return {
+            uid: (entry._metadata, _contentOf(entry))
+            for uid, entry in index.index.items()
+            if uid not in (ROOT_ID, TRASH_ID)
+        }
+
+
+def snapshotState(snapshot):
+    """The state of the entries saved in an IndexSnapshot, for `diffEntries`."""
+    return {uid: (meta, cont) for uid, meta, cont in snapshot.entries()}
+
+
+def sourceState(fsource, snapshot, old=None):
+    """
+    The current state of the entries of `fsource`, reading only those
+    whose files changed since they were saved in `snapshot`
+    (the others are taken from `old`, the state of the snapshot by default).
+    Returns None if the source cannot list its files.
+    """
+    stats = fsource.listStats()
+    if stats is None:
+        return None
+    if old is None:
+        old = snapshotState(snapshot)
+    known = snapshot.identities()
+    state = {}
+    changed = []
+    for name in stats:
+        if not name.endswith('.metadata'):
+            continue
+        uid = name[: -len('.metadata')]
+        if uid in old and known.get(uid) == entryIdentity(stats, uid):
+            state[uid] = old[uid]
+        else:
+            changed.append(uid)
+
+    def read(uid):
+        return (
+            fsource.readJson(uid, ext='metadata'),
+            fsource.readJson(uid, ext='content'),
+        )
+
+    n = max(fsource.parallel_reads, 1)
+    with ThreadPoolExecutor(n, 'StateReader') as pool:
+        for uid, item in zip(changed, pool.map(read, changed)):
+            state[uid] = item
+    return state
+
+
+def diffSnapshots(old, new):
+    """The journal of the changes between two IndexSnapshot."""
+    return diffEntries(snapshotState(old), snapshotState(new))
+
+
+def diffSource(fsource, snapshot):
+    """
+    The journal of the changes of `fsource` since `snapshot` was saved,
+    or None if the source cannot list its files.
+    """
+    old = snapshotState(snapshot)
+    new = sourceState(fsource, snapshot, old)
+    return None if new is None else diffEntries(old, new)
@@ -1,21 +1,32 @@
 from __future__ import annotations
 
 import json
+import sys
 import uuid
 from collections import namedtuple
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from enum import Enum
 from os import stat
 from pathlib import Path
-from threading import RLock
-from typing import Any, cast
+from threading import Lock, RLock
+from typing import cast
 
 import arrow
 
+from remedy.remarkable.compact import (
+    compactContent,
+    compactMetadata,
+    deepSizeOf,
+    expandContent,
+)
 from remedy.remarkable.filesource import FileSource
 from remedy.remarkable.lines import Layer, readLines
 from remedy.remarkable.pdfbase import PDFBase
+from remedy.remarkable.snapshot import entryIdentity
+from remedy.remarkable.tags import TagIndex
+from remedy.remarkable.writebehind import WriteBehind
 from remedy.utils import deepupdate, log
 
 Uid = str
@@ -49,7 +60,22 @@ class RemarkableUidCollision(RemarkableError):
 # - Consider an `update` method for Entry, triggering a save of json files on tablet
 
 
+def _int(value) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
 class Entry:
+    # The fields read all the time, decoded once from the metadata.
+    # The others are looked up in the raw metadata and content (see __getattr__),
+    # which are kept as read (or compacted, see RemarkableIndex.compact).
+    FIELDS = ('visibleName', 'parent', 'deleted', 'pinned', 'lastModified', 'version')
+
+    __slots__ = ('type_name', 'index', 'uid', '_metadata', '_content', '_dropped')
+    __slots__ += FIELDS
+
     @staticmethod
     def from_dict(index, uid, metadata, content) -> Entry:
         if 'type' not in metadata:
@@ -74,18 +100,68 @@ class Entry:
         self.type_name = type_name
         self.index = index
         self.uid = uid
-        self._metadata = metadata if metadata is not None else {}
-        self._content = content if content is not None else {}
+        metadata = metadata if metadata is not None else {}
+        content = content if content is not None else {}
 
-        self._metadata.setdefault('parent', ROOT_ID)
-        self._metadata.setdefault('deleted', False)
-        self._metadata.setdefault('visibleName', uid)
+        metadata.setdefault('parent', ROOT_ID)
+        metadata.setdefault('deleted', False)
+        metadata.setdefault('visibleName', uid)
+
+        self._dropped = None
+        if index.compact:
+            metadata = compactMetadata(metadata)
+            content, self._dropped = compactContent(content)
+        self._metadata = metadata
+        self._content = content
+        self._decode()
 
         self._postInit()
 
+    def _decode(self) -> None:
+        self.visibleName = self.get('visibleName')
+        self.parent = self.get('parent')
+        self.deleted = bool(self.get('deleted'))
+        self.pinned = bool(self.get('pinned'))
+        self.lastModified = _int(self.get('lastModified'))
+        self.version = _int(self.get('version')) or 0
+
+    def _setMetadata(self, metadata) -> None:
+        if self.index.compact:
+            metadata = compactMetadata(metadata)
+        self._metadata = metadata
+        self._decode()
+
+    def _setContent(self, content) -> None:
+        self._dropped = None
+        if self.index.compact:
+            content, self._dropped = compactContent(content)
+        self._content = content
+        self._decode()
+
+    def _restore(self) -> dict:
+        # Reads back the fields of the content left out by the compact mode
+        full = self.index._readJson(self.uid, 'content')
+        content = dict(self._content)
+        for field in self._dropped or ():
+            if field in full:
+                content[field] = full[field]
+        self._content = content
+        self._dropped = None
+        return content
+
+    def content(self) -> dict:
+        """A copy of the whole content, as plain JSON values, to be modified."""
+        if self._dropped:
+            self._restore()
+        return expandContent(self._content)
+
     def _postInit(self) -> None:
         pass
 
+    def invalidate(self) -> None:
+        """Forgets the side data read from the source, to read it again on use."""
+        pass
+
     def isRoot(self) -> bool:
         return self.uid == ROOT_ID and self.parent is None
 
@@ -137,10 +213,10 @@ class Entry:
         return self.get('coverPageNumber', self.get('lastOpenedPage', 0))
 
     def allDocTags(self):
-        return {t['name'] for t in self.tags or []}
+        return self.index.tags.docTagsOf(self.uid)
 
     def allPageTags(self):
-        return {t['name'] for t in self.pageTags or []}
+        return self.index.tags.pageTagsOf(self.uid)
 
     def allTags(self):
         return self.allDocTags() | self.allPageTags()
@@ -152,6 +228,9 @@ class Entry:
         if field in self._content:
             return self._content[field]
 
+        if self._dropped and field in self._dropped:
+            return self._restore().get(field, default)
+
         return default
 
     @property
@@ -159,23 +238,23 @@ class Entry:
         return self.index.fsource
 
     def __getattr__(self, field):
-        if field in self._metadata:
-            return self._metadata[field]
-
-        if field in self._content:
-            return self._content[field]
+        if field.startswith('_'):
+            raise AttributeError(field)
 
-        return None
+        return self.get(field)
 
     def __dir__(self):
         return (
             ['name', 'last_opened', 'last_updated', 'isDeleted', 'get', 'fsource']
             + list(self._metadata.keys())
             + list(self._content.keys())
+            + list(self._dropped or ())
         )
 
 
 class Folder(Entry):
+    __slots__ = ('files', 'folders')
+
     def _postInit(self) -> None:
         self.files: list[Uid] = []
         self.folders: list[Uid] = []
@@ -186,33 +265,140 @@ class Folder(Entry):
 
 
 class Unknown(Entry):
-    ...
+    __slots__ = ()
 
 
 ROOT_ID: Uid = ''
 TRASH_ID: Uid = 'trash'
 
 
+# Flags of the pages in Document.pageStates
+PAGE_MARKED = 1  # has strokes
+PAGE_HIGHLIGHTED = 2
+
+
 class Document(Entry):
+    # Side data, read from the source on first use
+    __slots__ = ('_markedIds', '_highlightedIds', '_pageStates', '_stamp')
+
+    def _postInit(self) -> None:
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        self._forgetPageFiles()
+
+    def _forgetPageFiles(self) -> None:
+        self._markedIds = None
+        self._highlightedIds = None
+        self._pageStates = None
+        self._stamp = None
+
+    def _folderStamp(self):
+        # Changes when files are added to or removed from the folders of the pages
+        return (
+            self.fsource.stat(self.uid),
+            self.fsource.stat(self.uid + '.highlights'),
+        )
+
+    def _listPageFiles(self) -> None:
+        self._stamp = self._folderStamp()
+        self._markedIds = set(self.fsource.listSubItems(self.uid, ext='rm'))
+        self._highlightedIds = set(
+            self.fsource.listSubItems(self.uid + '.highlights', ext='json')
+        )
+
+    def markedIds(self) -> set[str]:
+        """The ids of the pages with strokes."""
+        if self._markedIds is None:
+            self._listPageFiles()
+        return self._markedIds
+
+    def highlightedIds(self) -> set[str]:
+        """The ids of the pages with highlights."""
+        if self._highlightedIds is None:
+            self._listPageFiles()
+        return self._highlightedIds
+
+    def pageStates(self, refresh=False) -> bytearray:
+        """
+        The PAGE_MARKED and PAGE_HIGHLIGHTED flags of every page.
+        With `refresh`, the files of the pages are listed again
+        if their folders changed since (which takes a stat of each).
+        """
+        if refresh and self._stamp is not None:
+            if self._folderStamp() != self._stamp:
+                self._forgetPageFiles()
+        if self._pageStates is None:
+            marked, highlighted = self.markedIds(), self.highlightedIds()
+            pages = self.pages
+            if pages is None:
+                pages = [str(i) for i in range(self.num_pages())]
+            states = bytearray(len(pages))
+            for i, pid in enumerate(pages):
+                states[i] = (PAGE_MARKED if pid in marked else 0) | (
+                    PAGE_HIGHLIGHTED if pid in highlighted else 0
+                )
+            self._pageStates = states
+        return self._pageStates
+
     def getPageId(self, pageNum):
         if self.pages is None:
             return str(pageNum)
         else:
             return self.pages[pageNum]
 
+    def retrievePages(self, pageNums) -> dict[int, dict[str, str | None]]:
+        """
+        Retrieves the files of the pages `pageNums` all at once.
+        Returns, for each page, the local paths of its 'rm', 'metadata'
+        and 'highlights' files (None for those missing).
+        """
+        highlighted = self.highlightedIds()
+        wanted = {}
+        for pageNum in pageNums:
+            try:
+                pid = self.getPageId(pageNum)
+            except (IndexError, TypeError):
+                wanted[pageNum] = {}
+                continue
+            wanted[pageNum] = {
+                'rm': (self.uid, pid + '.rm'),
+                'metadata': (self.uid, pid + '-metadata.json'),
+            }
+            if pid in highlighted:
+                wanted[pageNum]['highlights'] = (
+                    self.uid + '.highlights',
+                    pid + '.json',
+                )
+        bundle = self.fsource.retrieveBundle(
+            [f for files in wanted.values() for f in files.values()]
+        )
+        return {
+            pageNum: {kind: bundle.get(f) for kind, f in files.items()}
+            for pageNum, files in wanted.items()
+        }
+
     def getPage(self, pageNum) -> Page:
+        return self._readPage(pageNum, self.retrievePages([pageNum])[pageNum])
+
+    def getPages(self, pageNums, chunk=16):
+        """The pages `pageNums`, retrieving the files of `chunk` of them at a time."""
+        pageNums = list(pageNums)
+        for i in range(0, len(pageNums), chunk):
+            files = self.retrievePages(pageNums[i : i + chunk])
+            for pageNum in pageNums[i : i + chunk]:
+                yield self._readPage(pageNum, files[pageNum])
+
+    def _readPage(self, pageNum, files) -> Page:
         try:
-            pid = self.getPageId(pageNum)
-            rmfile = self.fsource.retrieve(self.uid, pid, ext='rm')
-            with open(rmfile, 'rb') as f:
+            with open(files['rm'], 'rb') as f:
                 (ver, layers) = readLines(f)
         except:
             ver = 5
             layers = []
         else:
             try:
-                mfile = self.fsource.retrieve(self.uid, pid + '-metadata', ext='json')
-                with open(mfile) as f:
+                with open(files['metadata']) as f:
                     layerNames = json.load(f)
                 layerNames = layerNames['layers']
             except Exception:
@@ -220,11 +406,8 @@ class Document(Entry):
 
             highlights = {}
             try:
-                if self.fsource.exists(self.uid + '.highlights', pid, ext='json'):
-                    hfile = self.fsource.retrieve(
-                        self.uid + '.highlights', pid, ext='json'
-                    )
-                    with open(hfile) as f:
+                if files.get('highlights'):
+                    with open(files['highlights']) as f:
                         h = json.load(f).get('highlights', [])
                     for i in range(len(h)):
                         highlights[i] = h[i]
@@ -248,26 +431,21 @@ class Document(Entry):
         return 0
 
     def numHighlightedPages(self) -> int:
-        return sum(
-            1 for _ in self.fsource.listSubItems(self.uid + '.highlights', ext='json')
-        )
+        return sum(1 for s in self.pageStates() if s & PAGE_HIGHLIGHTED)
 
     def numMarkedPages(self) -> int:
-        return sum(1 for _ in self.fsource.listSubItems(self.uid, ext='rm'))
+        return sum(1 for s in self.pageStates() if s & PAGE_MARKED)
 
     def highlights(self):
         highlights = []
+        states = self.pageStates(refresh=True)
         pageCount = self.num_pages()
-        pages = self.pages
-        if pages is None:
-            pages = range(0, pageCount)
-        else:
-            pageCount = max(pageCount, len(pages))
+        if self.pages is not None:
+            pageCount = max(pageCount, len(self.pages))
 
-        pageRange = range(0, pageCount)
-        for i in pageRange:
-            pid = pages[i]
-            if self.fsource.exists(self.uid + '.highlights', pid, ext='json'):
+        for i in range(pageCount):
+            if i < len(states) and states[i] & PAGE_HIGHLIGHTED:
+                pid = self.getPageId(i)
                 hfile = self.fsource.retrieve(self.uid + '.highlights', pid, ext='json')
                 try:
                     with open(hfile) as f:
@@ -282,10 +460,8 @@ class Document(Entry):
         return highlights
 
     def marked(self, pageNum) -> bool:
-        pid = self.getPageId(pageNum)
-        return self.fsource.exists(self.uid, pid, ext='rm') or self.fsource.exists(
-            self.uid + '.highlights', pid, ext='json'
-        )
+        states = self.pageStates()
+        return pageNum < len(states) and states[pageNum] != 0
 
     def _makePage(self, layers, version, pageNum) -> Page:
         return Page(layers, version, pageNum, document=self)
@@ -330,16 +506,26 @@ Template = namedtuple('Template', ['name', 'path'])
 
 
 class Notebook(Document):
-    def _postInit(self) -> None:
-        try:
-            pfile = self.fsource.retrieve(self.uid, ext='pagedata')
-            with open(pfile, encoding='utf-8') as f:
-                self._bg = [t.rstrip('\n') for t in f.readlines()]
-        except OSError:
-            pass
+    __slots__ = ('_bg',)
+
+    def invalidate(self) -> None:
+        super().invalidate()
+        self._bg = None
+
+    def templateNames(self) -> list[str]:
+        """The names of the templates of the pages, from the pagedata."""
+        if self._bg is None:
+            try:
+                pfile = self.fsource.retrieve(self.uid, ext='pagedata')
+                with open(pfile, encoding='utf-8') as f:
+                    self._bg = [t.rstrip('\n') for t in f.readlines()]
+            except (OSError, TypeError):
+                self._bg = []
+        return self._bg
 
     def _makePage(self, layers, version, pageNum) -> Page:
-        t = self._bg[pageNum] if pageNum < len(self._bg) else None
+        bg = self.templateNames()
+        t = bg[pageNum] if pageNum < len(bg) else None
         if t:
             template = Template(t, path=(lambda: self.fsource.retrieveTemplate(t)))
         else:
@@ -349,15 +535,18 @@ class Notebook(Document):
 
 
 class PDFBasedDoc(Document):
-    def _postInit(self) -> None:
-        self._pdf = PDFBase(self)
+    __slots__ = ('_pdf',)
+
+    def invalidate(self) -> None:
+        super().invalidate()
+        self._pdf = None
 
     def _makePage(self, layers, version, pageNum) -> Page:
         return Page(layers, version, pageNum, document=self)
 
     def markedPages(self):
-        for i, p in enumerate(self.pages):
-            if self.fsource.exists(self.uid, p, ext='rm'):
+        for i, state in enumerate(self.pageStates(refresh=True)):
+            if state & PAGE_MARKED:
                 yield i
 
     def retrieveBaseDocument(self):
@@ -366,6 +555,16 @@ class PDFBasedDoc(Document):
             return self.fsource.retrieve(b)
         return None
 
+    def baseDocumentStat(self):
+        b = self.baseDocumentName()
+        return self.fsource.stat(b) if b else None
+
+    def baseDocumentBlocks(self):
+        # A BlockCache to read the base document without downloading it all,
+        # or None if the source has it at hand
+        b = self.baseDocumentName()
+        return self.fsource.retrieveBlocks(b) if b else None
+
     def shouldHaveBaseDocument(self):
         return True
 
@@ -374,6 +573,8 @@ class PDFBasedDoc(Document):
         return b and self.fsource.exists(b)
 
     def baseDocument(self):
+        if self._pdf is None:
+            self._pdf = PDFBase(self)
         return self._pdf
 
     def baseDocumentName(self):
@@ -382,7 +583,7 @@ class PDFBasedDoc(Document):
     def num_pages(self) -> int:
         result = super().num_pages()
         if result == 0:
-            return self._pdf.pageCount()
+            return self.baseDocument().pageCount()
 
         return result
 
@@ -473,14 +674,45 @@ FOLDER_METADATA = {
 }
 
 
+ETYPES = {
+    'notebook': EType.NOTEBOOK,
+    'pdf': EType.PDF,
+    'epub': EType.EPUB,
+    'folder': EType.FOLDER,
+}
+
+
 class RemarkableIndex:
     _upd_lock = RLock()
 
-    def __init__(self, fsource: FileSource, progress=(lambda x, tot: None)) -> None:
+    def __init__(
+        self,
+        fsource: FileSource,
+        progress=(lambda x, tot: None),
+        snapshot=None,
+        compact=False,
+        writeBehind=False,
+    ) -> None:
         self._reserved_uids: set[Uid] = set()
+        # Keep the entries small: shared strings, packed page ids,
+        # rarely used content fields read back only when asked for
+        self.compact = compact
+        # Updates change the index right away, their files are written
+        # in the background (see `flush`)
+        self._writes = None
+        if writeBehind:
+            self._writes = WriteBehind(fsource, onError=self._writeFailed)
+            fsource.addFlusher(self.flush)
+
+        # Derived from the hierarchy on first use, see `_invalidate`
+        self._chains: dict[Uid, tuple[Uid, ...]] = {}
+        self._paths: dict[Uid, dict[tuple, str]] = {}
+        self._deleted: dict[Uid, bool] = {}
+        self._cacheLock = Lock()
+        self._generation = 0
 
         self.fsource = fsource
-        uids = list(fsource.listItems())
+        self.snapshot = snapshot
         self.root = Folder(
             self,
             ROOT_ID,
@@ -506,44 +738,279 @@ class RemarkableIndex:
             type_name='trash',
         )
         self.index: dict[Uid, Entry] = {ROOT_ID: self.root, TRASH_ID: self.trash}
-        self.tags: dict[Uid, Any] = {}
-
-        j = 0
-        for j, uid in enumerate(uids):
-            progress(j, len(uids))
-
-            metadata = self.fsource.readJson(uid, ext='metadata')
-            content = self.fsource.readJson(uid, ext='content')
-
-            for t in content.get('tags', []):
-                if t['name'] not in self.tags:
-                    self.tags[t['name']] = {
-                        'docs': [],
-                        'pages': [],
-                    }
-                self.tags[t['name']]['docs'].append(uid)
-
-            for t in content.get('pageTags', []):
-                if t['name'] not in self.tags:
-                    self.tags[t['name']] = {
-                        'docs': [],
-                        'pages': [],
-                    }
-                self.tags[t['name']]['pages'].append({'doc': uid, 'page': t['pageId']})
-
-            self.index[uid] = Entry.from_dict(self, uid, metadata, content)
-
-        # create folders hierarchy
+        self.tags = TagIndex()
+
+        # When loaded from the snapshot, the source is read by `reconcile`
+        self.fromSnapshot = snapshot is not None and not snapshot.isEmpty()
+        if self.fromSnapshot:
+            for uid, metadata, content in snapshot.entries():
+                self.index[uid] = Entry.from_dict(self, uid, metadata, content)
+        else:
+            stats = fsource.listStats() if snapshot is not None else None
+            uids = list(fsource.listItems())
+            records = []
+
+            for uid, metadata, content, entry in self._readEntries(uids, progress):
+                if stats is not None:
+                    records.append((uid, metadata, content, entryIdentity(stats, uid)))
+
+                self.index[uid] = entry
+
+            if records:
+                snapshot.store(records)
+
+        self._indexTags()
+        self._buildHierarchy()
+
+    def _readEntries(self, uids, progress=(lambda x, tot: None)):
+        """
+        Reads the metadata and content of `uids` and builds their entries,
+        several at a time if the source allows it.
+        Yields (uid, metadata, content, entry) in the order of `uids`.
+        """
+
+        def read(uid):
+            metadata = self._readJson(uid, 'metadata')
+            content = self._readJson(uid, 'content')
+            return uid, metadata, content, Entry.from_dict(self, uid, metadata, content)
+
+        n = self.fsource.parallel_reads
+        pool = ThreadPoolExecutor(n, 'IndexReader') if n > 1 else None
+        try:
+            results = pool.map(read, uids) if pool else map(read, uids)
+            for j, result in enumerate(results):
+                progress(j, len(uids))
+                yield result
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+
+    def _readJson(self, uid: Uid, ext):
+        # As last stored, even if not written yet
+        if self._writes is not None:
+            content = self._writes.get(uid + '.' + ext)
+            if content is not None:
+                return content
+        return self.fsource.readJson(uid, ext=ext)
+
+    def _store(self, content, uid: Uid, ext, changes) -> None:
+        if self._writes is None:
+            self.fsource.store(content, uid + '.' + ext, overwrite=True)
+        else:
+            self._writes.store(content, uid + '.' + ext, changes)
+
+    def flush(self) -> None:
+        """
+        Waits for the files of the updates made so far to be written.
+        Not to be called holding the update lock.
+        """
+        if self._writes is not None:
+            self._writes.flush()
+
+    def _writeFailed(self, name, changes, exception) -> None:
+        uid, ext = name.rsplit('.', 1)
+        reread = False
+        with self._upd_lock:
+            # Back to what the source has, unless a later write is on its way
+            if uid in self.index and not self._writes.isPending(name):
+                try:
+                    self._reread(uid)
+                    reread = True
+                except Exception as e:
+                    log.error('Could not read %s back: %s', uid, e)
+        if reread:
+            entry = self.index[uid]
+            self._update_entry_prepare(uid, entry._metadata, entry._content)
+            self._update_entry_complete(uid, entry._metadata, entry._content)
+        if ext == 'metadata':
+            self._update_entry_error(exception, uid, changes, {})
+        else:
+            self._update_entry_error(exception, uid, {}, changes)
+
+    def _reread(self, uid: Uid) -> None:
+        for _, _, content, entry in self._readEntries([uid]):
+            old = self.index[uid]
+            if isinstance(old, Folder) and isinstance(entry, Folder):
+                entry.files, entry.folders = old.files, old.folders
+            self.index[uid] = entry
+            old.invalidate()
+            self._relocate(uid, self._placeOf(old), self._placeOf(entry))
+            self._invalidate(uid)
+            self.tags.add(uid, content)
+
+    def _indexTags(self) -> None:
+        tags = TagIndex()
+        for uid, entry in self.index.items():
+            if uid not in (ROOT_ID, TRASH_ID):
+                tags.add(uid, entry._content)
+        self.tags = tags
+
+    def _buildHierarchy(self) -> None:
+        self._invalidate()
+        for entry in self.index.values():
+            if isinstance(entry, Folder):
+                entry.files.clear()
+                entry.folders.clear()
+
         for uid, entry in self.index.items():
             parent = TRASH_ID if entry.deleted else entry.parent
             if parent is None:
                 continue
+            if parent not in self.index:
+                log.warning('Entry %s has a missing parent %s', uid, parent)
+                continue
 
             if entry.isFolder():
                 self.index[parent].folders.append(uid)
             else:
                 self.index[parent].files.append(uid)
 
+    def _placeOf(self, entry) -> Uid | None:
+        # The folder listing `entry` (see _buildHierarchy)
+        parent = TRASH_ID if entry.deleted else entry.parent
+        return parent if parent in self.index else None
+
+    def _relocate(self, uid: Uid, old: Uid | None, new: Uid | None) -> None:
+        # Moves `uid` from the lists of folder `old` to those of folder `new`
+        # (either None if it is not listed in one)
+        if old == new:
+            return
+        folder = self.index[uid].isFolder()
+        if old is not None:
+            items = self.index[old].folders if folder else self.index[old].files
+            if uid in items:
+                items.remove(uid)
+        if new is not None:
+            items = self.index[new].folders if folder else self.index[new].files
+            items.append(uid)
+
+    def reconcile(self, progress=(lambda x, tot: None)):
+        """
+        Brings an index loaded from the snapshot up to date with the source,
+        reading again only the entries whose files changed in the meantime,
+        and reports the changes through the `_new_entry_*`, `_update_entry_*`
+        and `_remove_entry_complete` hooks.
+        Returns the uids of the entries added, updated and removed.
+        """
+        return self.applyChanges(self.readChanges(progress))
+
+    def readChanges(self, progress=(lambda x, tot: None)):
+        """
+        The reading half of `reconcile`, which leaves the index untouched
+        and can thus run on another thread than those reading it.
+        Returns what to pass to `applyChanges`.
+        """
+        stats = self.fsource.listStats()
+        if stats is None or self.snapshot is None:
+            return None
+
+        known = self.snapshot.identities()
+        current = {
+            name[: -len('.metadata')] for name in stats if name.endswith('.metadata')
+        }
+        changed = [
+            uid for uid in current if known.get(uid) != entryIdentity(stats, uid)
+        ]
+
+        records = []
+        entries = {}
+        for uid, metadata, content, entry in self._readEntries(changed, progress):
+            records.append((uid, metadata, content, entryIdentity(stats, uid)))
+            entries[uid] = entry
+        progress(len(changed), len(changed))
+        return current, entries, records
+
+    def applyChanges(self, changes):
+        """
+        The second half of `reconcile`: updates the index with
+        the result of `readChanges`, moving only the entries changed.
+        """
+        if changes is None:
+            return [], [], []
+        current, entries, records = changes
+
+        # Imported here since the journal builds on this module
+        from remedy.remarkable.journal import diffEntries
+
+        added, updated = [], []
+        with self._upd_lock:
+            # Only the entries really changed, not just written again
+            before = {
+                uid: (self.index[uid]._metadata, self.index[uid]._content)
+                for uid in entries
+                if uid in self.index
+            }
+            after = {
+                uid: (entries[uid]._metadata, entries[uid]._content) for uid in before
+            }
+            different = {change.uid for change in diffEntries(before, after)}
+            places = {}
+            for uid, entry in entries.items():
+                old = self.index.get(uid)
+                if uid in self._reserved_uids:
+                    continue  # being created right now
+                if old is not None and old.version > entry.version:
+                    continue  # changed here since it was read
+                if old is not None and uid not in different:
+                    old.invalidate()  # its pages may have changed still
+                    continue
+                if old is not None:
+                    places[uid] = self._placeOf(old)
+                    if isinstance(old, Folder) and isinstance(entry, Folder):
+                        entry.files, entry.folders = old.files, old.folders
+                self.index[uid] = entry
+                if old is not None:
+                    # for those still holding the old entry
+                    old.invalidate()
+                (added if old is None else updated).append(uid)
+            # Once they are all in, for the new folders to be there
+            for uid in added + updated:
+                self._relocate(uid, places.get(uid), self._placeOf(self.index[uid]))
+                self._invalidate(uid)
+                self.tags.add(uid, self.index[uid]._content)
+            removed = [
+                uid
+                for uid in self.index
+                if uid not in current
+                and uid not in (ROOT_ID, TRASH_ID)
+                and uid not in self._reserved_uids
+            ]
+            for uid in removed:
+                self._invalidate(uid)
+                self._relocate(uid, self._placeOf(self.index[uid]), None)
+                self.tags.remove(uid)
+            for uid in removed:
+                del self.index[uid]
+        self.snapshot.store(records)
+        self.snapshot.remove(removed)
+
+        # Parents first, so that they are there when their children arrive
+        for uid in sorted(added, key=self._depth):
+            entry = self.index[uid]
+            etype = ETYPES.get(entry.type_name, EType.UNKNOWN)
+            self._new_entry_prepare(uid, etype, entry._metadata)
+            self._new_entry_complete(uid, etype, entry._metadata)
+        for uid in updated:
+            entry = self.index[uid]
+            self._update_entry_prepare(uid, entry._metadata, entry._content)
+            self._update_entry_complete(uid, entry._metadata, entry._content)
+        for uid in removed:
+            self._remove_entry_complete(uid)
+
+        log.info(
+            'Reconciled index: %d new, %d changed, %d removed',
+            len(added),
+            len(updated),
+            len(removed),
+        )
+        return added, updated, removed
+
+    def _depth(self, uid: Uid) -> int:
+        try:
+            return len(list(self.ancestryOf(uid)))
+        except ValueError:
+            return 0
+
     def _new_entry_prepare(self, uid: Uid, etype: EType, meta, path=None) -> None:
         pass  # for subclasses to specialise
 
@@ -567,6 +1034,18 @@ class RemarkableIndex:
     def _update_entry_error(self, exception, uid: Uid, new_meta, new_content) -> None:
         pass  # for subclasses to specialise
 
+    def _remove_entry_complete(self, uid: Uid) -> None:
+        pass  # for subclasses to specialise
+
+    def _update_entries_prepare(self, changes) -> None:
+        pass  # for subclasses to specialise
+
+    def _update_entries_complete(self, changes) -> None:
+        pass  # for subclasses to specialise
+
+    def _update_entries_error(self, exception, changes) -> None:
+        pass  # for subclasses to specialise
+
     def isReadOnly(self) -> bool:
         return self.fsource.isReadOnly()
 
@@ -579,16 +1058,83 @@ class RemarkableIndex:
     def allUids(self) -> Iterable[Uid]:
         return self.index.keys()
 
-    def ancestryOf(self, uid: Uid, includeSelf=False, reverse=True) -> Iterable[Uid]:
+    def footprint(self) -> dict[str, tuple[int, int]]:
+        """
+        The memory taken by the entries, as {type_name: (count, bytes)},
+        and by the tag index, under 'tags'.
+        What entries share (such as interned strings) is counted once.
+        """
+        seen = set()
+        usage = {}
+        for entry in list(self.index.values()):
+            size = sys.getsizeof(entry)
+            for cls in type(entry).__mro__:
+                for name in getattr(cls, '__slots__', ()):
+                    if name != 'index':
+                        size += deepSizeOf(getattr(entry, name, None), seen)
+            count, total = usage.get(entry.type_name, (0, 0))
+            usage[entry.type_name] = (count + 1, total + size)
+        usage['tags'] = (len(self.tags.uids), self.tags.footprint(seen))
+        return usage
+
+    def _remember(self, cache, uid: Uid, value, generation: int) -> None:
+        # Unless the hierarchy changed while computing it
+        with self._cacheLock:
+            if generation == self._generation:
+                cache[uid] = value
+
+    def _invalidate(self, uid: Uid | None = None) -> None:
+        """
+        Forgets the ancestry, paths and deletion state of `uid`
+        and of everything inside it, or of every entry.
+        """
+        with self._cacheLock:
+            self._generation += 1
+            if uid is None:
+                self._chains.clear()
+                self._paths.clear()
+                self._deleted.clear()
+                return
+            stack = [uid]
+            while stack:
+                u = stack.pop()
+                self._chains.pop(u, None)
+                self._paths.pop(u, None)
+                self._deleted.pop(u, None)
+                entry = self.index.get(u)
+                if isinstance(entry, Folder):
+                    stack.extend(entry.folders)
+                    stack.extend(entry.files)
+
+    def _chain(self, uid: Uid) -> tuple[Uid, ...]:
+        # uid and its ancestors, up to the root or trash (excluded)
+        chain = self._chains.get(uid)
+        if chain is not None:
+            return chain
+
+        generation = self._generation
         p: list[Uid] = []
-        while uid != TRASH_ID and uid != ROOT_ID:
-            if uid not in self.index:
-                raise ValueError(f'broken hierarchy: dangling index entry {uid}')
+        u = uid
+        while u != TRASH_ID and u != ROOT_ID:
+            known = self._chains.get(u)
+            if known is not None:
+                p.extend(known)
+                break
+
+            if u not in self.index:
+                raise ValueError(f'broken hierarchy: dangling index entry {u}')
+
+            p.append(u)
 
-            p.append(uid)
+            entry = self.get(u)
+            u = TRASH_ID if entry.deleted else entry.parent
 
-            entry = self.get(uid)
-            uid = TRASH_ID if entry.deleted else entry.parent
+        chain = tuple(p)
+        self._remember(self._chains, uid, chain, generation)
+        return chain
+
+    def ancestryOf(self, uid: Uid, includeSelf=False, reverse=True) -> Iterable[Uid]:
+        p = list(self._chain(uid))
 
         if not includeSelf:
             p = p[1:]
@@ -596,7 +1142,17 @@ class RemarkableIndex:
         return reversed(p) if reverse else p
 
     def pathOf(self, uid: Uid, includeSelf: bool = False, delim: str = '/') -> str:
-        return delim.join(self.nameOf(x) for x in self.ancestryOf(uid, includeSelf))
+        key = (includeSelf, delim)
+        paths = self._paths.get(uid)
+        if paths is not None and key in paths:
+            return paths[key]
+
+        generation = self._generation
+        p = delim.join(self.nameOf(x) for x in self.ancestryOf(uid, includeSelf))
+        with self._cacheLock:
+            if generation == self._generation:
+                self._paths.setdefault(uid, {})[key] = p
+        return p
 
     def fullPathOf(self, uid, includeSelf: bool = False) -> str:
         p = self.pathOf(uid, includeSelf=includeSelf)
@@ -618,18 +1174,24 @@ class RemarkableIndex:
         )
 
     def isIndirectlyDeleted(self, uid: Uid) -> bool:
-        return any(
-            self.isDeleted(a)
-            for a in self.ancestryOf(uid, includeSelf=True, reverse=False)
-        )
+        deleted = self._deleted.get(uid)
+        if deleted is None:
+            generation = self._generation
+            deleted = any(self.isDeleted(a) for a in self._chain(uid))
+            self._remember(self._deleted, uid, deleted, generation)
+        return deleted
 
     def __getattr__(self, field):
-        if field.endswith('Of'):
-            return (
-                lambda uid: self.index[uid].get(field[:-2])
-                if uid in self.index
-                else None
-            )
+        if field.endswith('Of') and not field.startswith('_'):
+            name = field[:-2]
+
+            def fieldOf(uid):
+                entry = self.index.get(uid)
+                return None if entry is None else entry.get(name)
+
+            # Found directly from now on
+            self.__dict__[field] = fieldOf
+            return fieldOf
         else:
             raise AttributeError(field)
 
@@ -690,6 +1252,7 @@ class RemarkableIndex:
 
             self.index[uid] = d = Folder(self, uid, meta, {}, type_name='folder')
             self.index[d.parent].folders.append(uid)
+            self.tags.add(uid, {})
             self._reserved_uids.discard(uid)
 
             self._new_entry_complete(uid, EType.FOLDER, metadata)
@@ -774,6 +1337,7 @@ class RemarkableIndex:
                 d = PDFBasedDoc(self, uid, meta, cont, type_name='epub')
             self.index[uid] = d
             self.index[d.parent].files.append(uid)
+            self.tags.add(uid, cont)
             self._reserved_uids.discard(uid)
 
             p(totBytes)
@@ -804,10 +1368,11 @@ class RemarkableIndex:
                 entry = self.get(uid)
 
                 if content:
-                    cont = deepcopy(entry._content)
+                    cont = entry.content()
                     deepupdate(cont, content)
-                    self.fsource.store(cont, uid + '.content', overwrite=True)
-                    entry._content = cont
+                    self._store(cont, uid, 'content', content)
+                    entry._setContent(cont)
+                    self.tags.add(uid, cont)
 
                 if metadata or content:  # if content changed, bump version
                     new_parent = old_parent = None  # flagging no reparenting needed
@@ -834,9 +1399,9 @@ class RemarkableIndex:
                     metadata.setdefault('metadatamodified', True)
                     metadata.setdefault('version', entry.version + 1)
                     deepupdate(meta, metadata)
-                    self.fsource.store(meta, uid + '.metadata', overwrite=True)
+                    self._store(meta, uid, 'metadata', metadata)
 
-                    entry._metadata = meta
+                    entry._setMetadata(meta)
                     if new_parent is not None:
                         if entry.isFolder():
                             old_parent.folders.remove(uid)
@@ -844,6 +1409,8 @@ class RemarkableIndex:
                         else:
                             old_parent.files.remove(uid)
                             new_parent.files.append(uid)
+                    if {'parent', 'deleted', 'visibleName'} & metadata.keys():
+                        self._invalidate(uid)
 
                 self._update_entry_complete(uid, metadata, content)
         except Exception as e:
@@ -858,14 +1425,202 @@ class RemarkableIndex:
     def rename(self, uid: Uid, new_name):
         self.update(uid, visibleName=new_name)
 
-    def newFolderWith(self, uids: list[Uid] = [], **metadata) -> None:
-        with self._upd_lock:
-            fuid = self.reserve_uid()
-            self.newFolder(fuid, **metadata)
-            for uid in uids:
-                self.update(uid, parent=fuid)
+    def transaction(self) -> Transaction:
+        return Transaction(self)
+
+    def newFolderWith(self, uids: list[Uid] = [], **metadata) -> Uid:
+        with self.transaction() as t:
+            fuid = t.newFolder(**metadata)
+            t.moveAll(uids, fuid)
+        return fuid
 
     def moveAll(self, uids, parent):
-        with self._upd_lock:
+        with self.transaction() as t:
+            t.moveAll(uids, parent)
+
+    def moveAllToTrash(self, uids):
+        with self.transaction() as t:
             for uid in uids:
-                self.update(uid, parent=parent)
+                t.moveToTrash(uid)
+
+    def updateAll(self, uids, **metadata):
+        """Applies the same changes of the metadata to all of `uids`."""
+        with self.transaction() as t:
+            for uid in uids:
+                t.update(uid, **metadata)
+
+
+class Transaction:
+    """
+    Changes to the metadata of several entries, made all at once:
+
+        with index.transaction() as t:
+            folder = t.newFolder(visibleName='Archive')
+            t.moveAll(uids, folder)
+
+    On leaving the block, the changes are checked together,
+    the files are written in one batch (see FileSource.storeBundle),
+    and the index is changed in one step, reported by the `_update_entries_*`
+    hooks (the new folders by the `_new_entry_*` ones).
+    Nothing changes if a check fails or the block raises an exception.
+    """
+
+    def __init__(self, index: RemarkableIndex) -> None:
+        self.index = index
+        self.changes: dict[Uid, dict] = {}
+        self.folders: dict[Uid, dict] = {}  # metadata of the new folders
+
+    def __enter__(self) -> Transaction:
+        return self
+
+    def __exit__(self, etype, exception, tb) -> bool:
+        if etype is None:
+            self.commit()
+        else:
+            self.index._reserved_uids.difference_update(self.folders)
+        return False
+
+    def update(self, uid: Uid, **metadata) -> None:
+        if uid in self.folders:
+            self.folders[uid].update(metadata)
+        else:
+            self.changes.setdefault(uid, {}).update(metadata)
+
+    def moveAll(self, uids, parent: Uid) -> None:
+        for uid in uids:
+            self.update(uid, parent=parent)
+
+    def moveToTrash(self, uid: Uid) -> None:
+        if not self.index.isDeleted(uid):
+            self.update(uid, parent=TRASH_ID)
+
+    def newFolder(self, **metadata) -> Uid:
+        index = self.index
+        uid = index.reserve_uid()
+        # As for RemarkableIndex.newFolder, the uid may be on the source
+        # but not yet in the index: take another one
+        while index.fsource.exists(uid, ext='metadata'):
+            taken = uid
+            uid = index.reserve_uid()
+            index._reserved_uids.discard(taken)
+        meta = FOLDER_METADATA.copy()
+        meta.setdefault('visibleName', 'New Folder')
+        meta.setdefault('lastModified', str(arrow.utcnow().int_timestamp * 1000))
+        meta.update(metadata)
+        self.folders[uid] = meta
+        return uid
+
+    def _check(self) -> dict[Uid, dict]:
+        # The new metadata of the entries changed, if the changes are consistent
+        index = self.index
+        if self.folders and index.isReadOnly():
+            raise RemarkableSourceError(
+                "The file source '%s' is read-only" % index.fsource.name
+            )
+        parents = {uid: meta['parent'] for uid, meta in self.folders.items()}
+        metas = {}
+        now = str(arrow.utcnow().int_timestamp * 1000)
+        for uid, metadata in self.changes.items():
+            if uid == ROOT_ID or uid == TRASH_ID:
+                raise RemarkableError('Cannot update root and trash entries')
+            if 'type' in metadata:
+                raise RemarkableError('Cannot change type of document')
+            entry = index.get(uid)
+            if 'parent' in metadata:
+                parents[uid] = metadata['parent']
+            changes = {
+                'lastModified': now,
+                'metadatamodified': True,
+                'version': entry.version + 1,
+            }
+            changes.update(metadata)
+            metas[uid] = meta = deepcopy(entry._metadata)
+            deepupdate(meta, changes)
+
+        def parentOf(uid):
+            if uid in parents:
+                return parents[uid]
+            entry = index.index.get(uid)
+            return None if entry is None else entry.parent
+
+        for uid, parent in parents.items():
+            if not (parent in self.folders or index.isFolder(parent)):
+                raise RemarkableError(
+                    'Cannot change parent of %s to %s which is not a folder'
+                    % (uid, parent)
+                )
+            seen = {uid}
+            p = parent
+            while p is not None and p != ROOT_ID:
+                if p in seen:
+                    raise RemarkableError(
+                        'Circularity would be introduced by making %s a parent of %s'
+                        % (parent, uid)
+                    )
+                seen.add(p)
+                p = parentOf(p)
+        return metas
+
+    def commit(self) -> None:
+        index = self.index
+        if not (self.changes or self.folders):
+            return
+        with index._upd_lock:
+            try:
+                index._update_entries_prepare(self.changes)
+                metas = self._check()
+                files = {}
+                for uid, meta in self.folders.items():
+                    files[uid + '.metadata'] = meta
+                    files[uid + '.content'] = {}
+                if index._writes is None:
+                    for uid, meta in metas.items():
+                        files[uid + '.metadata'] = meta
+                failed = index.fsource.storeBundle(files)
+                if failed:
+                    self._undo(files, failed)
+                    raise RemarkableError(
+                        'Could not write %s' % ', '.join(sorted(failed))
+                    )
+                if index._writes is not None:
+                    # Once the new folders are there, for the entries moved in them
+                    for uid, meta in metas.items():
+                        index._writes.store(meta, uid + '.metadata', self.changes[uid])
+
+                for uid, meta in self.folders.items():
+                    index.index[uid] = Folder(index, uid, meta, {}, type_name='folder')
+                    index.tags.add(uid, {})
+                # Once the new folders are all in, for those created in each other
+                for uid in self.folders:
+                    index._relocate(uid, None, index._placeOf(index.index[uid]))
+                for uid, meta in metas.items():
+                    entry = index.index[uid]
+                    old = index._placeOf(entry)
+                    entry._setMetadata(meta)
+                    index._relocate(uid, old, index._placeOf(entry))
+                for uid in metas:
+                    index._invalidate(uid)
+            except Exception as e:
+                index._update_entries_error(e, self.changes)
+                raise e
+            finally:
+                index._reserved_uids.difference_update(self.folders)
+
+        for uid, meta in self.folders.items():
+            index._new_entry_prepare(uid, EType.FOLDER, meta)
+            index._new_entry_complete(uid, EType.FOLDER, meta)
+        index._update_entries_complete(self.changes)
+
+    def _undo(self, files, failed) -> None:
+        # Puts back what was written before the failure, as far as possible
+        fsource = self.index.fsource
+        restore = {}
+        for name in files:
+            if name in failed:
+                continue
+            uid, ext = name.rsplit('.', 1)
+            if uid in self.folders:
+                fsource.remove(name)
+            elif ext == 'metadata':
+                restore[name] = self.index.index[uid]._metadata
+        fsource.storeBundle(restore)
@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import re
+from os import path
+
+from remedy.remarkable.batch import BatchJob, pdfStem, safeFilename, uniqueFilename
+from remedy.remarkable.metadata import ROOT_ID, Document
+from remedy.utils import log
+
+MANIFEST_NAME = '.remedy-mirror.json'
+MANIFEST_VERSION = 3
+
+
+def optionsKey(options):
+    """
+    A short digest of the export options,
+    so that changing them triggers a full re-export.
+    """
+
+    def plain(v):
+        if hasattr(v, 'toDict'):
+            return v.toDict()
+        if isinstance(v, (set, frozenset)):
+            return sorted(v)
+        return v
+
+    opt = {k: plain(v) for k, v in options.items()}
+    raw = json.dumps(opt, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def _stat(st):
+    return None if st is None else list(st)
+
+
+def _identity(entry, whichPages, optKey):
+    # Only what the PDF is made of: renaming, moving or pinning a document
+    # bumps its version, but is no reason to export it again
+    # (nor is opening it, which has the tablet rewrite its content)
+    fsource = entry.fsource
+    base = entry.baseDocumentStat() if hasattr(entry, 'baseDocumentStat') else None
+    return {
+        'base': _stat(base),
+        'strokes': {
+            pid: _stat(fsource.stat(entry.uid, pid, ext='rm'))
+            for pid in sorted(entry.markedIds())
+        },
+        'pages': list(entry.pages or []),
+        'orientation': entry.get('orientation'),
+        'transform': entry.get('transform'),
+        'whichPages': whichPages,
+        'options': optKey,
+    }
+
+
+class MirrorPlan:
+    def __init__(self):
+        self.exports = []  # (entry, relpath, identity)
+        self.moves = []  # (uid, old relpath, new relpath)
+        self.removals = []  # (uid, relpath)
+        self.unchanged = 0
+
+    def isEmpty(self):
+        return not (self.exports or self.moves or self.removals)
+
+    def __repr__(self):
+        return '<MirrorPlan: %d to export, %d to move, %d to remove, %d unchanged>' % (
+            len(self.exports),
+            len(self.moves),
+            len(self.removals),
+            self.unchanged,
+        )
+
+
+class LibraryMirror:
+    """
+    Keeps a directory of PDFs in sync with a folder of the library.
+
+    A manifest stored alongside the PDFs records what was exported
+    for every document, so that a refresh only exports new or changed
+    documents, moves the files of renamed/moved ones
+    and deletes the files of trashed ones.
+    """
+
+    def __init__(self, index, dest, uid=ROOT_ID, whichPages='', **options):
+        self.index = index
+        self.dest = dest
+        self.uid = uid
+        self.whichPages = whichPages
+        self.optKey = optionsKey(options)
+        self.manifestPath = path.join(dest, MANIFEST_NAME)
+        self.entries = self._loadManifest()
+        self._dirty = False
+
+    def _loadManifest(self):
+        try:
+            with open(self.manifestPath) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            log.warning('Ignoring unreadable mirror manifest: %s', e)
+            return {}
+        if (
+            manifest.get('version') != MANIFEST_VERSION
+            or manifest.get('root') != self.uid
+        ):
+            log.info('Mirror manifest is outdated, rebuilding the mirror')
+            return {}
+        return manifest.get('entries', {})
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(self.dest, exist_ok=True)
+        tmp = self.manifestPath + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(
+                {
+                    'version': MANIFEST_VERSION,
+                    'root': self.uid,
+                    'entries': self.entries,
+                },
+                f,
+            )
+        os.replace(tmp, self.manifestPath)
+        self._dirty = False
+
+    def _documents(self):
+        index = self.index
+        root = index.get(self.uid)
+        stack = [(root, '')]
+        while stack:
+            folder, folderPath = stack.pop()
+            for f in folder.files:
+                doc = index.get(f)
+                if isinstance(doc, Document) and not doc.isDeleted():
+                    yield doc, folderPath
+            for f in folder.folders:
+                sub = index.get(f)
+                if sub.type_name == 'trash' or sub.isDeleted():
+                    continue
+                stack.append((sub, path.join(folderPath, safeFilename(sub.name()))))
+
+    def plan(self):
+        plan = MirrorPlan()
+        docs = sorted(self._documents(), key=lambda d: d[0].uid)
+        present = {doc.uid for doc, _ in docs}
+        for uid, rec in self.entries.items():
+            if uid not in present:
+                plan.removals.append((uid, rec['path']))
+
+        # Files that can stay where they are keep their name,
+        # so that a clash does not shuffle the " (n)" suffixes around
+        taken = set()
+        keep = {}
+        for doc, folder in docs:
+            rec = self.entries.get(doc.uid)
+            if rec and _isVariantOf(rec['path'], folder, doc.visibleName):
+                if rec['path'] not in taken:
+                    taken.add(rec['path'])
+                    keep[doc.uid] = rec['path']
+
+        for doc, folder in docs:
+            rec = self.entries.get(doc.uid)
+            relpath = keep.get(doc.uid) or uniqueFilename(
+                folder, doc.visibleName, taken
+            )
+            ident = _identity(doc, self.whichPages, self.optKey)
+            if rec is None or not path.isfile(path.join(self.dest, rec['path'])):
+                plan.exports.append((doc, relpath, ident))
+                continue
+            if rec['path'] != relpath:
+                plan.moves.append((doc.uid, rec['path'], relpath))
+            if rec.get('identity') != ident:
+                plan.exports.append((doc, relpath, ident))
+            else:
+                plan.unchanged += 1
+        return plan
+
+    def apply(self, plan):
+        """
+        Performs the moves and removals of the plan,
+        and returns the jobs for the documents that need exporting.
+        """
+        for uid, relpath in plan.removals:
+            self._remove(relpath)
+            self.entries.pop(uid, None)
+            self._dirty = True
+
+        # Two passes, so that swapping names does not overwrite a file
+        staged = []
+        for uid, old, new in plan.moves:
+            tmp = path.join(self.dest, '.remedy-move-%s.pdf' % uid)
+            try:
+                os.replace(path.join(self.dest, old), tmp)
+                staged.append((uid, old, tmp, new))
+            except OSError as e:
+                log.warning('Could not move %s: %s', old, e)
+                self.entries.pop(uid, None)
+        for uid, old, tmp, new in staged:
+            target = path.join(self.dest, new)
+            os.makedirs(path.dirname(target), exist_ok=True)
+            os.replace(tmp, target)
+            self._prune(path.dirname(path.join(self.dest, old)))
+            self.entries[uid]['path'] = new
+            log.info('Moved %s to %s', old, new)
+        if plan.moves:
+            self._dirty = True
+        self.save()
+
+        self._pending = {}
+        jobs = []
+        for doc, relpath, ident in plan.exports:
+            job = BatchJob(
+                doc, path.join(self.dest, relpath), self.whichPages or [slice(None)]
+            )
+            self._pending[doc.uid] = (relpath, ident)
+            jobs.append(job)
+        return jobs
+
+    def exported(self, uid, filename=None):
+        """Records the successful export of a job returned by `apply`."""
+        relpath, ident = self._pending.pop(uid)
+        self.entries[uid] = {'path': relpath, 'identity': ident}
+        self._dirty = True
+
+    def _remove(self, relpath):
+        fullpath = path.join(self.dest, relpath)
+        try:
+            os.remove(fullpath)
+            log.info('Removed %s', relpath)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning('Could not remove %s: %s', relpath, e)
+            return
+        self._prune(path.dirname(fullpath))
+
+    def _prune(self, d):
+        # Removes the folders left empty, up to the mirror's root
+        root = path.abspath(self.dest)
+        d = path.abspath(d)
+        while d != root and d.startswith(root):
+            try:
+                os.rmdir(d)
+            except OSError:
+                return
+            d = path.dirname(d)
+
+
+def _isVariantOf(relpath, folder, name):
+    if path.dirname(relpath) != folder:
+        return False
+    stem = re.escape(pdfStem(name))
+    return re.fullmatch(stem + r'( \(\d+\))?\.pdf', path.basename(relpath)) is not None
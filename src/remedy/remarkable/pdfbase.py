@@ -1,5 +1,19 @@
+import hashlib
+import io
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import path
 from threading import RLock
 
+from PyPDF2 import PdfFileReader, PdfFileWriter
+from PyPDF2.generic import ArrayObject, DictionaryObject, NameObject
+from PyPDF2.pdf import PageObject
 from PyQt5.QtGui import QImage
 
 import remedy.remarkable.constants as rm
@@ -30,19 +44,363 @@ except ImportError:
 # Since we are not using metadata as standalone, here we compromise.
 
 
+class PageImageCache:
+    """
+    LRU cache of rendered pages, bounded by the bytes of the images.
+    Pages evicted from memory can be kept in a folder on disk
+    (bounded too, dropping the least recently used files first).
+    """
+
+    MAGIC = b'RMPC'
+    HEADER = struct.Struct('<4sIIII')
+
+    def __init__(self, budget=256 * 2**20, disk_budget=1024 * 2**20):
+        self.budget = budget
+        self.disk_budget = disk_budget
+        self._images = OrderedDict()
+        self._size = 0
+        self._diskUsage = {}
+        self._lock = RLock()
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._size = 0
+
+    def get(self, key, cache_dir=None):
+        with self._lock:
+            item = self._images.get(key)
+            if item is not None:
+                self._images.move_to_end(key)
+                return item[0]
+        img = None
+        if cache_dir:
+            img = self._readDisk(key, cache_dir)
+            if img is not None:
+                self._store(key, img, cache_dir, onDisk=True)
+        return img
+
+    def put(self, key, img, cache_dir=None):
+        self._store(key, img, cache_dir)
+
+    def flush(self):
+        """Writes to disk the pages that are only in memory, e.g. before exiting."""
+        with self._lock:
+            unsaved = [
+                (k, item) for k, item in self._images.items() if item[1] and not item[2]
+            ]
+            for k, (im, folder, _) in unsaved:
+                self._images[k] = (im, folder, True)
+        for k, (im, folder, _) in unsaved:
+            self._writeDisk(k, im, folder)
+
+    def _store(self, key, img, cache_dir=None, onDisk=False):
+        # Pages are only written to disk once evicted from memory
+        # (and if not read from there in the first place)
+        n = img.sizeInBytes()
+        evicted = []
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self._size -= old[0].sizeInBytes()
+            if n > self.budget:
+                evicted.append((key, (img, cache_dir, onDisk)))
+            else:
+                self._images[key] = (img, cache_dir, onDisk)
+                self._size += n
+            while self._size > self.budget:
+                k, item = self._images.popitem(last=False)
+                self._size -= item[0].sizeInBytes()
+                evicted.append((k, item))
+        for k, (im, folder, saved) in evicted:
+            if folder and not saved:
+                self._writeDisk(k, im, folder)
+
+    @staticmethod
+    def _folder(cache_dir):
+        return path.join(cache_dir, 'pages')
+
+    def _filename(self, key, cache_dir):
+        h = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return path.join(self._folder(cache_dir), h + '.page')
+
+    def _readDisk(self, key, cache_dir):
+        fn = self._filename(key, cache_dir)
+        try:
+            with open(fn, 'rb') as f:
+                magic, w, h, bpl, fmt = self.HEADER.unpack(f.read(self.HEADER.size))
+                data = zlib.decompress(f.read())
+            if magic != self.MAGIC:
+                return None
+            os.utime(fn)
+            return QImage(data, w, h, bpl, QImage.Format(fmt)).copy()
+        except (OSError, struct.error, zlib.error):
+            return None
+
+    def _writeDisk(self, key, img, cache_dir):
+        folder = self._folder(cache_dir)
+        fn = self._filename(key, cache_dir)
+        tmp = '%s.%d.tmp' % (fn, os.getpid())
+        try:
+            os.makedirs(folder, exist_ok=True)
+            header = self.HEADER.pack(
+                self.MAGIC,
+                img.width(),
+                img.height(),
+                img.bytesPerLine(),
+                int(img.format()),
+            )
+            data = zlib.compress(img.constBits().asstring(img.sizeInBytes()), 1)
+            with open(tmp, 'wb') as f:
+                f.write(header)
+                f.write(data)
+            os.replace(tmp, fn)
+        except OSError as e:
+            log.debug('Could not cache page on disk: %s', e)
+            return
+        with self._lock:
+            usage = self._diskUsage.get(folder)
+            if usage is None:
+                usage = sum(e.stat().st_size for e in os.scandir(folder) if e.is_file())
+            else:
+                usage += len(header) + len(data)
+            if usage > self.disk_budget:
+                usage = self._trimDisk(folder)
+            self._diskUsage[folder] = usage
+
+    def _trimDisk(self, folder):
+        files = sorted(
+            (e.stat().st_mtime, e.stat().st_size, e.path)
+            for e in os.scandir(folder)
+            if e.is_file()
+        )
+        usage = sum(size for _, size, _ in files)
+        # Trim a bit more than needed, to avoid trimming at every page
+        for _, size, fn in files:
+            if usage <= self.disk_budget * 0.8:
+                break
+            try:
+                os.remove(fn)
+                usage -= size
+            except OSError:
+                pass
+        return usage
+
+
+# Shared by all the documents, so that the viewer, thumbnails and OCR
+# reuse each other's renderings
+pageCache = PageImageCache()
+
+
+class DocumentPool:
+    """
+    Opened documents, one per file and thread:
+    neither fitz nor Poppler documents can be used by several threads at once,
+    but different documents for the same file can.
+    At most `max_handles` unused documents are kept open,
+    and those unused for `idle_timeout` seconds get closed.
+    """
+
+    def __init__(self, opener, closer=None, max_handles=8, idle_timeout=60):
+        self._opener = opener
+        self._closer = closer
+        self.max_handles = max_handles
+        self.idle_timeout = idle_timeout
+        # (filename, thread) -> [document, last used, users]
+        self._handles = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._handles)
+
+    @contextmanager
+    def handle(self, filename):
+        key = (filename, threading.get_ident())
+        with self._lock:
+            h = self._handles.pop(key, None)
+            if h is not None:
+                self._handles[key] = h
+                h[2] += 1
+        if h is None:
+            h = [self._opener(filename), 0, 1]
+            with self._lock:
+                self._handles[key] = h
+        try:
+            yield h[0]
+        finally:
+            with self._lock:
+                h[1] = time.monotonic()
+                h[2] -= 1
+            self.evict()
+
+    def evict(self, everything=False):
+        now = time.monotonic()
+        closing = []
+        with self._lock:
+            idle = [k for k, h in self._handles.items() if h[2] == 0]
+            excess = len(idle) - self.max_handles
+            for k in idle:  # least recently used first
+                h = self._handles[k]
+                if everything or excess > 0 or now - h[1] > self.idle_timeout:
+                    closing.append(self._handles.pop(k)[0])
+                    excess -= 1
+        if self._closer:
+            for doc in closing:
+                try:
+                    self._closer(doc)
+                except Exception as e:
+                    log.debug('Error closing document: %s', e)
+
+
+_INHERITABLE = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+# Links from annotations to other objects, which could drag in the whole file
+_ANNOT_LINKS = ('/P', '/Parent', '/Popup', '/IRT', '/A', '/Dest')
+
+
+def pdfPageCount(reader):
+    return int(reader.trailer['/Root'].getObject()['/Pages'].getObject()['/Count'])
+
+
+def _pageNode(reader, i):
+    # Walks down the page tree using the page counts of its nodes,
+    # so that only the nodes on the way to the page are read
+    node = reader.trailer['/Root'].getObject()['/Pages'].getObject()
+    inherited = {}
+    while node.get('/Type') == '/Pages':
+        inherited.update((k, node[k]) for k in _INHERITABLE if k in node)
+        kids = node['/Kids'].getObject()
+        if len(kids) == node['/Count']:
+            # All leaves
+            node = kids[i].getObject()
+            continue
+        for kid in kids:
+            kid = kid.getObject()
+            n = kid.get('/Count', 1) if kid.get('/Type') == '/Pages' else 1
+            if i < n:
+                node = kid
+                break
+            i -= n
+        else:
+            raise IndexError('Page out of range')
+    return node, inherited
+
+
+def extractPage(reader, i):
+    """
+    A PDF with only page `i` of the PDF read by `reader` (a PdfFileReader)
+    and the objects it needs, without reading the rest of the file.
+    """
+    node, inherited = _pageNode(reader, i)
+    page = PageObject(reader)
+    page.update(inherited)
+    for k, v in node.items():
+        if k not in ('/Parent', '/B', '/Annots'):
+            page[NameObject(k)] = v
+    annots = node.get('/Annots')
+    if annots:
+        page[NameObject('/Annots')] = ArrayObject(
+            DictionaryObject(
+                (k, v) for k, v in a.getObject().items() if k not in _ANNOT_LINKS
+            )
+            for a in annots.getObject()
+        )
+    writer = PdfFileWriter()
+    writer.addPage(page)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+class PageGeometry:
+    """
+    The number of pages of a PDF and the size and rotation of its pages,
+    recorded in a small JSON file so that they are known without opening it.
+    The record is discarded when the size or modification time of the PDF change.
+    Without a file, the record only lasts for the session.
+    """
+
+    VERSION = 1
+
+    def __init__(self, filename, identity):
+        self.filename = filename
+        self.identity = list(identity)
+        self.count = None
+        self.pages = {}  # page -> (width, height, rotation)
+        self._lock = RLock()
+        self._load()
+
+    def _load(self):
+        if not self.filename:
+            return
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != self.VERSION or data.get('identity') != self.identity:
+            return
+        self.count = data.get('count')
+        self.pages = {int(i): tuple(g) for i, g in data.get('pages', {}).items()}
+
+    def page(self, i):
+        return self.pages.get(i)
+
+    def record(self, count=None, pages=None):
+        with self._lock:
+            changed = False
+            if count is not None and count != self.count:
+                self.count = count
+                changed = True
+            for i, g in (pages or {}).items():
+                if self.pages.get(i) != g:
+                    self.pages[i] = g
+                    changed = True
+            if changed:
+                self._save()
+
+    def _save(self):
+        if not self.filename:
+            return
+        tmp = '%s.%d.tmp' % (self.filename, os.getpid())
+        try:
+            os.makedirs(path.dirname(self.filename), exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump(
+                    {
+                        'version': self.VERSION,
+                        'identity': self.identity,
+                        'count': self.count,
+                        'pages': self.pages,
+                    },
+                    f,
+                )
+            os.replace(tmp, self.filename)
+        except OSError as e:
+            log.debug('Could not save page geometry: %s', e)
+
+
 class _PDFBase:
-    _pdfDoc = None
+    _file = None
+    _identity = None
+    _geometry = None
+    _pool = None
+    # Whether the renderer can read the base document from a BlockCache
+    _partial = False
 
     # ABSTRACT
-    def _loadPdf(self):
-        pass
+    def _pageOf(self, doc, i):
+        return None
 
-    def _originalPage(self, i):
+    def _pageGeometry(self, page):
+        # (width, height, rotation) of the page, in points
         return None
 
-    def toImage(self, i, scale=1):
+    def _render(self, page, scale=1, clip=None):
         return QImage()
 
+    def _count(self, doc):
+        return 0
+
     # END ABSTRACT
 
     def __init__(self, entry):
@@ -51,9 +409,31 @@ class _PDFBase:
     def canRender(self):
         return False
 
-    def _pdf(self):
-        self._loadPdf()
-        return self._pdfDoc
+    def _filename(self):
+        # The path of the base document, or the BlockCache to read it from
+        if self._file is None and self._partial:
+            blocks = getattr(self._entry, 'baseDocumentBlocks', None)
+            try:
+                self._file = blocks() if blocks else None
+            except Exception as e:
+                log.debug('Cannot read %s in blocks: %s', self._entry.uid, e)
+        if self._file is None:
+            doc = self._entry.retrieveBaseDocument()
+            if doc is None:
+                log.warning('Base document for %s could not be found', self._entry.uid)
+            else:
+                self._file = str(doc)
+        return self._file
+
+    @contextmanager
+    def _document(self):
+        # The calling thread's own document, or None
+        filename = self._filename() if self._pool is not None else None
+        if filename is None:
+            yield None
+        else:
+            with self._pool.handle(filename) as doc:
+                yield doc
 
     def path(self):
         return self._entry.retrieveBaseDocument()
@@ -69,124 +449,240 @@ class _PDFBase:
                 i = None
         return i
 
-    def _page(self, i):
-        return self._originalPage(self.originalPageNum(i))
+    def geometry(self):
+        """The PageGeometry of the base document, or None if not available."""
+        if self._geometry is None:
+            self._geometry = False
+            stat = getattr(self._entry, 'baseDocumentStat', None)
+            try:
+                identity = stat() if stat else None
+            except Exception as e:
+                log.debug('Cannot stat the base of %s: %s', self._entry.uid, e)
+                identity = None
+            if identity is not None:
+                d = self._cacheDir()
+                fn = path.join(d, 'geometry', self._entry.uid + '.json') if d else None
+                self._geometry = PageGeometry(fn, identity)
+        return self._geometry or None
 
     def pageCount(self):
-        return 0
+        geo = self.geometry()
+        if geo and geo.count is not None:
+            return geo.count
+        pages = None
+        with self._document() as doc:
+            if not doc:
+                return 0
+            n = self._count(doc)
+            # Measuring all the pages at once is cheap for local files
+            if geo and isinstance(self._file, str):
+                pages = {i: self._pageGeometry(self._pageOf(doc, i)) for i in range(n)}
+        if geo:
+            geo.record(n, pages)
+        return n
+
+    def pageGeometry(self, i):
+        """
+        (width, height, rotation) of the page of the base document shown
+        on page `i`, or None.
+        """
+        page = self.originalPageNum(i)
+        if page is None:
+            return None
+        geo = self.geometry()
+        g = geo.page(page) if geo else None
+        if g is None:
+            with self._document() as doc:
+                if doc is None:
+                    return None
+                g = self._pageGeometry(self._pageOf(doc, page))
+            if geo:
+                geo.record(pages={page: g})
+        return g
+
+    def isLandscape(self, i):
+        g = self.pageGeometry(i)
+        return g is not None and g[0] > g[1]
+
+    def _renderImage(self, i, scale=1, clip=None):
+        page = self.originalPageNum(i)
+        if page is not None:
+            with self._document() as doc:
+                if doc:
+                    return self._render(self._pageOf(doc, page), scale, clip)
+        return QImage()
+
+    def _cacheKey(self, i, scale):
+        page = self.originalPageNum(i)
+        g = self.pageGeometry(i)
+        if g is None:
+            return None
+        rot = 270 if g[0] > g[1] else 0
+        if self._identity is None:
+            geo = self.geometry()
+            if geo:
+                # Known without retrieving the file
+                self._identity = tuple(geo.identity)
+            elif isinstance(self._filename(), str):
+                st = os.stat(self._file)
+                self._identity = (self._file, st.st_size, st.st_mtime_ns)
+            else:
+                self._identity = self._file.identity()
+        return (self._entry.uid, self._identity, page, float(scale), rot)
+
+    def _cacheDir(self):
+        fsource = getattr(self._entry, 'fsource', None)
+        return fsource.cache_dir if fsource else None
+
+    def isCached(self, i, scale=1):
+        """Whether `toImage(i, scale)` would return without rendering."""
+        try:
+            key = self._cacheKey(i, scale)
+        except Exception:
+            return False
+        return key is not None and pageCache.get(key, self._cacheDir()) is not None
+
+    def toImage(self, i, scale=1, clip=None):
+        # clip is a QRect of the resulting image to restrict the rendering to;
+        # clipped renderings are not cached
+        if clip is not None:
+            return self._renderImage(i, scale, clip)
+        try:
+            key = self._cacheKey(i, scale)
+        except Exception as e:
+            log.debug('Page %s of %s cannot be cached: %s', i, self._entry.uid, e)
+            key = None
+        if key is None:
+            return self._renderImage(i, scale)
+        img = pageCache.get(key, self._cacheDir())
+        if img is None:
+            img = self._renderImage(i, scale)
+            if not img.isNull():
+                pageCache.put(key, img, self._cacheDir())
+        return img
 
 
 if RENDERER == MUPDF:
+    from remedy.remarkable.renderpool import imageOf, pixmapOf, renderService
+
+    class RemotePDF:
+        """
+        Stands in for a fitz document, reading from a BlockCache:
+        each page is extracted into a PDF of its own to be opened by fitz,
+        so only the objects of the pages shown are downloaded.
+        """
+
+        def __init__(self, blocks, max_pages=4):
+            self._reader = PdfFileReader(blocks.open(), strict=False)
+            self._docs = OrderedDict()
+            self.max_pages = max_pages
+
+        def __len__(self):
+            return pdfPageCount(self._reader)
+
+        def __getitem__(self, i):
+            doc = self._docs.pop(i, None)
+            if doc is None:
+                doc = fitz.open('pdf', extractPage(self._reader, i))
+            self._docs[i] = doc
+            while len(self._docs) > self.max_pages:
+                self._docs.popitem(last=False)[1].close()
+            return doc[0]
+
+        def close(self):
+            for doc in self._docs.values():
+                doc.close()
+            self._docs.clear()
+            self._reader.stream.close()
+
+    def _openMuPDF(source):
+        if isinstance(source, str):
+            return fitz.open(source)
+        return RemotePDF(source)
 
     class PDFBase(_PDFBase):
+        _pool = DocumentPool(_openMuPDF, lambda doc: doc.close())
+        _partial = True
+
         def canRender(self):
             return True
 
-        def _loadPdf(self):
-            if self._pdfDoc is None:
-                doc = self._entry.retrieveBaseDocument()
-                if doc is None:
-                    log.warning(
-                        'Base document for %s could not be found', self._entry.uid
-                    )
-                else:
-                    self._pdfDoc = fitz.open(doc)
-
-        def _originalPage(self, i):
-            if i is not None:
-                pdf = self._pdf()
-                if pdf:
-                    return pdf[i]
-            return None
+        def _pageOf(self, doc, i):
+            return doc[i]
+
+        def _pageGeometry(self, page):
+            sz = page.mediabox
+            return (sz.width, sz.height, page.rotation)
 
-        def toImage(self, i, scale=1):
-            pdf = self._pdf()
-            if pdf:
-                page = self._page(i)
-                if page:
-                    sz = page.mediabox
-                    w, h = sz.width, sz.height
-                    if w <= h:
-                        ratio = min(rm.WIDTH / w, rm.HEIGHT / h) / 72
-                    else:
-                        ratio = min(rm.HEIGHT / w, rm.WIDTH / h) / 72
-                    m = fitz.Matrix(scale * ratio, scale * ratio)
-                    if w > h:
-                        m.prerotate(270)
-                    pix = page.get_pixmap(alpha=False, matrix=m)
-                    return QImage(
-                        pix.samples,
-                        pix.width,
-                        pix.height,
-                        pix.stride,  # length of one image line in bytes
-                        QImage.Format_RGB888,
-                    )
-            return QImage()
-
-        def pageCount(self):
-            pdf = self._pdf()
-            return len(pdf) if pdf else 0
+        def _render(self, page, scale=1, clip=None):
+            if clip is not None:
+                clip = (clip.x(), clip.y(), clip.width(), clip.height())
+            return imageOf(pixmapOf(page, scale, clip))
+
+        def _renderImage(self, i, scale=1, clip=None):
+            filename = self._filename() if renderService.enabled() else None
+            if not isinstance(filename, str):
+                return super()._renderImage(i, scale, clip)
+            page = self.originalPageNum(i)
+            if page is None:
+                return QImage()
+            if clip is not None:
+                clip = (clip.x(), clip.y(), clip.width(), clip.height())
+            return renderService.render(filename, page, scale, clip)
+
+        def _count(self, doc):
+            return len(doc)
 
 elif RENDERER == POPPLER:
 
+    def _openPoppler(filename):
+        doc = Poppler.Document.load(filename)
+        doc.setRenderHint(Poppler.Document.Antialiasing)
+        doc.setRenderHint(Poppler.Document.TextAntialiasing)
+        try:
+            doc.setRenderHint(Poppler.Document.HideAnnotations)
+        except Exception:
+            pass
+        return doc
+
     class PDFBase(_PDFBase):
-        lock = RLock()
+        _pool = DocumentPool(_openPoppler)
 
         def canRender(self):
             return True
 
-        def _loadPdf(self):
-            with self.lock:
-                if self._pdfDoc is None:
-                    doc = self._entry.retrieveBaseDocument()
-                    if doc is None:
-                        log.warning(
-                            'Base document for %s could not be found', self._entry.uid
-                        )
-                    else:
-                        self._pdfDoc = Poppler.Document.load(doc)
-                        self._pdfDoc.setRenderHint(Poppler.Document.Antialiasing)
-                        self._pdfDoc.setRenderHint(Poppler.Document.TextAntialiasing)
-                        try:
-                            self._pdfDoc.setRenderHint(Poppler.Document.HideAnnotations)
-                        except Exception:
-                            pass
-
-        def _originalPage(self, i):
-            if i is not None:
-                pdf = self._pdf()
-                if pdf:
-                    return pdf.page(i)
-            return None
-
-        def toImage(self, i, scale=1):
-            pdf = self._pdf()
-            if pdf:
-                with self.lock:
-                    page = self._page(i)
-                    if page:
-                        sz = page.pageSize()
-                        w, h = sz.width(), sz.height()
-                        if w <= h:
-                            ratio = min(rm.WIDTH / w, rm.HEIGHT / h)
-                        else:
-                            ratio = min(rm.HEIGHT / w, rm.WIDTH / h)
-                        xres = scale * ratio
-                        yres = scale * ratio
-                        if w <= h:
-                            return page.renderToImage(xres, yres)
-                        else:
-                            return page.renderToImage(
-                                xres, yres, -1, -1, -1, -1, page.Rotate270
-                            )
-            return QImage()
-
-        def pageCount(self):
-            pdf = self._pdf()
-            if pdf:
-                with self.lock:
-                    return pdf.numPages()
-            return 0
+        def _pageOf(self, doc, i):
+            return doc.page(i)
+
+        def _pageGeometry(self, page):
+            sz = page.pageSize()
+            rot = {
+                Poppler.Page.Landscape: 90,
+                Poppler.Page.UpsideDown: 180,
+                Poppler.Page.Seascape: 270,
+            }.get(page.orientation(), 0)
+            return (sz.width(), sz.height(), rot)
+
+        def _render(self, page, scale=1, clip=None):
+            sz = page.pageSize()
+            w, h = sz.width(), sz.height()
+            if w <= h:
+                ratio = min(rm.WIDTH / w, rm.HEIGHT / h)
+            else:
+                ratio = min(rm.HEIGHT / w, rm.WIDTH / h)
+            xres = scale * ratio
+            yres = scale * ratio
+            if clip is None:
+                rect = (-1, -1, -1, -1)
+            else:
+                rect = (clip.x(), clip.y(), clip.width(), clip.height())
+            if w <= h:
+                return page.renderToImage(xres, yres, *rect)
+            else:
+                return page.renderToImage(xres, yres, *rect, page.Rotate270)
+
+        def _count(self, doc):
+            return doc.numPages()
 
 else:
 
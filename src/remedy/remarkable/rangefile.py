@@ -0,0 +1,172 @@
+import io
+import os
+import struct
+from os import path
+from threading import RLock
+
+from remedy.utils import log
+
+BLOCK_SIZE = 64 * 1024
+
+
+class BlockCache:
+    """
+    A local copy of a remote file, downloaded block by block as it is read.
+
+    The blocks are written at their place in a sparse `<local>.part` file
+    and the list of those already there is kept in `<local>.blocks`,
+    so that they survive across sessions.
+    Once every block is there, the part file becomes `local`
+    with the modification time of the remote file,
+    as if it had been downloaded in one go.
+
+    `fetch(ranges)` reads a list of (offset, length) of the remote file
+    and returns the data of each.
+    """
+
+    HEADER = struct.Struct('<QdI')
+
+    def __init__(self, fetch, size, mtime, local, blockSize=BLOCK_SIZE, lock=None):
+        self._fetch = fetch
+        self.size = size
+        self.mtime = mtime
+        self.local = local
+        self.blockSize = blockSize
+        self.fetched = 0  # bytes downloaded by this instance
+        self._lock = lock or RLock()
+        self._count = (size + blockSize - 1) // blockSize
+        self._part = local + '.part'
+        self._blocksPath = local + '.blocks'
+        self._present = self._loadBlocks()
+
+    def identity(self):
+        return (self.local, self.size, self.mtime)
+
+    def isComplete(self):
+        return all(self._present)
+
+    def _loadBlocks(self):
+        try:
+            with open(self._blocksPath, 'rb') as f:
+                header = f.read(self.HEADER.size)
+                present = bytearray(f.read())
+            if (
+                self.HEADER.unpack(header) == (self.size, self.mtime, self.blockSize)
+                and len(present) == self._count
+                and path.isfile(self._part)
+            ):
+                return present
+        except (OSError, struct.error):
+            pass
+        return bytearray(self._count)
+
+    def _saveBlocks(self):
+        tmp = self._blocksPath + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.HEADER.pack(self.size, self.mtime, self.blockSize))
+            f.write(self._present)
+        os.replace(tmp, self._blocksPath)
+
+    def _createPart(self):
+        os.makedirs(path.dirname(self.local), exist_ok=True)
+        with open(self._part, 'wb') as f:
+            f.truncate(self.size)
+
+    def _missing(self, first, last):
+        # Runs of consecutive missing blocks, as byte ranges
+        ranges = []
+        b = first
+        while b <= last:
+            if self._present[b]:
+                b += 1
+                continue
+            start = b
+            while b <= last and not self._present[b]:
+                b += 1
+            end = min(b * self.blockSize, self.size)
+            ranges.append((start * self.blockSize, end - start * self.blockSize))
+        return ranges
+
+    def read(self, offset, n):
+        n = max(0, min(n, self.size - offset))
+        if n == 0:
+            return b''
+        with self._lock:
+            if not self.isComplete():
+                if not any(self._present):
+                    self._createPart()
+                first = offset // self.blockSize
+                last = (offset + n - 1) // self.blockSize
+                with open(self._part, 'r+b') as f:
+                    ranges = self._missing(first, last)
+                    if ranges:
+                        self._download(f, ranges)
+                    if not self.isComplete():
+                        f.seek(offset)
+                        return f.read(n)
+            if path.isfile(self._part):
+                self._finish()
+        with open(self.local, 'rb') as f:
+            f.seek(offset)
+            return f.read(n)
+
+    def _download(self, f, ranges):
+        for (start, length), data in zip(ranges, self._fetch(ranges)):
+            if len(data) != length:
+                raise IOError('Short read from %s' % self.local)
+            f.seek(start)
+            f.write(data)
+            self.fetched += length
+        f.flush()
+        for start, length in ranges:
+            for b in range(
+                start // self.blockSize, (start + length - 1) // self.blockSize + 1
+            ):
+                self._present[b] = 1
+        self._saveBlocks()
+
+    def _finish(self):
+        os.replace(self._part, self.local)
+        os.utime(self.local, (self.mtime, self.mtime))
+        try:
+            os.remove(self._blocksPath)
+        except OSError:
+            pass
+        log.debug('Fully downloaded %s', self.local)
+
+    def open(self, buffering=8192):
+        """A new (buffered) file object reading from the cache."""
+        return io.BufferedReader(RangeFile(self), buffering)
+
+
+class RangeFile(io.RawIOBase):
+    """A read-only file positioned independently on a `BlockCache`."""
+
+    def __init__(self, blocks):
+        self._blocks = blocks
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._blocks.size
+        if offset < 0:
+            raise ValueError('Negative seek position %d' % offset)
+        self._pos = offset
+        return offset
+
+    def readinto(self, b):
+        data = self._blocks.read(self._pos, len(b))
+        b[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
@@ -0,0 +1,258 @@
+import os
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import chain
+from math import ceil
+from multiprocessing import get_context
+from os import path
+
+from PyQt5.QtCore import QRect, QRectF, Qt
+from PyQt5.QtGui import QImage, QPainter, QTransform
+
+import remedy.remarkable.constants as rm
+from remedy.remarkable.metadata import PDFBasedDoc, Template
+from remedy.remarkable.pdfbase import PDFBase
+from remedy.remarkable.render import BarePageScene
+from remedy.utils import log
+
+# Pages are rendered in separate processes, each with its own (offscreen) Qt.
+# Only plain data crosses the process boundary: the parsed page
+# and the local paths of its template or base PDF.
+
+RASTER_FORMATS = {'png': 'PNG', 'webp': 'WEBP', 'tiff': 'TIFF'}
+
+# Resolution of the tablet's canvas (rm.WIDTH x rm.HEIGHT)
+DEVICE_DPI = 226
+
+RasterStats = namedtuple('RasterStats', ['pages', 'files', 'failed', 'seconds'])
+
+
+class BaseDocumentRef:
+    # Stands in for the document in a worker's PDFBase
+    def __init__(self, document, basePath):
+        self.uid = document.uid
+        self.redirectionPageMap = document.redirectionPageMap
+        self._path = basePath
+
+    def retrieveBaseDocument(self):
+        return self._path
+
+
+class _LocalPath:
+    # Picklable replacement for the lambda of Template.path
+    def __init__(self, p):
+        self._path = p
+
+    def __call__(self):
+        return self._path
+
+
+class RasterTask:
+    def __init__(self, page, base, filename, dpi, fmt, tile, rotate, options):
+        self.page = page
+        self.base = base
+        self.filename = filename
+        self.dpi = dpi
+        self.fmt = fmt
+        self.tile = tile
+        self.rotate = rotate
+        self.options = options
+
+
+def rasterFilename(stem, pageNum, ext, row=None, col=None):
+    name = path.join(stem, 'page-%03d' % (pageNum + 1))
+    if row is not None:
+        name += '-r%d-c%d' % (row, col)
+    return name + '.' + ext
+
+
+def _canvasRect(rect, width, height, angle):
+    # The area of the (unrotated) canvas that ends up in `rect` once rotated
+    x, y, w, h = rect.x(), rect.y(), rect.width(), rect.height()
+    if angle == 90:
+        return QRect(y, height - x - w, h, w)
+    if angle == -90:
+        return QRect(width - y - h, x, h, w)
+    return rect
+
+
+def _plainOptions(options):
+    opt = dict(options)
+    pal = opt.get('palette')
+    if hasattr(pal, 'toDict'):
+        opt['palette'] = pal.toDict()
+    return opt
+
+
+_app = None
+
+# The base PDFs opened by this worker, by path, so that the pages
+# of a document do not each open (and parse) it again
+_bases = OrderedDict()
+MAX_BASES = 4
+
+
+def _initWorker():
+    global _app
+    _bases.clear()
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+
+    if QApplication.instance() is None:
+        _app = QApplication([])
+
+
+def _baseOf(ref):
+    base = _bases.pop(ref._path, None)
+    if base is None:
+        base = PDFBase(ref)
+    _bases[ref._path] = base
+    while len(_bases) > MAX_BASES:
+        _bases.popitem(last=False)
+    return base
+
+
+def renderTask(task):
+    """
+    Renders one page into one image, or into a grid of tiles
+    of at most `task.tile` pixels per side.
+    Only one tile is held in memory at a time.
+    Returns the list of files written.
+    """
+    page = task.page
+    f = task.dpi / DEVICE_DPI
+    width, height = round(rm.WIDTH * f), round(rm.HEIGHT * f)
+    # Tiles are laid out on the final (rotated) image
+    outw, outh = (height, width) if task.rotate else (width, height)
+    tile = task.tile or max(outw, outh)
+    rows, cols = ceil(outh / tile), ceil(outw / tile)
+    scene = BarePageScene(page, **task.options)
+    base = _baseOf(task.base) if task.base else None
+    ext = task.fmt.lower()
+    files = []
+    for row in range(rows):
+        for col in range(cols):
+            out = QRect(
+                col * tile,
+                row * tile,
+                min(tile, outw - col * tile),
+                min(tile, outh - row * tile),
+            )
+            rect = _canvasRect(out, width, height, task.rotate)
+            img = QImage(rect.size(), QImage.Format_RGB32)
+            img.fill(Qt.GlobalColor.white)
+            painter = QPainter(img)
+            try:
+                painter.setRenderHint(QPainter.Antialiasing)
+                painter.setRenderHint(QPainter.SmoothPixmapTransform)
+                if base:
+                    painter.drawImage(0, 0, base.toImage(page.pageNum, 72 * f, rect))
+                scene.render(
+                    painter,
+                    QRectF(img.rect()),
+                    QRectF(
+                        rect.x() / f, rect.y() / f, rect.width() / f, rect.height() / f
+                    ),
+                    Qt.AspectRatioMode.IgnoreAspectRatio,
+                )
+            finally:
+                painter.end()
+            if task.rotate:
+                img = img.transformed(QTransform().rotate(task.rotate))
+            if rows * cols > 1:
+                filename = rasterFilename(task.filename, page.pageNum, ext, row, col)
+            else:
+                filename = rasterFilename(task.filename, page.pageNum, ext)
+            if not img.save(filename, RASTER_FORMATS[ext]):
+                raise IOError('Could not write %s' % filename)
+            files.append(filename)
+    return files
+
+
+def _tasks(jobs, fmt, dpi, tile, options):
+    include_base = options.get('include_base_layer', True)
+    for job in jobs:
+        doc = job.document
+        stem = (
+            job.filename[:-4] if job.filename.lower().endswith('.pdf') else job.filename
+        )
+        os.makedirs(stem, exist_ok=True)
+
+        base = None
+        if include_base and isinstance(doc, PDFBasedDoc):
+            basePath = doc.retrieveBaseDocument()
+            if basePath:
+                base = BaseDocumentRef(doc, basePath)
+
+        # Same orientation as the PDF export
+        rot = options.get('orientation', 'auto')
+        if rot == 'auto':
+            rot = doc.orientation != 'portrait'
+        else:
+            rot = rot == 'landscape'
+        if not rot:
+            rotate = 0
+        elif base:
+            rotate = -90
+        else:
+            rotate = 90
+
+        n = doc.num_pages()
+        pages = chain(*(range(*s.indices(n)) for s in job.whichPages))
+        for page in doc.getPages(pages):
+            page.document = None
+            bg = page.background
+            if bg:
+                page.background = Template(bg.name, _LocalPath(bg.path()))
+            yield RasterTask(page, base, stem, dpi, fmt, tile, rotate, options)
+
+
+def rasterize(
+    jobs, fmt='png', dpi=DEVICE_DPI, tile=None, workers=None, progress=None, **options
+):
+    """
+    Renders every page of the `BatchJob`s into images, in a pool of processes.
+    The images of a job are saved in a folder named after its filename.
+    """
+    fmt = fmt.lower()
+    if fmt not in RASTER_FORMATS:
+        raise ValueError('Unsupported raster format %s' % fmt)
+    workers = workers or os.cpu_count() or 1
+    total = sum(job.weight() for job in jobs)
+    pages = files = failed = 0
+    start = time.monotonic()
+
+    def collect(finished):
+        nonlocal pages, files, failed
+        for fut in finished:
+            try:
+                files += len(fut.result())
+                pages += 1
+            except Exception as e:
+                failed += 1
+                log.warning('Could not rasterise page: %s', e)
+        if callable(progress):
+            progress(pages + failed, total)
+
+    tasks = _tasks(jobs, fmt, dpi, tile, _plainOptions(options))
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=get_context('spawn'), initializer=_initWorker
+    ) as pool:
+        pending = set()
+        try:
+            for task in tasks:
+                pending.add(pool.submit(renderTask, task))
+                # Bound the number of parsed pages waiting in the queue
+                if len(pending) >= 2 * workers:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished)
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+        except BaseException:
+            for fut in pending:
+                fut.cancel()
+            raise
+
+    return RasterStats(pages, files, failed, time.monotonic() - start)
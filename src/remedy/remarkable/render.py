@@ -450,7 +450,7 @@ def pixmapOfBackground(bg):
     if bg and bg.name not in _TEMPLATE_CACHE:
         bgf = bg.path()
         if bgf:
-            _TEMPLATE_CACHE[bg.name] = QPixmap.fromImage(QImage(bgf))
+            _TEMPLATE_CACHE[bg.name] = QPixmap.fromImage(QImage(str(bgf)))
         else:
             return None
     return _TEMPLATE_CACHE[bg.name]
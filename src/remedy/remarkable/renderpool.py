@@ -0,0 +1,166 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock
+
+from PyQt5 import sip
+from PyQt5.QtGui import QImage
+
+import remedy.remarkable.constants as rm
+from remedy.utils import log
+
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+# Rendering pages of PDFs with PyMuPDF holds the GIL,
+# so threads cannot render more than one page at a time.
+# The RenderService renders them in a pool of processes instead:
+# each worker opens the PDFs itself and hands the pixels back
+# in a block of shared memory, which the QImage uses directly.
+
+
+# A QImage built on a buffer does not own it:
+# the buffer must outlive the image and every (implicitly shared) copy of it.
+# Each image is kept here with the owner of its pixels,
+# until only this list references it.
+_owners = []
+_ownersLock = Lock()
+
+
+def _release(owner):
+    if isinstance(owner, SharedMemory):
+        owner.close()
+
+
+def sweepImages():
+    """Frees the pixels of the images that are not used anymore."""
+    with _ownersLock:
+        alive = []
+        for entry in _owners:
+            # One reference from entry, one from getrefcount
+            if sys.getrefcount(entry[0]) <= 2 and entry[0].isDetached():
+                _release(entry[1])
+            else:
+                alive.append(entry)
+        _owners[:] = alive
+
+
+def wrapImage(buf, owner, width, height, stride):
+    """
+    A QImage of the RGB888 pixels in `buf`, without copying them.
+    `owner` is kept alive (and closed, if shared memory) as long as the image is.
+    """
+    img = QImage(sip.voidptr(buf), width, height, stride, QImage.Format_RGB888)
+    sweepImages()
+    with _ownersLock:
+        _owners.append([img, owner])
+    return img
+
+
+def pixmapOf(page, scale=1, clip=None):
+    """
+    Renders a fitz page at the size of the tablet's screen times `scale`.
+    Landscape pages are turned to portrait.
+    `clip` is a (x, y, width, height) tuple of the resulting image
+    to restrict the rendering to.
+    """
+    sz = page.mediabox
+    w, h = sz.width, sz.height
+    if w <= h:
+        ratio = min(rm.WIDTH / w, rm.HEIGHT / h) / 72
+    else:
+        ratio = min(rm.HEIGHT / w, rm.WIDTH / h) / 72
+    m = fitz.Matrix(scale * ratio, scale * ratio)
+    if w > h:
+        m.prerotate(270)
+    if clip is not None:
+        # fitz clips in page coordinates
+        o = (page.rect * m).top_left
+        x, y, cw, ch = clip
+        clip = fitz.Rect(x + o.x, y + o.y, x + cw + o.x, y + ch + o.y) * ~m
+    return page.get_pixmap(alpha=False, matrix=m, clip=clip)
+
+
+def imageOf(pix):
+    return wrapImage(pix.samples_mv, pix, pix.width, pix.height, pix.stride)
+
+
+_docs = None
+
+
+def renderInWorker(filename, pageNum, scale=1, clip=None):
+    """
+    Runs in the workers: renders the page into a new block of shared memory
+    and returns (name, width, height, stride).
+    The caller is responsible for unlinking the block.
+    """
+    global _docs
+    if _docs is None:
+        from remedy.remarkable.pdfbase import DocumentPool
+
+        _docs = DocumentPool(fitz.open, lambda doc: doc.close(), max_handles=4)
+    with _docs.handle(filename) as doc:
+        pix = pixmapOf(doc[pageNum], scale, clip)
+    samples = pix.samples_mv
+    shm = SharedMemory(create=True, size=max(1, samples.nbytes))
+    try:
+        shm.buf[: samples.nbytes] = samples
+        # The parent takes over the block
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    finally:
+        shm.close()
+    return shm.name, pix.width, pix.height, pix.stride
+
+
+class RenderService:
+    """
+    Renders PDF pages in a pool of `processes` workers (started on first use).
+    The calling thread waits for the result, without holding the GIL,
+    so several threads can render at once.
+    """
+
+    def __init__(self):
+        self.processes = 0
+        self._pool = None
+        self._lock = Lock()
+
+    def start(self, processes):
+        self.shutdown()
+        self.processes = processes if fitz else 0
+        if processes and not fitz:
+            log.warning('Rendering in separate processes requires PyMuPDF')
+
+    def enabled(self):
+        return self.processes > 0
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self.processes = 0
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=get_context('spawn')
+                )
+            return self._pool
+
+    def render(self, filename, pageNum, scale=1, clip=None):
+        name, w, h, stride = (
+            self._executor()
+            .submit(renderInWorker, filename, pageNum, scale, clip)
+            .result()
+        )
+        shm = SharedMemory(name=name)
+        # The mapping stays valid until closed
+        shm.unlink()
+        return wrapImage(shm.buf, shm, w, h, stride)
+
+
+renderService = RenderService()
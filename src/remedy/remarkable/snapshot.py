@@ -0,0 +1,96 @@
+import json
+import os
+import sqlite3
+from os import path
+from threading import RLock
+
+SCHEMA_VERSION = 1
+
+
+def entryIdentity(stats, uid):
+    """
+    The identity of the entry `uid` in a listing of the source:
+    the (size, mtime) of its metadata and content files.
+    """
+    return [
+        list(stats[f]) if f in stats else None
+        for f in (uid + '.metadata', uid + '.content')
+    ]
+
+
+def snapshotPath(fsource):
+    if fsource.cache_dir is None:
+        return None
+    return path.join(fsource.cache_dir, 'index.sqlite')
+
+
+class IndexSnapshot:
+    """
+    A copy of the metadata and content of the entries of a RemarkableIndex,
+    in a SQLite database, so that it can be rebuilt without reading
+    every file of the source again.
+
+    Each entry is kept with the identity of the files it was read from
+    (see `entryIdentity`), to tell which ones changed since.
+    """
+
+    def __init__(self, filename=':memory:'):
+        self.filename = filename
+        self._lock = RLock()
+        if filename != ':memory:':
+            os.makedirs(path.dirname(filename), exist_ok=True)
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._setup()
+
+    def _setup(self):
+        with self._lock, self._db as db:
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = NORMAL')
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                db.execute('DROP TABLE IF EXISTS entries')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS entries'
+                ' (uid TEXT PRIMARY KEY, metadata TEXT NOT NULL,'
+                ' content TEXT NOT NULL, identity TEXT NOT NULL)'
+            )
+            db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def isEmpty(self):
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM entries LIMIT 1').fetchone() is None
+
+    def entries(self):
+        """The (uid, metadata, content) of every entry."""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT uid, metadata, content FROM entries'
+            ).fetchall()
+        return [(uid, json.loads(meta), json.loads(cont)) for uid, meta, cont in rows]
+
+    def identities(self):
+        with self._lock:
+            return {
+                uid: json.loads(ident)
+                for uid, ident in self._db.execute('SELECT uid, identity FROM entries')
+            }
+
+    def store(self, entries):
+        """Saves a list of (uid, metadata, content, identity)."""
+        with self._lock, self._db as db:
+            db.executemany(
+                'INSERT OR REPLACE INTO entries (uid, metadata, content, identity)'
+                ' VALUES (?, ?, ?, ?)',
+                (
+                    (uid, json.dumps(meta), json.dumps(cont), json.dumps(ident))
+                    for uid, meta, cont, ident in entries
+                ),
+            )
+
+    def remove(self, uids):
+        with self._lock, self._db as db:
+            db.executemany('DELETE FROM entries WHERE uid = ?', ((u,) for u in uids))
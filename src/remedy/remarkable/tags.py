@@ -0,0 +1,186 @@
+import re
+from threading import RLock
+
+from remedy.remarkable.compact import deepSizeOf
+
+EMPTY = frozenset()
+
+
+class TagQueryError(ValueError):
+    pass
+
+
+class TagIndex:
+    """
+    An inverted index of the tags of the documents of a library:
+    for each tag, the documents tagged with it, and the documents with pages
+    tagged with it (and which pages).
+
+    `query` evaluates expressions on the tags such as
+    `work and not draft and page:todo` into the set of matching documents.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self.uids = set()  # every document known, for `not`
+        # Keyed by the casefolded tag, so that a query is a lookup
+        self._docs = {}  # tag -> uids
+        self._pageDocs = {}  # tag -> uid -> page ids
+        self._of = {}  # uid -> (doc tags, page tags), as written, if any
+
+    def add(self, uid, content):
+        """Indexes the tags in the `content` of document `uid`."""
+        docTags = frozenset(t['name'] for t in content.get('tags') or []) or EMPTY
+        pageTags = {}
+        for t in content.get('pageTags') or []:
+            pageTags.setdefault(t['name'], set()).add(t['pageId'])
+        with self._lock:
+            self.remove(uid)
+            self.uids.add(uid)
+            if docTags or pageTags:
+                self._of[uid] = (docTags, frozenset(pageTags))
+            for tag in docTags:
+                self._docs.setdefault(tag.casefold(), set()).add(uid)
+            for tag, pages in pageTags.items():
+                self._pageDocs.setdefault(tag.casefold(), {}).setdefault(
+                    uid, set()
+                ).update(pages)
+
+    def remove(self, uid):
+        with self._lock:
+            self.uids.discard(uid)
+            docTags, pageTags = self._of.pop(uid, (EMPTY, EMPTY))
+            for tag in {t.casefold() for t in docTags}:
+                self._docs[tag].discard(uid)
+                if not self._docs[tag]:
+                    del self._docs[tag]
+            for tag in {t.casefold() for t in pageTags}:
+                del self._pageDocs[tag][uid]
+                if not self._pageDocs[tag]:
+                    del self._pageDocs[tag]
+
+    def clear(self):
+        with self._lock:
+            self.uids.clear()
+            self._docs.clear()
+            self._pageDocs.clear()
+            self._of.clear()
+
+    def footprint(self, seen):
+        """The memory taken by the index, except for the objects in `seen`."""
+        with self._lock:
+            return deepSizeOf([self.uids, self._docs, self._pageDocs, self._of], seen)
+
+    def names(self):
+        """Every tag in use, on documents or on pages."""
+        with self._lock:
+            return {tag for tags in self._of.values() for tag in tags[0] | tags[1]}
+
+    def docTagsOf(self, uid):
+        return self._of.get(uid, (EMPTY, EMPTY))[0]
+
+    def pageTagsOf(self, uid):
+        return self._of.get(uid, (EMPTY, EMPTY))[1]
+
+    def docsWith(self, tag):
+        with self._lock:
+            return frozenset(self._docs.get(tag.casefold(), EMPTY))
+
+    def docsWithPageTag(self, tag):
+        with self._lock:
+            return frozenset(self._pageDocs.get(tag.casefold(), {}))
+
+    def pagesWith(self, tag, uid):
+        """The ids of the pages of `uid` tagged with `tag`."""
+        with self._lock:
+            return frozenset(self._pageDocs.get(tag.casefold(), {}).get(uid, EMPTY))
+
+    def query(self, text):
+        """
+        The set of documents matching a query made of tags
+        (in double quotes if they have spaces), `page:` followed by a page tag,
+        `and` (or just a space), `or`, `not` and parentheses.
+        Tags are matched ignoring case.
+        Raises TagQueryError if the query is malformed.
+        """
+        with self._lock:
+            return frozenset(_Parser(self, text).parse())
+
+    def _match(self, name, page):
+        table = self._pageDocs if page else self._docs
+        return set(table.get(name.casefold(), EMPTY))
+
+
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|(page:)?(?:"([^"]*)"|([^\s()"]+)))')
+
+
+class _Parser:
+    # query := term ('or' term)*
+    # term := factor (['and'] factor)*
+    # factor := 'not' factor | '(' query ')' | ['page:'] tag
+
+    def __init__(self, tags, text):
+        self.tags = tags
+        self.tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            m = _TOKEN.match(text, pos)
+            if not m:
+                raise TagQueryError('Unexpected %r' % text[pos:].strip())
+            pos = m.end()
+            lpar, rpar, page, quoted, word = m.groups()
+            if lpar or rpar:
+                self.tokens.append(lpar or rpar)
+            elif quoted is None and not page and word.lower() in ('and', 'or', 'not'):
+                self.tokens.append(word.lower())
+            else:
+                self.tokens.append(('page' if page else 'doc', quoted or word))
+        self.pos = 0
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self):
+        tok = self._peek()
+        if tok is None:
+            raise TagQueryError('Incomplete query')
+        self.pos += 1
+        return tok
+
+    def parse(self):
+        if not self.tokens:
+            return set(self.tags.uids)
+        result = self._query()
+        if self._peek() is not None:
+            raise TagQueryError('Unexpected %r' % (self._peek(),))
+        return result
+
+    def _query(self):
+        result = self._term()
+        while self._peek() == 'or':
+            self._next()
+            result = result | self._term()
+        return result
+
+    def _term(self):
+        result = self._factor()
+        while self._peek() not in (None, 'or', ')'):
+            if self._peek() == 'and':
+                self._next()
+            result = result & self._factor()
+        return result
+
+    def _factor(self):
+        tok = self._next()
+        if tok == 'not':
+            return self.tags.uids - self._factor()
+        if tok == '(':
+            result = self._query()
+            if self._next() != ')':
+                raise TagQueryError('Missing )')
+            return result
+        if isinstance(tok, tuple):
+            kind, name = tok
+            return self.tags._match(name, kind == 'page')
+        raise TagQueryError('Unexpected %r' % (tok,))
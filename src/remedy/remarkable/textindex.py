@@ -0,0 +1,208 @@
+import json
+import os
+import re
+import sqlite3
+from collections import OrderedDict, namedtuple
+from os import path
+from threading import RLock
+
+from remedy.remarkable.metadata import PDFBasedDoc
+from remedy.utils import log
+
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+TextHit = namedtuple('TextHit', ['uid', 'pages', 'snippet'])
+
+SCHEMA_VERSION = 2
+
+
+def ftsQuery(text):
+    """
+    Turns what the user typed into a FTS5 query:
+    all the words must appear, the last one possibly unfinished
+    (if long enough to make a quick prefix search).
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = ['"%s"' % w for w in words]
+    if len(words[-1]) >= 3:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def extractText(filename):
+    """The text of each page of a PDF (or EPUB), with PyMuPDF."""
+    with fitz.open(filename) as doc:
+        for page in doc:
+            yield page.get_text()
+
+
+class TextIndex:
+    """
+    A full-text index of the base documents of a library,
+    in a SQLite database with the FTS5 extension.
+
+    The text of a document is kept along with the identity (size, mtime)
+    of the base document it was extracted from, so that only new
+    or changed documents need extracting again.
+    """
+
+    def __init__(self, filename=':memory:'):
+        self.filename = filename
+        self._lock = RLock()
+        if filename != ':memory:':
+            os.makedirs(path.dirname(filename), exist_ok=True)
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._setup()
+
+    def _setup(self):
+        with self._lock, self._db as db:
+            # Each document is committed on its own while searches go on
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = NORMAL')
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                db.execute('DROP TABLE IF EXISTS docs')
+                db.execute('DROP TABLE IF EXISTS pages')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS docs'
+                ' (uid TEXT PRIMARY KEY, identity TEXT NOT NULL)'
+            )
+            db.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5'
+                " (uid UNINDEXED, page UNINDEXED, text,"
+                " tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def identities(self):
+        with self._lock:
+            return {
+                uid: tuple(json.loads(ident))
+                for uid, ident in self._db.execute('SELECT uid, identity FROM docs')
+            }
+
+    def update(self, uid, identity, pages):
+        """Replaces the text of document `uid` with the list of `pages`."""
+        with self._lock, self._db as db:
+            db.execute('DELETE FROM pages WHERE uid = ?', (uid,))
+            db.executemany(
+                'INSERT INTO pages (uid, page, text) VALUES (?, ?, ?)',
+                ((uid, i, text) for i, text in enumerate(pages) if text.strip()),
+            )
+            db.execute(
+                'INSERT OR REPLACE INTO docs (uid, identity) VALUES (?, ?)',
+                (uid, json.dumps(list(identity))),
+            )
+
+    def optimize(self):
+        # Merges the many small segments left by indexing one document at a time
+        with self._lock, self._db as db:
+            db.execute("INSERT INTO pages (pages) VALUES ('optimize')")
+
+    def remove(self, uid):
+        with self._lock, self._db as db:
+            db.execute('DELETE FROM pages WHERE uid = ?', (uid,))
+            db.execute('DELETE FROM docs WHERE uid = ?', (uid,))
+
+    def search(self, text, limit=500):
+        """
+        The documents containing all the words of `text`, best matches first,
+        as TextHits with the (original) pages where they appear.
+        """
+        query = ftsQuery(text)
+        if query is None:
+            return []
+        hits = OrderedDict()
+        with self._lock:
+            try:
+                rows = self._db.execute(
+                    "SELECT uid, page, snippet(pages, 2, '', '', '…', 8)"
+                    ' FROM pages WHERE pages MATCH ? ORDER BY rank',
+                    (query,),
+                )
+                # The limit is on documents, but the rows are pages:
+                # the pages of the best `limit` documents are all kept
+                for uid, page, snippet in rows:
+                    if uid in hits:
+                        hits[uid].pages.append(page)
+                    elif len(hits) < limit:
+                        hits[uid] = TextHit(uid, [page], snippet)
+            except sqlite3.OperationalError as e:
+                log.debug('Bad text query %r: %s', query, e)
+                return []
+        for hit in hits.values():
+            hit.pages.sort()
+        return list(hits.values())
+
+
+def indexLibrary(index, textIndex, progress=None, cancelled=None):
+    """
+    Brings `textIndex` up to date with the documents of `index`,
+    extracting the text of the new or changed ones only.
+    `progress(done, total)` is called after each extraction.
+    Returns the uids of the documents (re)indexed.
+    """
+    if fitz is None:
+        log.warning('Indexing the text of documents requires PyMuPDF')
+        return []
+    known = textIndex.identities()
+    todo = []
+    present = set()
+    for uid in index.allUids():
+        doc = index.get(uid)
+        if not isinstance(doc, PDFBasedDoc) or doc.isDeleted():
+            continue
+        present.add(uid)
+        identity = doc.baseDocumentStat()
+        if identity is not None and known.get(uid) != tuple(identity):
+            todo.append((doc, identity))
+    for uid in set(known) - present:
+        textIndex.remove(uid)
+
+    done = []
+    for n, (doc, identity) in enumerate(todo):
+        if callable(cancelled) and cancelled():
+            break
+        try:
+            filename = doc.retrieveBaseDocument()
+            pages = list(extractText(str(filename))) if filename else []
+            textIndex.update(doc.uid, identity, pages)
+            done.append(doc.uid)
+        except Exception as e:
+            log.warning('Could not index the text of %s: %s', doc.visibleName, e)
+        if callable(progress):
+            progress(n + 1, len(todo))
+    if done:
+        textIndex.optimize()
+    return done
+
+
+def documentPages(doc, pages):
+    """The pages of `doc` showing the given pages of its base document."""
+    pmap = doc.redirectionPageMap
+    if not pmap:
+        return list(pages)
+    wanted = set(pages)
+    return [i for i, p in enumerate(pmap) if p in wanted]
+
+
+def textIndexPath(fsource, default_dir):
+    """
+    Where to keep the text index of `fsource`,
+    or None if there is no cache folder to keep it in.
+    """
+    d = fsource.cache_dir
+    if d is None:
+        if default_dir is None:
+            return None
+        d = path.join(default_dir, re.sub(r'\W+', '_', fsource.name))
+    return path.join(d, 'text.sqlite')
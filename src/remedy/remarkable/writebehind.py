@@ -0,0 +1,96 @@
+import threading
+from copy import deepcopy
+
+from remedy.utils import deepupdate, log
+
+
+class WriteBehind:
+    """
+    Writes files to a source from a background thread, in batches
+    (see FileSource.storeBundle), so that those storing them do not wait.
+
+    A file stored again before being written is written once,
+    with its last content. The changes that led to each content are kept along,
+    and passed to `onError(name, changes, exception)` if the write fails.
+    """
+
+    def __init__(self, fsource, onError=None, delay=0.2, idle=1) -> None:
+        self.fsource = fsource
+        self.onError = onError
+        self.delay = delay  # to let quick successions of changes pile up
+        self.idle = idle  # before the thread ends, until the next store
+        self._cond = threading.Condition()
+        self._pending = {}  # name -> (content, changes)
+        self._writing = {}  # the batch being written
+        self._busy = False  # until its failures are reported
+        self._flushing = 0
+        self._thread = None
+
+    def store(self, content, name, changes=None) -> None:
+        with self._cond:
+            changes = deepcopy(changes or {})
+            if name in self._pending:
+                merged = self._pending[name][1]
+                deepupdate(merged, changes)
+            else:
+                merged = changes
+            self._pending[name] = (content, merged)
+            if self._thread is None:
+                # Not a daemon, so that the process waits for the writes
+                self._thread = threading.Thread(target=self._run, name='WriteBehind')
+                self._thread.start()
+            self._cond.notify_all()
+
+    def get(self, name):
+        """The last content stored as `name`, if not written yet, or None."""
+        with self._cond:
+            for batch in (self._pending, self._writing):
+                if name in batch:
+                    return batch[name][0]
+        return None
+
+    def isPending(self, name) -> bool:
+        """Whether `name` is still to be written (not counting a write under way)."""
+        with self._cond:
+            return name in self._pending
+
+    def flush(self) -> None:
+        """Waits until everything stored so far is written (or failed)."""
+        with self._cond:
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                self._cond.wait_for(lambda: not (self._pending or self._busy))
+            finally:
+                self._flushing -= 1
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self._pending, self.idle):
+                    self._thread = None
+                    return
+                self._cond.wait_for(lambda: self._flushing, timeout=self.delay)
+                batch, self._pending = self._pending, {}
+                self._writing = batch
+                self._busy = True
+
+            contents = {name: content for name, (content, _) in batch.items()}
+            try:
+                failed = self.fsource.storeBundle(contents)
+            except Exception as e:
+                failed = {name: e for name in contents}
+            with self._cond:
+                self._writing = {}
+
+            for name, e in failed.items():
+                log.error('Could not write %s: %s', name, e)
+                if self.onError is not None:
+                    try:
+                        self.onError(name, batch[name][1], e)
+                    except Exception:
+                        log.exception('Error handling the failure to write %s', name)
+
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
@@ -0,0 +1,57 @@
+import json
+import uuid
+
+from remedy.remarkable.filesource import FileSource
+from remedy.remarkable.metadata import PDF_BASE_CONTENT
+
+
+class SyntheticSource(FileSource):
+    """
+    A library of `folders` nested `depth` deep, with documents in each,
+    of `pages` pages (with their ids and the fields the tablet writes, if any).
+    """
+
+    def __init__(self, entries=20000, depth=12, folders=400, pages=0):
+        super().__init__('Synthetic')
+        self.items = {}
+        for i in range(folders):
+            parent = 'f%d' % (i - 1) if i % depth else ''
+            self.items['f%d' % i] = {
+                'metadata': {
+                    'type': 'CollectionType',
+                    'visibleName': 'Folder %d' % i,
+                    'parent': parent,
+                    'version': 1,
+                },
+            }
+        for i in range(entries - folders):
+            self.items['d%d' % i] = {
+                'metadata': {
+                    'type': 'DocumentType',
+                    'visibleName': 'Document %d' % i,
+                    'parent': 'f%d' % (i % folders),
+                    'deleted': i % 97 == 0,
+                    'version': 1,
+                },
+                'content': {'fileType': 'pdf', 'pageCount': 1},
+            }
+            if pages:
+                self.items['d%d' % i]['content'] = {
+                    **PDF_BASE_CONTENT,
+                    'pageCount': pages,
+                    'pages': [str(uuid.uuid4()) for _ in range(pages)],
+                    'redirectionPageMap': list(range(pages)),
+                }
+
+    def readJson(self, remote, ext=None):
+        # Parsed anew every time, as from a file
+        return json.loads(json.dumps(self.items[remote].get(ext, {})))
+
+    def listItems(self):
+        return list(self.items)
+
+    def store(self, content, *remote, progress=None, overwrite=False):
+        return True
+
+
+LATENCY = 0.02  # per request, as over Wi-Fi
@@ -0,0 +1,83 @@
+import gc
+import time
+import tracemalloc
+
+from assertpy import assert_that
+from synthetic import SyntheticSource
+
+from remedy.remarkable.metadata import Entry, RemarkableIndex
+
+NAMES = ('type_name', 'index', 'uid', '_metadata', '_content', '_dropped')
+NAMES += Entry.FIELDS
+
+
+class DictEntry:
+    """An entry keeping its fields in a __dict__, for comparison."""
+
+    def __init__(self, entry):
+        for name in NAMES:
+            setattr(self, name, getattr(entry, name))
+
+
+def slottedCopy(entry):
+    copy = object.__new__(type(entry))
+    for name in NAMES:
+        setattr(copy, name, getattr(entry, name))
+    return copy
+
+
+def traverse(index):
+    # Walks the whole tree, as the document tree does when it is filled
+    t = time.perf_counter()
+    queue = [index.root.uid]
+    n = 0
+    while queue:
+        folder = index.get(queue.pop())
+        for uid in folder.folders + folder.files:
+            entry = index.get(uid)
+            if entry.deleted or entry.pinned:
+                continue
+            n += entry.version + len(entry.visibleName)
+            index.parentOf(uid)
+        queue.extend(folder.folders)
+    return time.perf_counter() - t
+
+
+def retained(make):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = make()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size, objs
+
+
+def test_traversal_and_memory() -> None:
+    index = RemarkableIndex(SyntheticSource(20000))
+    entries = list(index.index.values())
+
+    best = min(traverse(index) for _ in range(5))
+    slotted, _ = retained(lambda: [slottedCopy(e) for e in entries])
+    plain, _ = retained(lambda: [DictEntry(e) for e in entries])
+
+    print(
+        '\n20000 entries: traversal %.3fs, %d bytes per slotted entry'
+        ' (%d with a __dict__)' % (best, slotted / len(entries), plain / len(entries))
+    )
+    assert_that(slotted).is_less_than(plain)
+
+
+def test_compact_index_memory() -> None:
+    source = SyntheticSource(10000, pages=30)
+
+    for compact in (False, True):
+        size, index = retained(lambda: RemarkableIndex(source, compact=compact))
+        usage = index.footprint()
+        count, total = usage['pdf']
+        print(
+            '\n10000 entries of 30 pages, %s: %d bytes retained per entry,'
+            ' %d bytes per document (footprint)'
+            % ('compact' if compact else 'normal', size / 10000, total / count)
+        )
@@ -0,0 +1,34 @@
+import time
+
+import pytest
+from assertpy import assert_that
+from synthetic import SyntheticSource
+
+from remedy.remarkable.metadata import RemarkableIndex
+
+
+def sweep(index):
+    # What the search results ask for every row on a repaint
+    t = time.perf_counter()
+    for uid in index.allUids():
+        index.fullPathOf(uid)
+        index.isIndirectlyDeleted(uid)
+    return time.perf_counter() - t
+
+
+@pytest.mark.parametrize('entries', [5000, 20000])
+def test_repaint_sweep(entries) -> None:
+    index = RemarkableIndex(SyntheticSource(entries))
+
+    cold = sweep(index)
+    warm = sweep(index)
+    index.rename('f0', 'Renamed')  # invalidates a 12-deep subtree
+    index.update('f13', parent='f30')
+    after = sweep(index)
+
+    print(
+        '\n%6d entries: cold %.3fs, warm %.3fs, after moves %.3fs'
+        % (entries, cold, warm, after)
+    )
+    assert_that(warm).is_less_than(cold)
+    assert_that(index.fullPathOf('f11')).starts_with('/Renamed/')
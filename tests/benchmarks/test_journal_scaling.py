@@ -0,0 +1,26 @@
+import time
+
+import pytest
+from assertpy import assert_that
+from synthetic import SyntheticSource
+
+from remedy.remarkable.journal import MOVED, diffEntries, indexState
+from remedy.remarkable.metadata import RemarkableIndex
+
+
+@pytest.mark.parametrize('entries', [5000, 20000])
+def test_journal_between_states(entries) -> None:
+    index = RemarkableIndex(SyntheticSource(entries))
+    old = indexState(index)
+    index.update('f13', parent='f30')
+    new = indexState(index)
+
+    t = time.perf_counter()
+    journal = diffEntries(old, new)
+    elapsed = time.perf_counter() - t
+
+    print(
+        '\n%6d entries: journal of %d changes in %.3fs'
+        % (entries, len(journal), elapsed)
+    )
+    assert_that([c for c in journal if c.kind == MOVED]).is_length(1)
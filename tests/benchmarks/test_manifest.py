@@ -0,0 +1,52 @@
+import json
+import os
+import time
+
+from assertpy import assert_that
+from synthetic import LATENCY
+
+from remedy.remarkable.metadata import RemarkableIndex
+
+DOCS = 100
+
+
+def _library(root):
+    for i in range(DOCS):
+        uid = 'd%d' % i
+        os.makedirs(root / uid)
+        meta = {'type': 'DocumentType', 'visibleName': uid}
+        (root / (uid + '.metadata')).write_text(json.dumps(meta))
+        (root / (uid + '.content')).write_text('{"fileType": "notebook"}')
+        (root / uid / 'p0.rm').write_text('')
+
+
+def _load(sshSource, name, **options):
+    source = sshSource(LATENCY, name, **options)
+    t = time.perf_counter()
+    source.prefetchMetadata()
+    index = RemarkableIndex(source)
+    for uid in index.allUids():
+        if index.isFolder(uid):
+            continue
+        doc = index.get(uid)
+        doc.pageStates()
+        source.exists(uid, ext='pdf')
+    return time.perf_counter() - t, index
+
+
+def test_loading_with_a_manifest(tablet, sshSource) -> None:
+    _library(tablet)
+
+    stats, _ = _load(sshSource, 'stats', use_manifest=False)
+    listed, index = _load(sshSource, 'manifest')
+    # With the cache filled, only the listing is left
+    again, _ = _load(sshSource, 'manifest')
+
+    print(
+        '\nLoading %d documents with %dms of latency: %.2fs asking for each file,'
+        ' %.2fs from one listing, %.2fs again with the cache'
+        % (DOCS, LATENCY * 1000, stats, listed, again)
+    )
+    assert_that(index.get('d0').markedIds()).is_equal_to({'p0'})
+    assert_that(again).is_less_than(listed)
+    assert_that(listed).is_less_than(stats)
@@ -0,0 +1,53 @@
+import os
+import time
+
+from assertpy import assert_that
+from synthetic import LATENCY
+
+from remedy.remarkable.lines import HEADER_START, S_HEADER_PAGE, S_LAYER, S_PAGE
+from remedy.remarkable.metadata import RemarkableIndex
+
+
+def _library(root, pages):
+    os.makedirs(root / 'd')
+    os.makedirs(root / 'd.highlights')
+    (root / 'd.metadata').write_text('{"type": "DocumentType", "visibleName": "D"}')
+    pids = ['p%d' % i for i in range(pages)]
+    (root / 'd.content').write_text(
+        '{"fileType": "notebook", "pages": [%s]}' % ', '.join('"%s"' % p for p in pids)
+    )
+    page = S_HEADER_PAGE.pack(HEADER_START, b'5', b' ' * 10)
+    page += S_PAGE.pack(1, 0, 0) + S_LAYER.pack(0)
+    for pid in pids:
+        (root / 'd' / (pid + '.rm')).write_bytes(page)
+        (root / 'd' / (pid + '-metadata.json')).write_text('{"layers": [{}]}')
+        (root / 'd.highlights' / (pid + '.json')).write_text('{"highlights": []}')
+
+
+def test_page_open_latency(tablet, sshSource) -> None:
+    _library(tablet, 20)
+    source = sshSource(LATENCY)
+    doc = RemarkableIndex(source).get('d')
+    doc.highlightedIds()
+
+    # One file after the other, as pages used to be opened
+    t = time.perf_counter()
+    source.retrieve('d', 'p0', ext='rm')
+    source.retrieve('d', 'p0-metadata', ext='json')
+    source.retrieve('d.highlights', 'p0', ext='json')
+    sequential = time.perf_counter() - t
+
+    t = time.perf_counter()
+    doc.getPage(1)
+    bundled = time.perf_counter() - t
+
+    t = time.perf_counter()
+    pages = list(doc.getPages(range(2, 20)))
+    chunked = (time.perf_counter() - t) / len(pages)
+
+    print(
+        '\nOpening a page with %dms of latency: %.0fms one file after the other,'
+        ' %.0fms bundled, %.0fms per page in chunks'
+        % (LATENCY * 1000, sequential * 1000, bundled * 1000, chunked * 1000)
+    )
+    assert_that(bundled).is_less_than(sequential)
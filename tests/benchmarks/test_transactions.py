@@ -0,0 +1,45 @@
+import json
+import time
+
+from assertpy import assert_that
+from synthetic import LATENCY
+
+from remedy.remarkable.metadata import RemarkableIndex
+
+DOCS = 100
+
+
+def _library(root):
+    for name in ('a', 'b'):
+        meta = {'type': 'CollectionType', 'visibleName': name, 'parent': ''}
+        (root / (name + '.metadata')).write_text(json.dumps(meta))
+    for i in range(DOCS):
+        meta = {'type': 'DocumentType', 'visibleName': 'D%d' % i, 'parent': 'a'}
+        (root / ('d%d.metadata' % i)).write_text(json.dumps(meta))
+        (root / ('d%d.content' % i)).write_text('{"fileType": "notebook"}')
+
+
+def test_moving_many_entries(tablet, sshSource) -> None:
+    _library(tablet)
+    source = sshSource(LATENCY)
+    index = RemarkableIndex(source)
+    uids = ['d%d' % i for i in range(DOCS)]
+
+    # One entry after the other, as they used to be moved
+    t = time.perf_counter()
+    for uid in uids:
+        index.update(uid, parent='b')
+    sequential = time.perf_counter() - t
+
+    t = time.perf_counter()
+    index.moveAll(uids, 'a')
+    batched = time.perf_counter() - t
+
+    print(
+        '\nMoving %d entries with %dms of latency: %.2fs one after the other,'
+        ' %.2fs in a transaction' % (DOCS, LATENCY * 1000, sequential, batched)
+    )
+    assert_that(index.get('a').files).is_length(DOCS)
+    meta = json.loads((tablet / 'd0.metadata').read_text())
+    assert_that(meta['parent']).is_equal_to('a')
+    assert_that(batched).is_less_than(sequential)
@@ -0,0 +1,97 @@
+import io
+import os
+import shutil
+import subprocess
+import threading
+import time
+import types
+
+import pytest
+
+from remedy.remarkable.filesource import LiveFileSourceSSH
+
+
+class LocalSFTP:
+    """
+    SFTP over a local folder, recording the requests
+    and answering one at a time after `latency` seconds.
+    """
+
+    def __init__(self, requests, latency=0):
+        self.requests = requests
+        self.latency = latency
+        self._lock = threading.Lock()
+
+    def _request(self, *request):
+        with self._lock:
+            self.requests.append(request)
+            time.sleep(self.latency)
+
+    def stat(self, p):
+        self._request('stat', p)
+        return os.stat(p)
+
+    def get(self, remote, local):
+        self._request('get', remote)
+        shutil.copyfile(remote, local)
+
+    def open(self, p, mode='r'):
+        self._request('open', p)
+        return open(p, mode)
+
+    def listdir(self, p):
+        self._request('listdir', p)
+        return os.listdir(p)
+
+    def listdir_attr(self, p):
+        raise IOError(p)
+
+    def close(self):
+        pass
+
+
+class LocalSSH:
+    """Runs the commands on the local machine, after `latency` seconds."""
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.commands = []
+        self.requests = []
+
+    def exec_command(self, command):
+        self.commands.append(command)
+        time.sleep(self.latency)
+        done = subprocess.run(command, shell=True, capture_output=True, text=True)
+        out = io.StringIO(done.stdout)
+        out.channel = types.SimpleNamespace(recv_exit_status=lambda: done.returncode)
+        return None, out, None
+
+    def open_sftp(self):
+        return LocalSFTP(self.requests, self.latency)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def tablet(tmp_path, monkeypatch):
+    """The folder standing for the documents on the tablet."""
+    root = tmp_path / 'xochitl'
+    root.mkdir()
+    monkeypatch.setattr(LiveFileSourceSSH, 'remote_roots', (str(root), str(tmp_path)))
+    return root
+
+
+@pytest.fixture
+def sshSource(tablet, tmp_path):
+    """
+    Makes a LiveFileSourceSSH reading `tablet` over a LocalSSH
+    (at `source.ssh`), with its cache in the folder `cache`.
+    """
+
+    def make(latency=0, cache='cache', **options):
+        return LiveFileSourceSSH(
+            LocalSSH(latency), cache_dir=str(tmp_path / cache), connect=False, **options
+        )
+
+    return make
@@ -0,0 +1,49 @@
+from remedy.remarkable.filesource import FileSource
+
+
+class MemorySource(FileSource):
+    def __init__(self) -> None:
+        super().__init__('MemorySource')
+        self.items = {}
+
+    def readJson(self, remote, ext=None):
+        return self.items.get(remote, dict()).get(ext, dict())
+
+    def listItems(self):
+        yield from self.items.keys()
+
+    def exists(self, uid, ext=None):
+        return ext in self.items.get(uid, {})
+
+    def listSubItems(self, uid, ext):
+        return ()
+
+    def isReadOnly(self):
+        return False
+
+    def store(self, content, *remote, progress=None, overwrite=False):
+        uid, ext = remote[-1].rsplit('.', 1)
+        self.items.setdefault(uid, {})[ext] = content
+        return True
+
+    def remove(self, *remote, progress=None):
+        uid, ext = remote[-1].rsplit('.', 1)
+        return self.items.get(uid, {}).pop(ext, None) is not None
+
+
+def docItem(name, parent='', pages=1, **metadata):
+    return {
+        'metadata': {
+            'type': 'DocumentType',
+            'visibleName': name,
+            'parent': parent,
+            **metadata,
+        },
+        'content': {'fileType': 'pdf', 'pageCount': pages},
+    }
+
+
+def folderItem(name, parent=''):
+    return {
+        'metadata': {'type': 'CollectionType', 'visibleName': name, 'parent': parent}
+    }
@@ -0,0 +1,74 @@
+from os import path
+
+from assertpy import assert_that
+from sources import MemorySource, docItem, folderItem
+
+from remedy.remarkable.batch import BatchExporter, batchJobs
+from remedy.remarkable.metadata import ROOT_ID, RemarkableIndex
+
+
+def _library():
+    source = MemorySource()
+    source.items['f1'] = folderItem('Papers')
+    source.items['f2'] = folderItem('Old', parent='f1')
+    source.items['d1'] = docItem('Intro', parent='f1', pages=30)
+    source.items['d2'] = docItem('Intro', parent='f1', pages=2)
+    source.items['d3'] = docItem('Draft', parent='f2')
+    source.items['d4'] = docItem('Gone', parent='f1', deleted=True)
+    source.items['d5'] = docItem('a/b', pages=5)
+    return RemarkableIndex(source)
+
+
+def test_folders_are_exported_recursively() -> None:
+    jobs = batchJobs(_library(), ['f1'], 'out')
+
+    assert_that([j.uid for j in jobs]).contains_only('d1', 'd2', 'd3')
+    assert_that([j.filename for j in jobs]).contains(
+        path.join('out', 'Papers', 'Old', 'Draft.pdf')
+    )
+
+
+def test_name_clashes_get_a_suffix() -> None:
+    jobs = batchJobs(_library(), ['f1'], 'out')
+
+    assert_that({j.filename for j in jobs}).contains(
+        path.join('out', 'Papers', 'Intro.pdf'),
+        path.join('out', 'Papers', 'Intro (2).pdf'),
+    )
+
+
+def test_root_export_skips_trash_and_sanitises_names() -> None:
+    jobs = batchJobs(_library(), [ROOT_ID], 'out')
+
+    assert_that([j.uid for j in jobs]).does_not_contain('d4')
+    assert_that([j.filename for j in jobs]).contains(path.join('out', 'a_b.pdf'))
+
+
+def test_job_weight_is_the_number_of_pages() -> None:
+    jobs = batchJobs(_library(), ['d1', 'd2'], 'out', whichPages='2:end')
+
+    assert_that([j.weight() for j in jobs]).is_equal_to([29, 1])
+
+
+def test_job_weight_is_estimated_without_the_base_pdf() -> None:
+    source = MemorySource()
+    source.items['d'] = docItem('Unknown length', pages=0)
+    source.items['d']['content']['pages'] = ['p1', 'p2', 'p3']
+    source.exists = None  # the base PDF must not be looked for
+
+    jobs = batchJobs(RemarkableIndex(source), ['d'], 'out')
+
+    assert_that(jobs[0].weight()).is_equal_to(3)
+
+
+def test_failed_jobs_still_count_in_the_progress(tmp_path) -> None:
+    (tmp_path / 'file').write_text('')
+    jobs = batchJobs(_library(), ['d2'], str(tmp_path / 'file'))
+    batch = BatchExporter(jobs)
+    progress = []
+    batch.onProgress.connect(lambda done, total: progress.append((done, total)))
+
+    batch.start()
+
+    assert_that(batch.failed).is_length(1)
+    assert_that(progress[-1]).is_equal_to((2, 2))
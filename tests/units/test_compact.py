@@ -0,0 +1,55 @@
+import uuid
+from array import array
+
+from assertpy import assert_that
+from sources import MemorySource, docItem
+
+from remedy.remarkable.compact import PackedIds, compactContent, expandContent
+from remedy.remarkable.metadata import RemarkableIndex
+
+
+def _content(pages=3):
+    return {
+        'fileType': 'pdf',
+        'pages': [str(uuid.uuid4()) for _ in range(pages)],
+        'redirectionPageMap': [0, -1, 1][:pages],
+        'extraMetadata': {'LastTool': 'Finelinerv2'},
+        'tags': [{'name': 'work', 'timestamp': 1}],
+    }
+
+
+def test_compact_content_reads_back_the_same() -> None:
+    content = _content()
+    compact, dropped = compactContent(content)
+
+    assert_that(compact['pages']).is_instance_of(PackedIds)
+    assert_that(compact['pages']).is_equal_to(content['pages'])
+    assert_that(compact['pages'][-1]).is_equal_to(content['pages'][-1])
+    assert_that(compact['redirectionPageMap']).is_instance_of(array)
+    assert_that(dropped).is_equal_to({'extraMetadata'})
+    assert_that(compact).does_not_contain_key('extraMetadata')
+    del content['extraMetadata']
+    assert_that(expandContent(compact)).is_equal_to(content)
+
+    odd, _ = compactContent({'pages': ['not-a-uuid', 'ABC']})
+    assert_that(odd['pages']).is_equal_to(['not-a-uuid', 'ABC'])
+
+
+def test_compact_entries_read_dropped_fields_on_use() -> None:
+    source = MemorySource()
+    source.items['d'] = docItem('D', version=1)
+    source.items['d']['content'] = _content()
+    index = RemarkableIndex(source, compact=True)
+    entry = index.get('d')
+
+    assert_that(entry.pages).is_equal_to(source.items['d']['content']['pages'])
+    assert_that(entry.allDocTags()).is_equal_to({'work'})
+
+    # The dropped fields are written back with the others
+    index.update('d', content={'lastOpenedPage': 2})
+    stored = source.items['d']['content']
+    assert_that(stored['lastOpenedPage']).is_equal_to(2)
+    assert_that(stored['extraMetadata']).is_equal_to({'LastTool': 'Finelinerv2'})
+    assert_that(stored['pages']).is_instance_of(list)
+    assert_that(entry.extraMetadata).is_equal_to({'LastTool': 'Finelinerv2'})
+    assert_that(index.footprint()['pdf'][0]).is_equal_to(1)
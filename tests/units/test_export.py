@@ -0,0 +1,72 @@
+import pytest
+from assertpy import assert_that
+from PyPDF2 import PdfFileReader, PdfFileWriter
+from PyPDF2.generic import DecodedStreamObject, NameObject
+
+import remedy.remarkable.export as export
+from remedy.remarkable.export import chunkSize, pdfdedupe, pdfrotate
+
+
+def _pdf(p, pages):
+    writer = PdfFileWriter()
+    for i in range(pages):
+        writer.addBlankPage(100 + i, 200)
+    with open(p, 'wb') as out:
+        writer.write(out)
+    return str(p)
+
+
+def test_no_budget_means_a_single_chunk(tmp_path) -> None:
+    pdf = _pdf(tmp_path / 'a.pdf', 10)
+
+    assert_that(chunkSize([pdf], 10, 0)).is_equal_to(10)
+    assert_that(chunkSize([pdf], 10, 2**30)).is_equal_to(10)
+    assert_that(chunkSize([pdf], 10, 1)).is_equal_to(1)
+
+
+def test_chunked_rewrite_keeps_all_pages_in_order(tmp_path) -> None:
+    pdf = _pdf(tmp_path / 'a.pdf', 5)
+
+    pdfrotate(pdf, 90, budget=1)
+
+    reader = PdfFileReader(pdf)
+    assert_that(list(tmp_path.iterdir())).is_length(1)
+    assert_that(
+        [reader.getPage(i).mediaBox.getWidth() for i in range(reader.numPages)]
+    ).is_equal_to([100, 101, 102, 103, 104])
+    assert_that(reader.getPage(4).get('/Rotate')).is_equal_to(90)
+
+
+def test_chunks_do_not_read_whole_files(tmp_path, monkeypatch) -> None:
+    pdf = _pdf(tmp_path / 'a.pdf', 5)
+    sources = []
+
+    def reader(stream, **kw):
+        sources.append(stream)
+        return PdfFileReader(stream, **kw)
+
+    monkeypatch.setattr(export, 'PdfFileReader', reader)
+    pdfrotate(pdf, 90, budget=1)
+
+    # A path would be read into memory at once, for every chunk
+    assert_that([s for s in sources if isinstance(s, str)]).is_empty()
+    assert_that({id(s) for s in sources[1:]}).is_length(1)
+
+
+def test_identical_objects_are_stored_once(tmp_path) -> None:
+    fitz = pytest.importorskip('fitz')
+    writer = PdfFileWriter()
+    addObject = getattr(writer, '_add_object', None) or writer._addObject
+    for i in range(3):
+        page = writer.addBlankPage(100, 100)
+        content = DecodedStreamObject()
+        content.setData(b'0 0 m 100 100 l S')
+        page[NameObject('/Contents')] = addObject(content)
+    pdf = str(tmp_path / 'a.pdf')
+    with open(pdf, 'wb') as out:
+        writer.write(out)
+
+    assert_that(pdfdedupe(pdf)).is_true()
+
+    with fitz.open(pdf) as doc:
+        assert_that({page.get_contents()[0] for page in doc}).is_length(1)
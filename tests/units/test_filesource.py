@@ -0,0 +1,84 @@
+import os
+
+import pytest
+from assertpy import assert_that
+
+import remedy.remarkable.filesource as filesource
+from remedy.remarkable.filesource import LiveFileSourceSSH, RemoteManifest
+
+
+def test_manifest_reads_both_listings() -> None:
+    printf = RemoteManifest.parse(
+        ['d 4096 1700000000.9999999990 doc\n', 'f 12 1700000001.5 doc/p 1.rm\n']
+    )
+    stat = RemoteManifest.parse(
+        ['41ed 4096 1700000000 ./doc', '81a4 12 1700000001 ./doc/p 1.rm']
+    )
+
+    for manifest in (printf, stat):
+        assert_that(manifest.isdir('doc')).is_true()
+        assert_that(manifest.isfile('doc/p 1.rm')).is_true()
+        assert_that(manifest.stats).is_equal_to(
+            {'doc': (4096, 1700000000), 'doc/p 1.rm': (12, 1700000001)}
+        )
+        assert_that(manifest.folders['doc']).is_equal_to({'p 1.rm'})
+    assert_that(RemoteManifest.parse(['find: unknown option -printf'])).is_none()
+
+
+def _library(root):
+    os.makedirs(root / 'd')
+    (root / 'd.metadata').write_text('{"type": "DocumentType", "visibleName": "D"}')
+    (root / 'd.content').write_text('{"fileType": "notebook"}')
+    (root / 'd' / 'p1.rm').write_text('lines')
+
+
+@pytest.mark.parametrize('failing', [0, 1])
+def test_manifest_answers_without_round_trips(
+    tablet, sshSource, monkeypatch, failing
+) -> None:
+    _library(tablet)
+    # As if find had no -printf, falling back on stat
+    commands = ('false %s',) * failing + LiveFileSourceSSH.MANIFEST_COMMANDS
+    monkeypatch.setattr(LiveFileSourceSSH, 'MANIFEST_COMMANDS', commands)
+    source = sshSource()
+    ssh = source.ssh
+    source.prefetchMetadata()
+    ssh.requests.clear()
+
+    assert_that(source.listItems()).is_equal_to(['d'])
+    assert_that(list(source.listSubItems('d', 'rm'))).is_equal_to(['p1'])
+    assert_that(source.exists('d', 'p2', ext='rm')).is_false()
+    assert_that(source.listStats()).contains_key('d.metadata', 'd.content')
+    local = source.retrieve('d', 'p1', ext='rm')
+    assert_that(source.retrieve('d', 'p1', ext='rm')).is_equal_to(local)
+    assert_that(ssh.requests).is_equal_to([('get', str(tablet / 'd' / 'p1.rm'))])
+
+    # What is written shows, its size and time are asked when needed
+    source.store('more lines', 'd', 'p2.rm')
+    assert_that(source.exists('d', 'p2', ext='rm')).is_true()
+    assert_that(source.stat('d', 'p2', ext='rm')[0]).is_equal_to(10)
+    assert_that([r for r, _ in ssh.requests]).is_equal_to(['get', 'open', 'stat'])
+
+
+def test_manifest_is_only_trusted_for_a_while(tablet, sshSource, monkeypatch) -> None:
+    _library(tablet)
+    source = sshSource(manifest_ttl=10)
+    clock = [100.0]
+    monkeypatch.setattr(filesource.time, 'monotonic', lambda: clock[0])
+    source.prefetchMetadata()
+    (tablet / 'd' / 'p2.rm').write_text('drawn on the tablet')
+
+    assert_that(source.exists('d', 'p2', ext='rm')).is_false()
+
+    clock[0] += 11
+    source.ssh.requests.clear()
+    assert_that(source.exists('d', 'p2', ext='rm')).is_true()
+    assert_that([r for r, _ in source.ssh.requests]).is_equal_to(['stat'])
+
+    # Listing the documents, as reconciling the index does, lists everything again
+    assert_that(source.listStats()).contains_key('d.metadata')
+    listings = [c for c in source.ssh.commands if c.startswith('find')]
+    assert_that(listings).is_length(2)
+    source.ssh.requests.clear()
+    assert_that(list(source.listSubItems('d', 'rm'))).contains_only('p1', 'p2')
+    assert_that(source.ssh.requests).is_empty()
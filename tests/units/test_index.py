@@ -1,19 +1,21 @@
-from assertpy import assert_that
-
-from remedy.remarkable.filesource import FileSource
-from remedy.remarkable.metadata import ROOT_ID, TRASH_ID, RemarkableIndex
-
+import json
+import os
+import threading
+import time
 
-class MemorySource(FileSource):
-    def __init__(self) -> None:
-        super().__init__('MemorySource')
-        self.items = {}
-
-    def readJson(self, remote, ext=None):
-        return self.items.get(remote, dict()).get(ext, dict())
+import pytest
+from assertpy import assert_that
+from sources import MemorySource, docItem, folderItem
 
-    def listItems(self):
-        yield from self.items.keys()
+from remedy.remarkable.filesource import LocalFileSource
+from remedy.remarkable.lines import HEADER_START, S_HEADER_PAGE, S_LAYER, S_PAGE
+from remedy.remarkable.metadata import (
+    ROOT_ID,
+    TRASH_ID,
+    RemarkableError,
+    RemarkableIndex,
+)
+from remedy.remarkable.snapshot import IndexSnapshot
 
 
 def test_index_has_root_folder() -> None:
@@ -58,3 +60,373 @@ def test_deleted_files_are_in_trash() -> None:
     assert_that(index.get('uid1')).is_not_none()
     assert_that(index.get('uid1').isDeleted()).is_equal_to(True)
     assert_that(index.trash.items()).contains('uid1')
+
+
+class _CountingSource(LocalFileSource):
+    def __init__(self, root):
+        super().__init__('Local', root)
+        self.read = []
+        self.retrieved = []
+        self.bundles = []
+
+    def readJson(self, remote, ext=None):
+        self.read.append(remote)
+        return super().readJson(remote, ext=ext)
+
+    def retrieve(self, *filename, ext=None, progress=None):
+        self.retrieved.append((*filename, ext))
+        return super().retrieve(*filename, ext=ext, progress=progress)
+
+    def listSubItems(self, uid, ext):
+        self.retrieved.append((uid, ext))
+        return super().listSubItems(uid, ext)
+
+    def retrieveBundle(self, files):
+        self.bundles.append(list(files))
+        return super().retrieveBundle(files)
+
+    def write(self, uid, item, mtime=1000):
+        for ext in ('metadata', 'content'):
+            f = self.root / (uid + '.' + ext)
+            f.write_text(json.dumps(item.get(ext, {})))
+            os.utime(f, (mtime, mtime))
+
+
+class _RecordingIndex(RemarkableIndex):
+    def __init__(self, *args, **kw):
+        self.events = []
+        super().__init__(*args, **kw)
+
+    def _new_entry_complete(self, uid, etype, meta, path=None):
+        self.events.append(('new', uid))
+
+    def _update_entry_complete(self, uid, new_meta, new_content):
+        self.events.append(('update', uid))
+
+    def _remove_entry_complete(self, uid):
+        self.events.append(('remove', uid))
+
+    def _update_entries_complete(self, changes):
+        self.events.append(('updates', sorted(changes)))
+
+
+def test_index_is_loaded_from_snapshot_without_reading_the_source(tmp_path) -> None:
+    source = _CountingSource(tmp_path)
+    source.write('f', folderItem('Folder'))
+    doc = docItem('Doc', parent='f')
+    doc['content']['tags'] = [{'name': 'todo'}]
+    source.write('d', doc)
+    snapshot = IndexSnapshot()
+    RemarkableIndex(source, snapshot=snapshot)
+    source.read.clear()
+
+    index = RemarkableIndex(source, snapshot=snapshot)
+
+    assert_that(source.read).is_empty()
+    assert_that(index.fromSnapshot).is_true()
+    assert_that(index.get('f').files).is_equal_to(['d'])
+    assert_that(index.fullPathOf('d', includeSelf=True)).is_equal_to('/Folder/Doc')
+    assert_that(index.tags.names()).contains('todo')
+
+
+def test_reconcile_reads_only_the_changed_entries(tmp_path) -> None:
+    source = _CountingSource(tmp_path)
+    for uid in ('a', 'b', 'c'):
+        source.write(uid, docItem(uid))
+    snapshot = IndexSnapshot()
+    RemarkableIndex(source, snapshot=snapshot)
+    source.write('b', docItem('renamed'), mtime=2000)
+    source.write('a', docItem('a'), mtime=2000)  # written again as it was
+    source.write('n', docItem('new'))
+    for ext in ('metadata', 'content'):
+        (tmp_path / ('c.' + ext)).unlink()
+    source.read.clear()
+
+    index = _RecordingIndex(source, snapshot=snapshot)
+    index.reconcile()
+
+    assert_that(source.read).contains_only('a', 'b', 'n')
+    assert_that(index.events).contains_only(
+        ('new', 'n'), ('update', 'b'), ('remove', 'c')
+    )
+    assert_that(index.nameOf('b')).is_equal_to('renamed')
+    assert_that(index.root.files).contains_only('a', 'b', 'n')
+    assert_that(snapshot.identities()).does_not_contain_key('c')
+    assert_that(_RecordingIndex(source, snapshot=snapshot).reconcile()).is_equal_to(
+        ([], [], [])
+    )
+
+
+def test_reconciled_changes_move_only_the_entries_changed(tmp_path) -> None:
+    source = _CountingSource(tmp_path)
+    source.write('f', folderItem('Folder'))
+    source.write('g', folderItem('Other'))
+    source.write('a', docItem('a', parent='f'))
+    source.write('b', docItem('b', parent='f'))
+    snapshot = IndexSnapshot()
+    RemarkableIndex(source, snapshot=snapshot)
+    source.write('f', folderItem('Renamed'), mtime=2000)
+    source.write('b', docItem('b', parent='g'), mtime=2000)
+    source.write('n', docItem('new', parent='f'))
+    for ext in ('metadata', 'content'):
+        (tmp_path / ('g.' + ext)).unlink()
+
+    index = RemarkableIndex(source, snapshot=snapshot)
+    folder = index.get('f')
+    changes = index.readChanges()
+
+    # Nothing changes until the changes are applied
+    assert_that(index.get('f')).is_same_as(folder)
+    assert_that(index.nameOf('f')).is_equal_to('Folder')
+
+    index.applyChanges(changes)
+
+    assert_that(index.get('f').files).contains_only('a', 'n')
+    assert_that(index.root.folders).contains_only('f', TRASH_ID)
+    assert_that(index.pathOf('a', includeSelf=True)).is_equal_to('Renamed/a')
+    # Moved to a folder that is gone, so listed nowhere
+    assert_that(index.root.files).does_not_contain('b')
+
+
+class _SlowSource(MemorySource):
+    parallel_reads = 4
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.reading = 0
+        self.most = 0
+
+    def readJson(self, remote, ext=None):
+        with self.lock:
+            self.reading += 1
+            self.most = max(self.most, self.reading)
+        time.sleep(0.01)
+        with self.lock:
+            self.reading -= 1
+        return super().readJson(remote, ext=ext)
+
+
+def test_entries_are_read_concurrently_and_merged_in_order() -> None:
+    source = _SlowSource()
+    source.items['f'] = folderItem('Folder')
+    for i in range(12):
+        source.items['d%d' % i] = docItem('Doc %d' % i, parent='f')
+    steps = []
+
+    index = RemarkableIndex(source, progress=lambda j, tot: steps.append((j, tot)))
+
+    assert_that(source.most).is_greater_than(1)
+    assert_that(steps).is_equal_to([(j, 13) for j in range(13)])
+    assert_that(index.get('f').files).is_equal_to(['d%d' % i for i in range(12)])
+
+
+def test_side_files_are_read_on_first_use_only(tmp_path) -> None:
+    source = _CountingSource(tmp_path)
+    notebook = docItem('Notes', pages=3)
+    notebook['content'] = {'fileType': 'notebook', 'pages': ['p0', 'p1', 'p2']}
+    source.write('n', notebook)
+    (tmp_path / 'n').mkdir()
+    (tmp_path / 'n' / 'p1.rm').write_bytes(b'')
+    index = RemarkableIndex(source)
+    doc = index.get('n')
+    assert_that(source.retrieved).does_not_contain(('n', 'pagedata'))
+
+    assert_that([doc.marked(i) for i in range(3)]).is_equal_to([False, True, False])
+    assert_that(doc.getPage(0).background).is_none()
+    assert_that(source.retrieved).contains(('n', 'rm'), ('n', 'pagedata'))
+    source.retrieved.clear()
+    assert_that(doc.numMarkedPages()).is_equal_to(1)
+    assert_that(source.retrieved).is_empty()
+
+    (tmp_path / 'n' / 'p2.rm').write_bytes(b'')
+    doc.invalidate()
+    assert_that(doc.numMarkedPages()).is_equal_to(2)
+
+
+def test_page_states_follow_the_folders_of_the_pages(tmp_path) -> None:
+    source = _CountingSource(tmp_path)
+    doc = docItem('Doc', pages=4)
+    doc['content']['pages'] = ['p0', 'p1', 'p2', 'p3']
+    source.write('d', doc)
+    for folder, name in (('d', 'p1.rm'), ('d.highlights', 'p3.json')):
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / name).write_text('{}')
+        os.utime(tmp_path / folder, (1000, 1000))
+    doc = RemarkableIndex(source).get('d')
+    source.retrieved.clear()
+
+    assert_that(list(doc.pageStates())).is_equal_to([0, 1, 0, 2])
+    assert_that(list(doc.markedPages())).is_equal_to([1])
+    assert_that(doc.numHighlightedPages()).is_equal_to(1)
+    assert_that(source.retrieved).is_length(2)  # one listing per folder
+
+    (tmp_path / 'd' / 'p2.rm').write_bytes(b'')
+    os.utime(tmp_path / 'd', (2000, 2000))
+    assert_that([doc.marked(i) for i in range(4)]).is_equal_to(
+        [False, True, False, True]
+    )
+    assert_that(list(doc.markedPages())).is_equal_to([1, 2])
+    assert_that(source.retrieved).is_length(4)
+
+    # The counts shown in the GUI use the pages as last listed
+    (tmp_path / 'd' / 'p0.rm').write_bytes(b'')
+    os.utime(tmp_path / 'd', (3000, 3000))
+    source.retrieved.clear()
+    assert_that(doc.numMarkedPages()).is_equal_to(2)
+    assert_that(source.retrieved).is_empty()
+
+
+def _lines(layers):
+    # An empty page of the version 5 format
+    return (
+        S_HEADER_PAGE.pack(HEADER_START, b'5', b' ' * 10)
+        + S_PAGE.pack(layers, 0, 0)
+        + S_LAYER.pack(0) * layers
+    )
+
+
+def test_the_files_of_pages_are_retrieved_together(tmp_path) -> None:
+    source = _CountingSource(tmp_path)
+    doc = docItem('Doc', pages=3)
+    doc['content']['pages'] = ['p0', 'p1', 'p2']
+    source.write('d', doc)
+    (tmp_path / 'd').mkdir()
+    (tmp_path / 'd.highlights').mkdir()
+    for pid in ('p0', 'p1'):
+        (tmp_path / 'd' / (pid + '.rm')).write_bytes(_lines(2))
+    (tmp_path / 'd' / 'p1-metadata.json').write_text(
+        json.dumps({'layers': [{'name': 'Sketch'}, {'name': 'Notes'}]})
+    )
+    (tmp_path / 'd.highlights' / 'p1.json').write_text(
+        json.dumps({'highlights': [[], [{'text': 'hi'}]]})
+    )
+    doc = RemarkableIndex(source).get('d')
+
+    page = doc.getPage(1)
+    assert_that([l.name for l in page.layers]).is_equal_to(['Sketch', 'Notes'])
+    assert_that(page.layers[1].highlights).is_equal_to([{'text': 'hi'}])
+    assert_that(source.bundles).is_length(1)
+
+    source.bundles.clear()
+    pages = list(doc.getPages(range(3), chunk=2))
+    assert_that([len(p.layers) for p in pages]).is_equal_to([2, 2, 0])
+    assert_that([l.name for l in pages[0].layers]).is_equal_to(['Layer 0', 'Layer 1'])
+    assert_that([len(b) for b in source.bundles]).is_equal_to([5, 2])
+
+
+def test_paths_follow_renames_and_moves() -> None:
+    source = MemorySource()
+    source.items['a'] = folderItem('A')
+    source.items['b'] = folderItem('B', parent='a')
+    source.items['c'] = folderItem('C')
+    source.items['d'] = docItem('D', parent='b', version=1)
+    for uid in 'abc':
+        source.items[uid]['metadata']['version'] = 1
+    index = RemarkableIndex(source)
+    assert_that(index.pathOf('d', includeSelf=True)).is_equal_to('A/B/D')
+    assert_that(index.isIndirectlyDeleted('d')).is_false()
+
+    index.rename('a', 'Z')
+    assert_that(index.pathOf('d', includeSelf=True)).is_equal_to('Z/B/D')
+
+    index.update('b', parent='c')
+    assert_that(index.pathOf('d', includeSelf=True)).is_equal_to('C/B/D')
+    assert_that(list(index.ancestryOf('d'))).is_equal_to(['c', 'b'])
+
+    index.moveToTrash('c')
+    assert_that(index.isIndirectlyDeleted('d')).is_true()
+    assert_that(index.isIndirectlyDeleted('a')).is_false()
+
+
+def test_entry_fields_are_decoded_and_follow_updates() -> None:
+    source = MemorySource()
+    source.items['d'] = docItem('D', version='3', lastModified='1592831071604')
+    index = RemarkableIndex(source)
+    entry = index.get('d')
+    assert_that(entry.version).is_equal_to(3)
+    assert_that(entry.lastModified).is_equal_to(1592831071604)
+    assert_that(entry.pinned).is_false()
+
+    index.update('d', pinned=True, visibleName='E')
+
+    assert_that(entry.pinned).is_true()
+    assert_that(entry.visibleName).is_equal_to('E')
+    assert_that(entry.version).is_equal_to(4)
+    assert_that(index.visibleNameOf('d')).is_equal_to('E')
+
+
+class _BundleSource(MemorySource):
+    def __init__(self, fail=()):
+        super().__init__()
+        self.bundles = []
+        self.fail = fail
+
+    def storeBundle(self, contents):
+        self.bundles.append(sorted(contents))
+        contents = {n: c for n, c in contents.items() if n not in self.fail}
+        failed = super().storeBundle(contents)
+        failed.update({n: OSError(n) for n in self.fail})
+        return failed
+
+
+def test_transactions_write_their_changes_together() -> None:
+    source = _BundleSource()
+    source.items['a'] = folderItem('A')
+    for uid in 'xyz':
+        source.items[uid] = docItem(uid.upper(), version=1)
+    index = _RecordingIndex(source)
+    # Only the entries changed move, the other lists are left as they are
+    index._buildHierarchy = lambda: pytest.fail('all the folders were rebuilt')
+
+    fuid = index.newFolderWith(['x', 'y'], parent='a', visibleName='F')
+
+    assert_that(source.bundles).is_length(1)
+    assert_that(source.items[fuid]['metadata']['visibleName']).is_equal_to('F')
+    assert_that(source.items['x']['metadata']['parent']).is_equal_to(fuid)
+    assert_that(index.pathOf('y', includeSelf=True)).is_equal_to('A/F/Y')
+    assert_that(index.get('x').version).is_equal_to(2)
+    assert_that(index.events).is_equal_to([('new', fuid), ('updates', ['x', 'y'])])
+
+    index.moveAllToTrash(['x', 'z'])
+    assert_that(index.isIndirectlyDeleted('z')).is_true()
+    assert_that(index.get(fuid).files).is_equal_to(['y'])
+    assert_that(index.get('a').folders).is_equal_to([fuid])
+    assert_that(index.root.files).is_empty()
+    assert_that(index.trash.files).contains_only('x', 'z')
+
+
+def test_transactions_do_not_reuse_the_uids_of_the_source(monkeypatch) -> None:
+    source = MemorySource()
+    index = RemarkableIndex(source)
+    # Created on the tablet since the index was read
+    source.items['taken'] = docItem('Taken')
+    uids = iter(['taken', 'free'])
+    monkeypatch.setattr('remedy.remarkable.metadata.uuid.uuid4', lambda: next(uids))
+
+    fuid = index.newFolderWith(visibleName='F')
+
+    assert_that(fuid).is_equal_to('free')
+    assert_that(source.items['taken']['metadata']['visibleName']).is_equal_to('Taken')
+    assert_that(index._reserved_uids).is_empty()
+
+
+def test_failed_transactions_change_nothing() -> None:
+    source = _BundleSource(fail={'y.metadata'})
+    source.items['a'] = folderItem('A')
+    source.items['b'] = folderItem('B', parent='a')
+    for uid in 'xy':
+        source.items[uid] = docItem(uid.upper(), version=1)
+    index = RemarkableIndex(source)
+
+    for uids, parent in ((['a'], 'b'), (['x'], 'y'), (['x', 'y'], 'a')):
+        with pytest.raises(RemarkableError):
+            index.moveAll(uids, parent)
+
+    # The one written is put back
+    assert_that(source.bundles).is_equal_to(
+        [['x.metadata', 'y.metadata'], ['x.metadata']]
+    )
+    assert_that(source.items['x']['metadata']['parent']).is_equal_to('')
+    assert_that(index.get('x').parent).is_equal_to('')
+    assert_that(index.get('a').folders).is_equal_to(['b'])
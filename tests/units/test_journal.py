@@ -0,0 +1,106 @@
+import json
+import os
+
+import pytest
+from assertpy import assert_that
+from sources import docItem, folderItem
+
+from remedy.remarkable.filesource import LocalFileSource
+from remedy.remarkable.journal import (
+    ADDED,
+    CHANGED,
+    MOVED,
+    REMOVED,
+    RENAMED,
+    Change,
+    diffEntries,
+    diffSource,
+    indexState,
+    sourceState,
+)
+from remedy.remarkable.metadata import TRASH_ID, RemarkableIndex
+from remedy.remarkable.snapshot import IndexSnapshot
+
+
+def _state(**items):
+    return {
+        uid: (item['metadata'], item.get('content', {})) for uid, item in items.items()
+    }
+
+
+def test_journal_orders_the_changes_so_that_parents_exist() -> None:
+    old = _state(
+        f=folderItem('F'),
+        g=folderItem('G', parent='f'),
+        d=docItem('D', parent='g'),
+        e=docItem('E'),
+        x=docItem('X'),
+    )
+    moved = docItem('X2', parent='n')
+    changed = docItem('E', pages=3)
+    new = _state(
+        c=docItem('C', parent='n'),
+        n=folderItem('N'),
+        e=changed,
+        x=moved,
+        d=docItem('D'),
+    )
+    new['d'][0]['deleted'] = True
+
+    journal = diffEntries(old, new)
+
+    assert_that(journal).is_equal_to(
+        [
+            Change(ADDED, 'n', None, new['n'][0]),
+            Change(ADDED, 'c', None, new['c'][0]),
+            Change(CHANGED, 'e', old['e'][0], new['e'][0]),
+            Change(MOVED, 'x', '', 'n'),
+            Change(RENAMED, 'x', 'X', 'X2'),
+            Change(MOVED, 'd', 'g', TRASH_ID),
+            Change(REMOVED, 'g', old['g'][0], None),
+            Change(REMOVED, 'f', old['f'][0], None),
+        ]
+    )
+    assert_that(diffEntries(new, new)).is_empty()
+
+
+def _write(root, uid, item, mtime=1000):
+    for ext in ('metadata', 'content'):
+        f = root / (uid + '.' + ext)
+        f.write_text(json.dumps(item.get(ext, {})))
+        os.utime(f, (mtime, mtime))
+
+
+def test_journal_of_the_source_since_its_snapshot(tmp_path) -> None:
+    source = LocalFileSource('Local', str(tmp_path))
+    _write(tmp_path, 'f', folderItem('F'))
+    _write(tmp_path, 'a', docItem('A'))
+    _write(tmp_path, 'b', docItem('B'))
+    snapshot = IndexSnapshot()
+    RemarkableIndex(source, snapshot=snapshot)
+
+    _write(tmp_path, 'a', docItem('A', parent='f'), mtime=2000)
+    _write(tmp_path, 'b', docItem('B'), mtime=2000)
+    _write(tmp_path, 'n', docItem('N'))
+    (tmp_path / 'f.metadata').unlink()
+
+    journal = diffSource(source, snapshot)
+
+    assert_that([(c.kind, c.uid) for c in journal]).is_equal_to(
+        [(ADDED, 'n'), (MOVED, 'a'), (REMOVED, 'f')]
+    )
+
+
+def test_compact_index_state_leaves_out_the_dropped_fields(tmp_path) -> None:
+    source = LocalFileSource('Local', str(tmp_path))
+    item = docItem('A')
+    item['content']['extraMetadata'] = {'LastTool': 'Fineliner'}
+    _write(tmp_path, 'a', item)
+    snapshot = IndexSnapshot()
+    index = RemarkableIndex(source, compact=True, snapshot=snapshot)
+    source.readJson = lambda *remote, ext=None: pytest.fail('read %s' % ext)
+
+    state = indexState(index)
+
+    assert_that(index.get('a')._dropped).contains('extraMetadata')
+    assert_that(diffEntries(sourceState(source, snapshot), state)).is_empty()
@@ -0,0 +1,148 @@
+import os
+from os import path
+
+from assertpy import assert_that
+from sources import MemorySource, docItem, folderItem
+
+from remedy.remarkable.metadata import RemarkableIndex
+from remedy.remarkable.mirror import LibraryMirror
+
+
+def _source():
+    source = MemorySource()
+    source.items['f1'] = folderItem('Papers')
+    source.items['d1'] = docItem('Intro', parent='f1', version=1)
+    source.items['d2'] = docItem('Notes', version=1)
+    source.items['d3'] = docItem('Draft', version=1)
+    return source
+
+
+def _mirror(source, dest, **options):
+    return LibraryMirror(RemarkableIndex(source), str(dest), **options)
+
+
+def _sync(source, dest, **options):
+    mirror = _mirror(source, dest, **options)
+    plan = mirror.plan()
+    for job in mirror.apply(plan):
+        os.makedirs(path.dirname(job.filename), exist_ok=True)
+        with open(job.filename, 'w') as f:
+            f.write(job.uid)
+        mirror.exported(job.uid, job.filename)
+    mirror.save()
+    return plan
+
+
+def test_first_run_exports_everything(tmp_path) -> None:
+    plan = _sync(_source(), tmp_path)
+
+    assert_that(plan.exports).is_length(3)
+    assert_that(str(tmp_path / 'Papers' / 'Intro.pdf')).is_file()
+
+
+def test_unchanged_library_exports_nothing(tmp_path) -> None:
+    source = _source()
+    _sync(source, tmp_path)
+
+    plan = _mirror(source, tmp_path).plan()
+
+    assert_that(plan.isEmpty()).is_true()
+    assert_that(plan.unchanged).is_equal_to(3)
+
+
+def test_changed_documents_are_exported_again(tmp_path) -> None:
+    source = _source()
+    _sync(source, tmp_path)
+    source.items['d2']['content']['pages'] = ['p1', 'p2']
+
+    plan = _mirror(source, tmp_path).plan()
+
+    assert_that([doc.uid for doc, _, _ in plan.exports]).is_equal_to(['d2'])
+
+
+def test_opening_a_document_does_not_export_it_again(tmp_path) -> None:
+    source = _source()
+    source.stat = lambda *remote, ext=None: (1, 1.0)
+    _sync(source, tmp_path)
+    # The tablet rewrites the content, with the page it was left at
+    source.stat = lambda *remote, ext=None: (1, 2.0 if ext == 'content' else 1.0)
+    source.items['d2']['content']['lastOpenedPage'] = 3
+    source.items['d3']['content']['orientation'] = 'landscape'
+
+    plan = _mirror(source, tmp_path).plan()
+
+    assert_that([doc.uid for doc, _, _ in plan.exports]).is_equal_to(['d3'])
+
+
+def test_renamed_and_moved_documents_are_moved(tmp_path) -> None:
+    source = _source()
+    _sync(source, tmp_path)
+    source.items['d1']['metadata']['parent'] = ''
+    source.items['d2']['metadata']['visibleName'] = 'Memo'
+
+    plan = _sync(source, tmp_path)
+
+    assert_that(plan.exports).is_empty()
+    assert_that(plan.moves).is_length(2)
+    assert_that(str(tmp_path / 'Intro.pdf')).is_file()
+    assert_that(str(tmp_path / 'Memo.pdf')).is_file()
+    assert_that(path.exists(tmp_path / 'Notes.pdf')).is_false()
+    # The folder is left empty and pruned
+    assert_that(path.exists(tmp_path / 'Papers')).is_false()
+
+
+def test_renaming_through_the_index_exports_nothing(tmp_path) -> None:
+    source = _source()
+    index = RemarkableIndex(source)
+    mirror = LibraryMirror(index, str(tmp_path))
+    for job in mirror.apply(mirror.plan()):
+        os.makedirs(path.dirname(job.filename), exist_ok=True)
+        with open(job.filename, 'w') as f:
+            f.write(job.uid)
+        mirror.exported(job.uid, job.filename)
+    mirror.save()
+
+    # Each bumps the version and the modification time of the document
+    index.rename('d2', 'Memo')
+    index.update('d1', parent='')
+    index.update('d3', pinned=True)
+
+    plan = LibraryMirror(index, str(tmp_path)).plan()
+
+    assert_that(plan.exports).is_empty()
+    assert_that(plan.moves).is_length(2)
+    assert_that(plan.unchanged).is_equal_to(3)
+
+
+def test_trashed_documents_are_removed(tmp_path) -> None:
+    source = _source()
+    _sync(source, tmp_path)
+    source.items['d3']['metadata']['parent'] = 'trash'
+    del source.items['d2']
+
+    plan = _sync(source, tmp_path)
+
+    assert_that(plan.removals).is_length(2)
+    assert_that(path.exists(tmp_path / 'Draft.pdf')).is_false()
+    assert_that(path.exists(tmp_path / 'Notes.pdf')).is_false()
+
+
+def test_swapping_names_does_not_lose_files(tmp_path) -> None:
+    source = _source()
+    _sync(source, tmp_path)
+    source.items['d2']['metadata']['visibleName'] = 'Draft'
+    source.items['d3']['metadata']['visibleName'] = 'Notes'
+
+    _sync(source, tmp_path)
+
+    assert_that((tmp_path / 'Draft.pdf').read_text()).is_equal_to('d2')
+    assert_that((tmp_path / 'Notes.pdf').read_text()).is_equal_to('d3')
+
+
+def test_new_options_export_everything(tmp_path) -> None:
+    source = _source()
+    _sync(source, tmp_path)
+
+    plan = _mirror(source, tmp_path, smoothen=True).plan()
+
+    assert_that(plan.exports).is_length(3)
@@ -0,0 +1,193 @@
+from multiprocessing.shared_memory import SharedMemory
+from os import path
+from threading import Thread
+from types import SimpleNamespace
+
+from assertpy import assert_that
+from PyQt5.QtGui import QColor, QImage
+
+from remedy.remarkable.pdfbase import DocumentPool, PageImageCache, _PDFBase
+from remedy.remarkable.renderpool import _owners, sweepImages, wrapImage
+
+
+def _image(color='red'):
+    img = QImage(10, 10, QImage.Format_RGB888)
+    img.fill(QColor(color))
+    return img
+
+
+def test_least_recently_used_pages_are_evicted() -> None:
+    size = _image().sizeInBytes()
+    cache = PageImageCache(budget=2 * size)
+    cache.put('a', _image())
+    cache.put('b', _image())
+    cache.get('a')
+
+    cache.put('c', _image())
+
+    assert_that(cache.get('a')).is_not_none()
+    assert_that(cache.get('b')).is_none()
+    assert_that(cache.get('c')).is_not_none()
+
+
+def test_evicted_pages_are_read_back_from_disk(tmp_path) -> None:
+    cache = PageImageCache(budget=0)
+    cache.put('a', _image('blue'), str(tmp_path))
+
+    img = cache.get('a', str(tmp_path))
+
+    assert_that(img).is_equal_to(_image('blue'))
+    assert_that(cache.get('b', str(tmp_path))).is_none()
+
+
+def test_pages_are_written_to_disk_once_evicted(tmp_path) -> None:
+    cache = PageImageCache(budget=2 * _image().sizeInBytes())
+    cache.put('a', _image(), str(tmp_path))
+    cache.put('b', _image(), str(tmp_path))
+
+    assert_that(path.exists(tmp_path / 'pages')).is_false()
+
+    cache.put('c', _image(), str(tmp_path))
+
+    assert_that(list((tmp_path / 'pages').iterdir())).is_length(1)
+    assert_that(cache.get('a', str(tmp_path))).is_equal_to(_image())
+
+
+def test_flushed_pages_survive_a_restart(tmp_path) -> None:
+    cache = PageImageCache()
+    cache.put('a', _image('blue'), str(tmp_path))
+    cache.put('b', _image())
+
+    cache.flush()
+    cache.flush()
+
+    assert_that(list((tmp_path / 'pages').iterdir())).is_length(1)
+    restarted = PageImageCache()
+    assert_that(restarted.get('a', str(tmp_path))).is_equal_to(_image('blue'))
+
+
+def test_disk_usage_is_bounded(tmp_path) -> None:
+    cache = PageImageCache(budget=0, disk_budget=1)
+    for key in 'abc':
+        cache.put(key, _image(), str(tmp_path))
+
+    assert_that(list((tmp_path / 'pages').iterdir())).is_length(0)
+
+
+class _Opener:
+    def __init__(self):
+        self.opened = []
+        self.closed = []
+
+    def open(self, filename):
+        doc = (filename, len(self.opened))
+        self.opened.append(doc)
+        return doc
+
+    def close(self, doc):
+        self.closed.append(doc)
+
+
+def test_each_thread_gets_its_own_document() -> None:
+    docs = _Opener()
+    pool = DocumentPool(docs.open, docs.close)
+
+    with pool.handle('a.pdf') as first:
+        pass
+    with pool.handle('a.pdf') as again:
+        pass
+    other = []
+    t = Thread(target=lambda: other.append(pool.handle('a.pdf').__enter__()))
+    t.start()
+    t.join()
+
+    assert_that(again).is_same_as(first)
+    assert_that(other[0]).is_not_equal_to(first)
+    assert_that(docs.opened).is_length(2)
+
+
+def test_idle_documents_are_closed() -> None:
+    docs = _Opener()
+    pool = DocumentPool(docs.open, docs.close, max_handles=1, idle_timeout=3600)
+
+    with pool.handle('a.pdf'):
+        with pool.handle('b.pdf'):
+            pass
+        assert_that(docs.closed).is_empty()
+    with pool.handle('c.pdf'):
+        pass
+
+    assert_that(docs.closed).is_equal_to(docs.opened[:2])
+    pool.idle_timeout = 0
+    pool.evict()
+    assert_that(len(pool)).is_zero()
+
+
+def test_shared_pixels_live_as_long_as_their_image() -> None:
+    shm = SharedMemory(create=True, size=4 * 3 * 2)
+    shm.unlink()
+    shm.buf[:] = bytes([255, 0, 0] * 8)
+
+    img = wrapImage(shm.buf, shm, 4, 2, 12)
+    sweepImages()
+
+    assert_that(shm.buf).is_not_none()
+    assert_that(img.pixelColor(3, 1)).is_equal_to(QColor('red'))
+    img = None
+    sweepImages()
+    assert_that(shm.buf).is_none()
+    assert_that([e for e in _owners if e[1] is shm]).is_empty()
+
+
+class _FakePDF(_PDFBase):
+    _pool = DocumentPool(lambda filename: filename)
+
+    def _pageOf(self, doc, i):
+        return i
+
+    def _pageGeometry(self, page):
+        return (100 + page, 200, 0)
+
+    def _count(self, doc):
+        return 3
+
+    def _render(self, page, scale=1, clip=None):
+        return _image()
+
+
+def test_cached_pages_are_known_without_rendering(tmp_path) -> None:
+    (tmp_path / 'base.pdf').write_bytes(b'%PDF')
+    entry = SimpleNamespace(
+        uid='cached-pages',
+        redirectionPageMap=None,
+        retrieveBaseDocument=lambda: tmp_path / 'base.pdf',
+    )
+    pdf = _FakePDF(entry)
+
+    assert_that(pdf.isCached(0, 144)).is_false()
+    pdf.toImage(0, 144)
+    assert_that(pdf.isCached(0, 144)).is_true()
+    assert_that(pdf.isCached(0, 36)).is_false()
+
+
+class _ClosedPDF(_FakePDF):
+    _pool = DocumentPool(lambda filename: 1 / 0)
+
+
+def test_page_geometry_is_known_without_opening_the_pdf(tmp_path) -> None:
+    (tmp_path / 'base.pdf').write_bytes(b'%PDF')
+    entry = SimpleNamespace(
+        uid='measured',
+        redirectionPageMap=None,
+        retrieveBaseDocument=lambda: tmp_path / 'base.pdf',
+        baseDocumentStat=lambda: (4, 1234.0),
+        fsource=SimpleNamespace(cache_dir=str(tmp_path)),
+    )
+    assert_that(_FakePDF(entry).pageCount()).is_equal_to(3)
+
+    pdf = _ClosedPDF(entry)
+
+    assert_that(pdf.pageCount()).is_equal_to(3)
+    assert_that(pdf.pageGeometry(2)).is_equal_to((102, 200, 0))
+    entry.baseDocumentStat = lambda: (5, 1234.0)
+    assert_that(_ClosedPDF(entry).geometry().count).is_none()
@@ -0,0 +1,68 @@
+import os
+
+from assertpy import assert_that
+from PyPDF2 import PdfFileReader, PdfFileWriter
+
+from remedy.remarkable.pdfbase import extractPage, pdfPageCount
+from remedy.remarkable.rangefile import BlockCache
+
+
+class _Remote:
+    def __init__(self, data):
+        self.data = data
+        self.requests = []
+
+    def fetch(self, ranges):
+        self.requests.append(ranges)
+        return [self.data[start : start + length] for start, length in ranges]
+
+
+def _cache(tmp_path, remote, blockSize=4):
+    return BlockCache(
+        remote.fetch, len(remote.data), 1234.0, str(tmp_path / 'f'), blockSize
+    )
+
+
+def test_only_the_blocks_read_are_fetched(tmp_path) -> None:
+    remote = _Remote(bytes(range(20)))
+    cache = _cache(tmp_path, remote)
+
+    f = cache.open(buffering=1)
+    f.seek(5)
+    assert_that(f.read(4)).is_equal_to(bytes(range(5, 9)))
+    assert_that(cache.read(6, 1)).is_equal_to(bytes([6]))
+
+    assert_that(remote.requests).is_equal_to([[(4, 8)]])
+    assert_that(os.path.exists(tmp_path / 'f')).is_false()
+
+
+def test_fetched_blocks_are_kept_across_sessions(tmp_path) -> None:
+    remote = _Remote(bytes(range(20)))
+    _cache(tmp_path, remote).read(0, 6)
+
+    data = _cache(tmp_path, remote).read(0, 20)
+
+    assert_that(data).is_equal_to(remote.data)
+    assert_that(remote.requests[1]).is_equal_to([(8, 12)])
+    assert_that((tmp_path / 'f').read_bytes()).is_equal_to(remote.data)
+    assert_that(os.stat(tmp_path / 'f').st_mtime).is_equal_to(1234.0)
+    assert_that(list(tmp_path.iterdir())).is_length(1)
+
+
+def test_pages_are_extracted_without_reading_the_others(tmp_path) -> None:
+    writer = PdfFileWriter()
+    for i in range(20):
+        writer.addBlankPage(100 + i, 200)
+    with open(tmp_path / 'a.pdf', 'wb') as out:
+        writer.write(out)
+    remote = _Remote((tmp_path / 'a.pdf').read_bytes())
+    cache = _cache(tmp_path, remote, blockSize=128)
+    reader = PdfFileReader(cache.open(buffering=16), strict=False)
+
+    with open(tmp_path / 'page.pdf', 'wb') as out:
+        out.write(extractPage(reader, 12))
+
+    assert_that(pdfPageCount(reader)).is_equal_to(20)
+    page = PdfFileReader(str(tmp_path / 'page.pdf')).getPage(0)
+    assert_that(page.mediaBox.getWidth()).is_equal_to(112)
+    assert_that(cache.fetched).is_less_than(len(remote.data))
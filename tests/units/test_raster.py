@@ -0,0 +1,81 @@
+import json
+from os import path
+
+from assertpy import assert_that
+from PyPDF2 import PdfFileWriter
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QImage
+
+from remedy.remarkable.batch import BatchJob
+from remedy.remarkable.filesource import LocalFileSource
+from remedy.remarkable.metadata import RemarkableIndex
+from remedy.remarkable.raster import _canvasRect, rasterFilename, rasterize
+
+
+def test_tiles_are_numbered_by_row_and_column() -> None:
+    assert_that(rasterFilename('out', 0, 'png')).is_equal_to(
+        path.join('out', 'page-001.png')
+    )
+    assert_that(rasterFilename('out', 11, 'webp', 2, 0)).is_equal_to(
+        path.join('out', 'page-012-r2-c0.webp')
+    )
+
+
+def test_unrotated_tiles_map_to_themselves() -> None:
+    rect = QRect(100, 200, 50, 60)
+
+    assert_that(_canvasRect(rect, 1404, 1872, 0)).is_equal_to(rect)
+
+
+def test_rotated_tiles_map_back_to_the_canvas() -> None:
+    # The top-left corner of the rotated image
+    corner = QRect(0, 0, 100, 50)
+
+    # Turning clockwise brings the bottom-left corner of the canvas there
+    assert_that(_canvasRect(corner, 1404, 1872, 90)).is_equal_to(
+        QRect(0, 1772, 50, 100)
+    )
+    # Turning counter-clockwise brings the top-right corner there
+    assert_that(_canvasRect(corner, 1404, 1872, -90)).is_equal_to(
+        QRect(1354, 0, 50, 100)
+    )
+
+
+def _library(root, pages):
+    (root / 'd.metadata').write_text(
+        json.dumps({'type': 'DocumentType', 'visibleName': 'D', 'parent': ''})
+    )
+    (root / 'd.content').write_text(json.dumps({'fileType': 'pdf', 'pageCount': pages}))
+    writer = PdfFileWriter()
+    for _ in range(pages):
+        writer.addBlankPage(72 * 1404 / 226, 72 * 1872 / 226)
+    with open(root / 'd.pdf', 'wb') as out:
+        writer.write(out)
+    return RemarkableIndex(LocalFileSource('Local', root))
+
+
+def test_pages_are_rasterized_into_tiles(tmp_path) -> None:
+    root = tmp_path / 'xochitl'
+    root.mkdir()
+    index = _library(root, 2)
+    out = tmp_path / 'out'
+
+    stats = rasterize(
+        [BatchJob(index.get('d'), str(out) + '.pdf')],
+        dpi=113,
+        tile=500,
+        workers=1,
+        orientation='portrait',
+    )
+
+    # 702 x 936 pixels, in 2 x 2 tiles of at most 500
+    assert_that(stats.pages).is_equal_to(2)
+    assert_that(stats.failed).is_equal_to(0)
+    assert_that(stats.files).is_equal_to(8)
+    sizes = {}
+    for row, col in [(0, 0), (0, 1), (1, 0), (1, 1)]:
+        img = QImage(rasterFilename(str(out), 1, 'png', row, col))
+        sizes[row, col] = (img.width(), img.height())
+    assert_that(sizes).is_equal_to(
+        {(0, 0): (500, 500), (0, 1): (202, 500), (1, 0): (500, 436), (1, 1): (202, 436)}
+    )
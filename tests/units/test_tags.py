@@ -0,0 +1,59 @@
+import pytest
+from assertpy import assert_that
+from sources import MemorySource, docItem
+
+from remedy.remarkable.metadata import RemarkableIndex
+from remedy.remarkable.tags import TagIndex, TagQueryError
+
+
+def _tags(*names):
+    return [{'name': n} for n in names]
+
+
+def _pageTags(*pairs):
+    return [{'name': n, 'pageId': p} for n, p in pairs]
+
+
+def _library():
+    tags = TagIndex()
+    tags.add('a', {'tags': _tags('Work', 'draft')})
+    tags.add('b', {'tags': _tags('work'), 'pageTags': _pageTags(('todo', 'p1'))})
+    tags.add(
+        'c', {'tags': _tags('home project'), 'pageTags': _pageTags(('todo', 'p2'))}
+    )
+    tags.add('d', {})
+    return tags
+
+
+def test_queries_combine_tags_with_and_or_not() -> None:
+    tags = _library()
+
+    assert_that(tags.query('work')).is_equal_to({'a', 'b'})
+    assert_that(tags.query('work and not draft')).is_equal_to({'b'})
+    assert_that(tags.query('work not draft page:todo')).is_equal_to({'b'})
+    assert_that(tags.query('"home project" or draft')).is_equal_to({'a', 'c'})
+    assert_that(tags.query('not (work or page:todo)')).is_equal_to({'d'})
+    assert_that(tags.query('')).is_equal_to({'a', 'b', 'c', 'd'})
+    assert_that(tags.pagesWith('todo', 'c')).is_equal_to({'p2'})
+
+
+def test_malformed_queries_are_rejected() -> None:
+    tags = _library()
+
+    for query in ('work and', '(work', 'work )', 'not'):
+        with pytest.raises(TagQueryError):
+            tags.query(query)
+
+
+def test_tags_follow_updates_of_the_index() -> None:
+    source = MemorySource()
+    source.items['a'] = docItem('A', version=1)
+    source.items['a']['content']['tags'] = _tags('old')
+    index = RemarkableIndex(source)
+    assert_that(index.get('a').allDocTags()).is_equal_to({'old'})
+
+    index.update('a', content={'tags': _tags('new'), 'pageTags': _pageTags(('x', 'p'))})
+
+    assert_that(index.tags.query('old')).is_empty()
+    assert_that(index.tags.query('new and page:x')).is_equal_to({'a'})
+    assert_that(index.get('a').allTags()).is_equal_to({'new', 'x'})
@@ -0,0 +1,81 @@
+import pytest
+from assertpy import assert_that
+from sources import MemorySource, docItem
+
+from remedy.remarkable.metadata import RemarkableIndex
+from remedy.remarkable.textindex import TextIndex, indexLibrary, textIndexPath
+
+
+def test_documents_are_found_by_the_words_of_their_pages() -> None:
+    text = TextIndex()
+    text.update('a', (1, 1), ['The quick brown fox', '', 'jumps over the lazy dog'])
+    text.update('b', (1, 1), ['Quick thinking'])
+
+    assert_that([hit.uid for hit in text.search('quick')]).contains_only('a', 'b')
+    assert_that(text.search('brown quick')[0][:2]).is_equal_to(('a', [0]))
+    assert_that(text.search('the laz')[0].pages).is_equal_to([2])
+    assert_that(text.search('"')).is_empty()
+
+    text.update('a', (2, 2), ['Slow'])
+    assert_that([hit.uid for hit in text.search('quick')]).is_equal_to(['b'])
+
+
+def test_the_limit_counts_documents_not_pages() -> None:
+    text = TextIndex()
+    text.update('a', (1, 1), ['fox'] * 5)
+    text.update('b', (1, 1), ['fox'])
+
+    hits = text.search('fox', limit=2)
+
+    assert_that({hit.uid: hit.pages for hit in hits}).is_equal_to(
+        {'a': [0, 1, 2, 3, 4], 'b': [0]}
+    )
+    assert_that(text.search('fox', limit=1)).is_length(1)
+
+
+def test_no_cache_folder_means_no_index_file() -> None:
+    source = MemorySource()
+
+    assert_that(textIndexPath(source, None)).is_none()
+    assert_that(textIndexPath(source, 'cache')).ends_with('text.sqlite')
+
+
+class _PDFSource(MemorySource):
+    def __init__(self, tmp_path):
+        super().__init__()
+        self.folder = tmp_path
+        self.stats = {}
+
+    def addPdf(self, uid, *pages):
+        fitz = pytest.importorskip('fitz')
+        doc = fitz.open()
+        for text in pages:
+            doc.new_page().insert_text((72, 72), text)
+        doc.save(str(self.folder / (uid + '.pdf')))
+        self.items[uid] = docItem(uid, pages=len(pages))
+        self.stats[uid + '.pdf'] = (1, 1.0)
+
+    def exists(self, *filename, ext=None):
+        return filename[-1] in self.stats
+
+    def retrieve(self, *filename, ext=None, progress=None):
+        return str(self.folder / filename[-1])
+
+    def stat(self, *filename, ext=None):
+        return self.stats.get(filename[-1])
+
+
+def test_only_new_or_changed_documents_are_indexed(tmp_path) -> None:
+    source = _PDFSource(tmp_path)
+    source.addPdf('d1', 'alpha', 'beta')
+    source.addPdf('d2', 'gamma')
+    text = TextIndex(str(tmp_path / 'cache' / 'text.sqlite'))
+
+    assert_that(indexLibrary(RemarkableIndex(source), text)).contains_only('d1', 'd2')
+    assert_that(indexLibrary(RemarkableIndex(source), text)).is_empty()
+
+    source.stats['d2.pdf'] = (2, 2.0)
+    del source.items['d1']
+    assert_that(indexLibrary(RemarkableIndex(source), text)).is_equal_to(['d2'])
+    assert_that(text.search('beta')).is_empty()
+    assert_that([hit.uid for hit in text.search('gamma')]).is_equal_to(['d2'])
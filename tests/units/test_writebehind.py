@@ -0,0 +1,132 @@
+import threading
+
+import pytest
+from assertpy import assert_that
+from sources import MemorySource, docItem, folderItem
+
+from remedy.remarkable.metadata import RemarkableIndex
+from remedy.remarkable.writebehind import WriteBehind
+
+
+class _GatedSource(MemorySource):
+    """Writes only once the gate is opened, failing those named in `fail`."""
+
+    def __init__(self, fail=()):
+        super().__init__()
+        self.gate = threading.Event()
+        self.bundles = []
+        self.fail = set(fail)
+        self.refreshed = []
+
+    def storeBundle(self, contents):
+        self.gate.wait()
+        self.bundles.append(sorted(contents))
+        failed = {n: OSError(n) for n in self.fail if n in contents}
+        super().storeBundle({n: c for n, c in contents.items() if n not in failed})
+        return failed
+
+    def cleanup(self):
+        self.flush()
+        self.refreshed.append(self.items['x']['metadata'].get('visibleName'))
+
+
+class _ErrorIndex(RemarkableIndex):
+    def __init__(self, *args, **kw):
+        self.errors = []
+        super().__init__(*args, **kw)
+
+    def _update_entry_error(self, exception, uid, new_meta, new_content):
+        self.errors.append((uid, new_meta.get('visibleName'), new_meta.get('pinned')))
+
+
+def _library(source):
+    source.items['a'] = folderItem('A')
+    source.items['x'] = docItem('X', version=1)
+    source.items['y'] = docItem('Y', version=1)
+
+
+def test_updates_are_written_later_and_coalesced() -> None:
+    source = _GatedSource()
+    _library(source)
+    index = RemarkableIndex(source, writeBehind=True)
+
+    index.rename('x', 'X1')
+    index.update('x', pinned=True)
+    index.rename('x', 'X2')
+    index.update('y', parent='a')
+
+    # The index changes right away, the source only once the writes go through
+    assert_that(index.get('x').visibleName).is_equal_to('X2')
+    assert_that(index.pathOf('y', includeSelf=True)).is_equal_to('A/Y')
+    assert_that(source.items['x']['metadata']['visibleName']).is_equal_to('X')
+
+    source.gate.set()
+    source.cleanup()
+
+    assert_that(source.refreshed).is_equal_to(['X2'])
+    assert_that(source.items['x']['metadata']).contains_entry(
+        {'visibleName': 'X2'}, {'pinned': True}, {'version': 4}
+    )
+    assert_that(source.items['y']['metadata']['parent']).is_equal_to('a')
+    written = [name for bundle in source.bundles for name in bundle]
+    assert_that(written.count('x.metadata')).is_equal_to(1)
+
+
+def test_failed_writes_are_reported_and_undone() -> None:
+    source = _GatedSource(fail={'x.metadata'})
+    _library(source)
+    index = _ErrorIndex(source, writeBehind=True)
+
+    index.rename('x', 'X1')
+    index.update('x', pinned=True)
+    index.rename('y', 'Y1')
+    source.gate.set()
+    index.flush()
+
+    assert_that(index.errors).is_equal_to([('x', 'X1', True)])
+    assert_that(index.get('x').visibleName).is_equal_to('X')
+    assert_that(index.get('x').pinned).is_false()
+    assert_that(index.get('y').visibleName).is_equal_to('Y1')
+    assert_that(source.items['y']['metadata']['visibleName']).is_equal_to('Y1')
+
+
+def test_moves_that_fail_are_undone_in_the_folders() -> None:
+    source = _GatedSource(fail={'y.metadata'})
+    _library(source)
+    index = RemarkableIndex(source, writeBehind=True)
+    index._buildHierarchy = lambda: pytest.fail('all the folders were rebuilt')
+
+    index.update('y', parent='a')
+    assert_that(index.get('a').files).is_equal_to(['y'])
+    source.gate.set()
+    index.flush()
+
+    assert_that(index.get('a').files).is_empty()
+    assert_that(index.root.files).contains('y')
+    assert_that(index.pathOf('y', includeSelf=True)).is_equal_to('Y')
+
+
+def test_sources_write_what_is_left_on_cleanup() -> None:
+    source = MemorySource()
+    _library(source)
+    index = RemarkableIndex(source, writeBehind=True)
+
+    index.rename('x', 'X1')
+    source.cleanup()
+
+    assert_that(source.items['x']['metadata']['visibleName']).is_equal_to('X1')
+
+
+def test_the_writer_thread_ends_when_idle() -> None:
+    source = MemorySource()
+    writes = WriteBehind(source, delay=0, idle=0.01)
+
+    writes.store({}, 'x.metadata')
+    thread = writes._thread
+    writes.flush()
+    thread.join(5)
+
+    assert_that(thread.daemon).is_false()
+    assert_that(thread.is_alive()).is_false()
+    assert_that(writes._thread).is_none()
+    assert_that(source.items['x']['metadata']).is_equal_to({})